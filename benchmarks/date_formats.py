@@ -0,0 +1,109 @@
+"""Benchmark the compiled date/time matcher used by ``slugify_camel_iso`` against the previous pendulum loop.
+
+Run it with::
+
+    python benchmarks/date_formats.py --count 1000000
+
+Both paths are applied to the date-like chunks of a synthetic corpus of file names,
+and the results are compared to make sure the output is identical.
+"""
+
+import random
+from timeit import default_timer
+from typing import List, Optional
+
+import click
+import pendulum
+from slugify import slugify
+
+from clib.rename import POSSIBLE_FORMATS, REGEX_DATE_TIME, SLUG_SEPARATOR, format_date_time, slugify_camel_iso
+
+WORDS = ("WhatsApp", "Image", "IMG", "scan", "Rechnung", "visa", "DSC", "holiday", "Bancários", "p2p")
+SEPARATORS = ("_", " ", "-", ".", "")
+
+
+def pendulum_format_date_time(text: str, next_ten_years: int) -> Optional[str]:
+    """Previous implementation: try all possible formats with ``pendulum.from_format()``, catching errors."""
+    actual_date = None
+    which_format = "YYYY-MM-DD"
+    for date_format in POSSIBLE_FORMATS:
+        if len(text) != len(date_format):
+            continue
+        try:
+            actual_date = pendulum.from_format(text, date_format)
+            if "YYYY" not in date_format and actual_date.year > next_ten_years:
+                actual_date = actual_date.subtract(years=100)
+            if "HH" in date_format:
+                which_format = "YYYY-MM-DDTHH-mm-ss"
+            elif "DD" not in date_format:
+                which_format = "YYYY-MM"
+            break
+        except ValueError:
+            continue
+    return actual_date.format(which_format) if actual_date else None
+
+
+def random_date_chunk(rand: random.Random) -> str:
+    """Create a random date-like chunk from one of the possible formats, valid or not."""
+    date_format = rand.choice(POSSIBLE_FORMATS)
+    separator = rand.choice(SEPARATORS)
+    chunk = date_format
+    for token, upper in (("YYYY", 2100), ("YY", 99), ("MM", 13), ("DD", 32), ("HH", 24), ("mm", 60), ("ss", 60)):
+        value = rand.randint(0, upper)
+        chunk = chunk.replace(token, f"{value:0{len(token)}d}"[-len(token) :])
+    return chunk.replace("_", separator)
+
+
+def synthetic_names(count: int, seed: int) -> List[str]:
+    """Create a synthetic corpus of file names with words and dates."""
+    rand = random.Random(seed)
+    return [
+        f"{rand.choice(WORDS)} {random_date_chunk(rand)} {rand.choice(WORDS)}{rand.randint(0, 999)}"
+        for _ in range(count)
+    ]
+
+
+def measure(label: str, function, chunks: List[str], next_ten_years: int) -> List[Optional[str]]:
+    """Apply a function to all chunks and display the elapsed time."""
+    start = default_timer()
+    results = [function(chunk, next_ten_years) for chunk in chunks]
+    elapsed = default_timer() - start
+    click.echo(f"{label:>10}: {elapsed:8.2f}s ({len(chunks) / elapsed:,.0f} dates/s)")
+    return results
+
+
+@click.command()
+@click.option("--count", "-c", default=1_000_000, help="Number of synthetic file names")
+@click.option("--seed", "-s", default=42, help="Random seed for the synthetic corpus")
+@click.option("--full", is_flag=True, default=False, help="Also measure the full slugify_camel_iso() call")
+def main(count: int, seed: int, full: bool):
+    """Compare the old and new date/time paths on a synthetic corpus of file names."""
+    names = synthetic_names(count, seed)
+    chunks = [
+        match.group(0) for name in names for match in REGEX_DATE_TIME.finditer(slugify(name, separator=SLUG_SEPARATOR))
+    ]
+    click.echo(f"{len(names):,} names, {len(chunks):,} date-like chunks")
+
+    next_ten_years = pendulum.today().year + 10
+    old = measure("pendulum", pendulum_format_date_time, chunks, next_ten_years)
+    new = measure("compiled", format_date_time, chunks, next_ten_years)
+
+    differences = [
+        (chunk, old_value, new_value) for chunk, old_value, new_value in zip(chunks, old, new) if old_value != new_value
+    ]
+    for chunk, old_value, new_value in differences[:10]:
+        click.secho(f"{chunk!r}: pendulum={old_value!r} compiled={new_value!r}", fg="red")
+    if differences:
+        raise click.ClickException(f"{len(differences)} different results")
+    click.secho("Identical results", fg="green")
+
+    if full:
+        start = default_timer()
+        for name in names:
+            slugify_camel_iso(name)
+        elapsed = default_timer() - start
+        click.echo(f"{'slugify':>10}: {elapsed:8.2f}s ({len(names) / elapsed:,.0f} names/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""Benchmark the index of ``docker-find yml`` against a linear scan of the JSON list of yml files.
+
+Run it with::
+
+    python benchmarks/yml_lookup.py --count 20000
+
+Each lookup reads the files from disk, like a ``docker-find yml`` run does.
+The results are compared, to make sure both ways find the same files with the same ranking.
+"""
+
+import random
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from timeit import default_timer
+from typing import Callable, List
+
+import click
+
+from clib.config import JsonConfig
+from clib.docker import YML_FILE_PATTERNS, YmlIndex, best_is_unique, save_yml_files, score_yml_file
+
+WORDS = ("api", "web", "worker", "db", "proxy", "rapid", "apis", "billing", "search", "auth", "infra", "legacy")
+
+
+def linear_lookup(partial_name: str, files_config: JsonConfig) -> List[str]:
+    """Previous implementation: parse the whole JSON list, then rank the files that contain the partial name."""
+    found = [file for file in files_config.load_set() if partial_name in file]
+    return sorted(found, key=lambda file: score_yml_file(file, partial_name), reverse=True)
+
+
+def index_lookup(partial_name: str, index: YmlIndex) -> List[str]:
+    """Same lookup as ``docker-find yml``: prefix matches first, then all the substrings if no match is the best."""
+    found = index.prefix_matches(partial_name)
+    if best_is_unique(found, partial_name):
+        return found
+    return index.search(partial_name)
+
+
+def synthetic_files(count: int, seed: int) -> List[str]:
+    """Create a synthetic list of yml files, in project trees of different depths."""
+    rand = random.Random(seed)
+    return sorted(
+        {
+            "/".join(
+                [
+                    "",
+                    "home",
+                    "user",
+                    f"project{rand.randrange(count // 4)}",
+                    *rand.choices(WORDS, k=rand.randint(0, 3)),
+                    rand.choice(YML_FILE_PATTERNS),
+                ]
+            )
+            for _ in range(count)
+        }
+    )
+
+
+def measure(function: Callable[[], List[str]], repeat: int) -> float:
+    """Return the average time of a lookup in milliseconds."""
+    start = default_timer()
+    for _ in range(repeat):
+        function()
+    return (default_timer() - start) / repeat * 1000
+
+
+@click.command()
+@click.option("--count", "-c", default=20000, help="Number of synthetic yml files")
+@click.option("--seed", "-s", default=42, help="Random seed for the synthetic files")
+@click.option("--repeat", "-r", default=20, help="Lookups of each partial name")
+def main(count: int, seed: int, repeat: int):
+    """Compare the lookup time and the size on disk of the JSON list and of the index."""
+    files = synthetic_files(count, seed)
+    with TemporaryDirectory() as temp_dir:
+        files_config = JsonConfig(Path(temp_dir) / "files.json")
+        save_yml_files(files, files_config)
+        index = YmlIndex(files_config)
+        click.echo(
+            f"{len(files):,} files: list {files_config.full_path.stat().st_size:,} bytes,"
+            f" index {index.path.stat().st_size:,} bytes"
+        )
+
+        for partial_name in ("project123", "project12", "worker/db", "roject1", "nothing"):
+            linear = linear_lookup(partial_name, files_config)
+            indexed = index_lookup(partial_name, index)
+            if best_is_unique(linear, partial_name):
+                # The best match is chosen without the others
+                same = indexed[:1] == linear[:1]
+            else:
+                # Ties in the ranking can be in any order, since both ways go through sets
+                scores = [[score_yml_file(file, partial_name) for file in found] for found in (linear, indexed)]
+                same = sorted(linear) == sorted(indexed) and scores[0] == scores[1]
+            if not same:
+                raise click.ClickException(f"{partial_name!r}: different results")
+            linear_elapsed = measure(lambda: linear_lookup(partial_name, files_config), repeat)
+            index_elapsed = measure(lambda: index_lookup(partial_name, index), repeat)
+            click.echo(
+                f"{partial_name:>10}: {len(linear):5,} found, linear {linear_elapsed:7.2f}ms,"
+                f" index {index_elapsed:7.2f}ms"
+            )
+    click.secho("Identical results", fg="green")
+
+
+if __name__ == "__main__":
+    main()
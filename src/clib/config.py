@@ -28,11 +28,20 @@ class JsonConfig:
         """Load file data as a set."""
         return set(self._generic_load(set()))
 
-    def dump(self, new_data):
-        """Dump new JSON data in the config file."""
+    def load_dict(self) -> dict:
+        """Load file data as a dict."""
+        data = self._generic_load({})
+        return data if isinstance(data, dict) else {}
+
+    def dump(self, new_data, compact: bool = False):
+        """Dump new JSON data in the config file.
+
+        :param compact: Don't add whitespace after separators; useful for big cache files.
+        """
         if isinstance(new_data, set):
             new_data = list(new_data)
-        self.full_path.write_text(json.dumps(new_data))
+        separators = (",", ":") if compact else None
+        self.full_path.write_text(json.dumps(new_data, separators=separators))
 
 
 def cast_to_directory_list(check_existing: bool = True):
@@ -6,9 +6,11 @@ from subprocess import PIPE
 from typing import List, Optional
 
 from clib.docker import DockerContainer
-from clib.files import existing_directory_type, existing_file_type, shell
+from clib.files import existing_directory_type, existing_file_type, shell, shell_many, which
 
 POSTGRES_DOCKER_CONTAINER_NAME = "postgres12"
+# One dump at a time by default: more load the server, and password prompts would share the terminal
+BACKUP_JOBS = 1
 
 
 class DatabaseServer:
@@ -58,12 +60,12 @@ class PostgreSQLServer(DatabaseServer):
         """Determine which psql executable exists on this machine."""
         super().__init__(*args, **kwargs)
 
-        self.psql = shell("which psql", quiet=True, return_lines=True)[0]
+        self.psql = which("psql")
         if not self.psql:
             self.psql = "psql_docker"
             self.inside_docker = True
 
-        self.pg_dump = shell("which pg_dump", quiet=True, return_lines=True)[0]
+        self.pg_dump = which("pg_dump")
         if not self.pg_dump:
             self.pg_dump = "pg_dump_docker"
             self.inside_docker = True
@@ -93,13 +95,15 @@ def backup(parser, args):
     """Backup PostgreSQL databases."""
     pg = PostgreSQLServer(args.server_uri).list_databases()
     container = DockerContainer(POSTGRES_DOCKER_CONTAINER_NAME)
+    commands = []
     for database in pg.databases:
         sql_file: Path = Path(args.backup_dir) / f"{pg.protocol}_{pg.server}_{pg.port}" / f"{database}.sql"
         sql_file.parent.mkdir(parents=True, exist_ok=True)
 
         if pg.inside_docker:
             sql_file = container.replace_mount_dir(sql_file)
-        shell(f"{pg.pg_dump} --clean --create --if-exists --file={sql_file} {pg.docker_uri}/{database}")
+        commands.append(f"{pg.pg_dump} --clean --create --if-exists --file={sql_file} {pg.docker_uri}/{database}")
+    shell_many(commands, jobs=args.jobs)
 
 
 def restore(parser, args):
@@ -129,6 +133,13 @@ def postgresx():
 
     parser_backup = subparsers.add_parser("backup", help="backup a PostgreSQL database to a SQL file")
     parser_backup.add_argument("backup_dir", type=existing_directory_type, help="directory to store the backups")
+    parser_backup.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=BACKUP_JOBS,
+        help=f"number of databases dumped at the same time (default: {BACKUP_JOBS})",
+    )
     parser_backup.set_defaults(chosen_function=backup)
 
     parser_restore = subparsers.add_parser("restore", help="restore a PostgreSQL database from a SQL file")
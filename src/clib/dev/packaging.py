@@ -8,7 +8,7 @@ from typing import List, Optional, Tuple
 import click
 
 from clib import dry_run_option, verbose_option
-from clib.files import shell
+from clib.files import shell, which
 from clib.ui import prompt
 
 HeaderCommand = Tuple[str, str]
@@ -122,8 +122,7 @@ class Publisher:
         """Check if all needed tools and files are present."""
         all_ok = True
         for executable, help_text in self.NEEDED_TOOLS.items():
-            output = shell(f"which {executable}", quiet=True, return_lines=True)
-            if not output:
+            if not which(executable):
                 click.secho(f"Executable not found on the $PATH: {executable}. {help_text}", fg="bright_red")
                 all_ok = False
 
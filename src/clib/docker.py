@@ -1,58 +1,281 @@
 """Docker module."""
 
 import argparse
+import fcntl
+import hashlib
 import json
+import mmap
+import os
+import re
+import stat
+import tarfile
+import zlib
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from datetime import datetime
+from fnmatch import fnmatchcase
 from pathlib import Path
-from subprocess import PIPE
-from typing import List
+from shlex import quote
+from subprocess import PIPE, Popen
+from tempfile import NamedTemporaryFile, TemporaryFile
+from time import monotonic, time
+from typing import IO, Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple, Union
 
 from clib.config import JsonConfig
-from clib.files import existing_directory_type, existing_file_type, shell, shell_find
+from clib.files import (
+    COPY_CHUNK_SIZE,
+    Inotify,
+    InotifyEvent,
+    existing_directory_type,
+    existing_file_type,
+    find_paths,
+    fzf,
+    human_size,
+    shell,
+    which,
+)
 from clib.types import JsonDict
 
 YML_DIRS = JsonConfig("docker-find-yml-dirs.json")
 YML_FILES = JsonConfig("docker-find-yml-files.json")
+YML_CACHE = JsonConfig("docker-find-yml-cache.json")
+YML_FILE_PATTERNS = ["docker-compose.yml", "docker-compose.yaml", "docker-compose.*.yml", "compose.yml", "compose.yaml"]
+SCAN_JOBS = 8
+INSPECT_CACHE = JsonConfig("docker-inspect-cache.json")
+SHORT_ID_LENGTH = 12
+REGEX_HEX = re.compile("[0-9a-f]+")
+COMPRESS_GZIP = "gzip"
+COMPRESS_ZSTD = "zstd"
+COMPRESS_NONE = "none"
+BACKUP_EXTENSIONS = {COMPRESS_GZIP: ".tgz", COMPRESS_ZSTD: ".tar.zst", COMPRESS_NONE: ".tar"}
+BACKUP_JOBS = 4
+VOLUME_TAR_COMMAND = ["docker", "run", "--rm", "-v", "/var/lib/docker/volumes:/volumes:ro", "busybox", "tar", "cf", "-"]
+# The names to archive are read from stdin
+VOLUME_TAR_NAMES_COMMAND = "docker run --rm -i -v /var/lib/docker/volumes:/volumes:ro busybox tar cf - -T -".split()
+VOLUME_LIST_COMMAND = ["docker", "run", "--rm", "-v", "/var/lib/docker/volumes:/volumes:ro", "busybox", "find"]
+VOLUME_STAT_FORMAT = "%f %u %g %s %Y %h %U %G %n"
+SNAPSHOT_DIR = "snapshots"
+SNAPSHOT_CHUNK_SIZE = 4 * 1024 * 1024
+
+
+class ContainerCache:
+    """Metadata of Docker containers, shared by the whole process.
+
+    Containers are inspected in batches, with a single ``docker inspect`` call.
+    With a TTL, the metadata is also saved in a cache file and reused by other processes for that many seconds.
+    """
+
+    def __init__(self, ttl: Optional[float] = None, config: Optional[JsonConfig] = None) -> None:
+        self._ttl = ttl
+        self.config = config or INSPECT_CACHE
+        self.containers: Dict[str, JsonDict] = {}
+        self.mount_tables: Dict[str, Dict[str, str]] = {}
+
+    @property
+    def ttl(self) -> float:
+        """Seconds to reuse the cache file; by default, the ``DOCKER_INSPECT_TTL`` environment variable."""
+        if self._ttl is None:
+            # Import locally, so we get an error only when the TTL is needed, and not when this module is imported
+            from clib.environments import DOCKER_INSPECT_TTL
+
+            self._ttl = DOCKER_INSPECT_TTL
+        return self._ttl
+
+    def inspect(self, *names: str) -> List[JsonDict]:
+        """Return the metadata of containers, inspecting the ones that are not cached yet.
+
+        :raise LookupError: If a container doesn't exist.
+        """
+        missing = [name for name in dict.fromkeys(names) if name not in self.containers]
+        if missing and self.ttl:
+            now = time()
+            for name, cached in self.config.load_dict().items():
+                if name in missing and now - cached["time"] < self.ttl:
+                    self.containers[name] = cached["info"]
+            missing = [name for name in missing if name not in self.containers]
+        if missing:
+            self._inspect_batch(missing)
+        return [self.containers[name] for name in names]
+
+    def _inspect_batch(self, names: List[str]) -> None:
+        """Inspect containers with one ``docker`` call."""
+        # Docker still prints the containers that exist, when some of them don't
+        output = shell(f"docker inspect {' '.join(quote(name) for name in names)}", quiet=True, capture_output=True)
+        infos: List[JsonDict] = json.loads(output.stdout or "[]")
+        for name in names:
+            for info in infos:
+                if container_matches(info, name):
+                    self.containers[name] = info
+                    break
+            else:
+                raise LookupError(f"Docker container not found: {name}. {output.stderr.strip()}".strip())
+
+        if self.ttl:
+            now = time()
+            cached = {name: value for name, value in self.config.load_dict().items() if now - value["time"] < self.ttl}
+            cached.update({name: {"time": now, "info": self.containers[name]} for name in names})
+            self.config.dump(cached, compact=True)
+
+    def mount_table(self, name: str) -> Dict[str, str]:
+        """Return the mounts of a container, as a dict of source dirs (on the host) to destination dirs."""
+        if name not in self.mount_tables:
+            mounts = self.inspect(name)[0].get("Mounts") or []
+            self.mount_tables[name] = {
+                os.path.normpath(mount["Source"]): mount["Destination"] for mount in mounts if mount.get("Source")
+            }
+        return self.mount_tables[name]
+
+
+CONTAINERS = ContainerCache()
+
+
+def container_matches(info: JsonDict, name: str) -> bool:
+    """Check if the inspected metadata belongs to a container given by name or ID, like ``docker inspect`` does.
+
+    An ID prefix only matches when it's at least as long as the short IDs displayed by ``docker ps``,
+    so a container name doesn't match the ID of another container that happens to start with it.
+
+    >>> info = {"Name": "/db", "Id": "d3adbeef0123456789abcdef"}
+    >>> container_matches(info, "db"), container_matches(info, "d3adbeef0123"), container_matches(info, "d3ad")
+    (True, True, False)
+    """
+    if info.get("Name", "").lstrip("/") == name or info.get("Id") == name:
+        return True
+    return (
+        len(name) >= SHORT_ID_LENGTH and REGEX_HEX.fullmatch(name) is not None and info.get("Id", "").startswith(name)
+    )
 
 
 class DockerContainer:
     """A helper for Docker containers."""
 
-    def __init__(self, container_name: str) -> None:
+    def __init__(self, container_name: str, cache: Optional[ContainerCache] = None) -> None:
         """Init instance."""
         self.container_name = container_name
+        self.cache = cache or CONTAINERS
         self.inspect_json: List[JsonDict] = []
 
     def inspect(self) -> "DockerContainer":
         """Inspect a Docker container and save its JSON info."""
         if not self.inspect_json:
-            raw_info = shell(f"docker inspect {self.container_name}", quiet=True, capture_output=True).stdout
-            self.inspect_json = json.loads(raw_info)
+            self.inspect_json = self.cache.inspect(self.container_name)
         return self
 
     def replace_mount_dir(self, path: Path) -> Path:
-        """Replace a mounted dir on a file/dir path inside a Docker container."""
-        self.inspect()
-        for mount in self.inspect_json[0]["Mounts"]:
-            source = mount["Source"]
-            if str(path).startswith(source):
-                new_path = str(path).replace(source, mount["Destination"])
-                return Path(new_path)
+        """Replace a mounted dir on a file/dir path inside a Docker container.
+
+        The longest mounted dir that contains the path is used; a mounted dir only matches whole path components.
+        """
+        mounts = self.cache.mount_table(self.container_name)
+        path = Path(os.path.normpath(path))
+        for parent in (path, *path.parents):
+            destination = mounts.get(str(parent))
+            if destination is not None:
+                return Path(destination) / path.relative_to(parent)
         return path
 
 
-def rescan_files(dirs):
-    """Rescan all directories and save the yml files that were found."""
+def is_yml_file(name: str) -> bool:
+    """Check if a file name is a Docker Compose file.
+
+    >>> [is_yml_file(name) for name in ("docker-compose.yml", "docker-compose.override.yml", "compose.yaml")]
+    [True, True, True]
+    >>> [is_yml_file(name) for name in ("docker-compose.yml.bak", "other.yml")]
+    [False, False]
+    """
+    return any(fnmatchcase(name, pattern) for pattern in YML_FILE_PATTERNS)
+
+
+def is_inside(path: str, root: str) -> bool:
+    """Check if a path is inside a directory.
+
+    >>> is_inside("/data/docker-compose.yml", "/data"), is_inside("/database/docker-compose.yml", "/data")
+    (True, False)
+    """
+    return path.startswith(os.path.join(root, ""))
+
+
+def scan_yml_dir(root: str, cache: Dict[str, Any]) -> Dict[str, Any]:
+    """Scan a directory tree for yml files.
+
+    Adding, removing or renaming an entry changes the mtime of its directory.
+    So a subdirectory with the same mtime as the cached one is not scanned again;
+    its cached subdirectories and yml files are used instead.
+
+    :param cache: Cached tree of a previous scan, as returned by this function.
+    :return: ``[mtime_ns, subdirectory names, yml file names]`` for each directory of the tree.
+    """
+    tree: Dict[str, Any] = {}
+    pending = [root]
+    while pending:
+        directory = pending.pop()
+        try:
+            mtime = os.stat(directory).st_mtime_ns
+        except OSError:
+            continue
+        cached = cache.get(directory)
+        if cached and cached[0] == mtime:
+            _, subdirs, files = cached
+        else:
+            subdirs, files = [], []
+            try:
+                with os.scandir(directory) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            subdirs.append(entry.name)
+                        elif is_yml_file(entry.name):
+                            files.append(entry.name)
+            except OSError:
+                continue
+        tree[directory] = [mtime, subdirs, files]
+        pending.extend(os.path.join(directory, subdir) for subdir in subdirs)
+    return tree
+
+
+def tree_files(tree: Dict[str, Any]) -> List[str]:
+    """Return the full paths of the yml files in a tree returned by ``scan_yml_dir()``."""
+    return sorted(os.path.join(directory, file) for directory, (_, _, files) in tree.items() for file in files)
+
+
+def rescan_files(dirs: Iterable[str], scan_dirs: Optional[Iterable[str]] = None, jobs: int = SCAN_JOBS) -> None:
+    """Save the directories, scan them in parallel and save the yml files that were found.
+
+    The tree of each directory is cached as soon as it's scanned, so an interrupted rescan can be resumed
+    without scanning again the directories that didn't change.
+
+    :param scan_dirs: Only scan these directories, keeping the files found before in the other ones.
+        By default, all directories are scanned.
+    """
     sorted_dirs = sorted(dirs)
     YML_DIRS.dump(sorted_dirs)
 
-    files = set()
-    for dir in sorted_dirs:
+    cached_trees = YML_CACHE.load_dict()
+    trees = {dir: cached_trees[dir] for dir in sorted_dirs if dir in cached_trees}
+    to_scan = sorted_dirs if scan_dirs is None else sorted(set(scan_dirs))
+    if scan_dirs is None:
+        files = set()
+    else:
+        # Keep files of the other directories, including the ones added by "docker-find watch"
+        files = {
+            file
+            for file in YML_FILES.load_set()
+            if any(is_inside(file, dir) for dir in sorted_dirs) and not any(is_inside(file, dir) for dir in to_scan)
+        }
+
+    with ThreadPoolExecutor(max(jobs, 1), thread_name_prefix="scan") as executor:
+        futures = {executor.submit(scan_yml_dir, dir, trees.get(dir, {})): dir for dir in to_scan}
+        for future in as_completed(futures):
+            trees[futures[future]] = future.result()
+            YML_CACHE.dump(trees, compact=True)
+
+    for dir in to_scan:
         print(f"Files on {dir}")
-        for file in shell_find(f"{dir} -name docker-compose.yml"):
+        for file in tree_files(trees[dir]):
             print(f"  {file}")
-            files.add(str(file))
-    sorted_files = sorted(files)
-    YML_FILES.dump(sorted_files)
+            files.add(file)
+    YML_CACHE.dump(trees, compact=True)
+    save_yml_files(files)
 
 
 def scan_command(parser, args):
@@ -63,7 +286,7 @@ def scan_command(parser, args):
     for dir in args.dir:
         dirs.add(str(dir))
         print(f"Directory added: {dir}")
-    rescan_files(dirs)
+    rescan_files(dirs, [str(dir) for dir in args.dir] if args.dir else None, args.jobs)
 
 
 def rm_command(parser, args):
@@ -76,7 +299,165 @@ def rm_command(parser, args):
             print(f"Directory removed: {one_dir}")
         else:
             print(f"Directory was not configured: {one_dir}")
-    rescan_files(dirs)
+    rescan_files(dirs, scan_dirs=[])
+
+
+def score_yml_file(file: str, partial_name: str) -> Tuple[int, int, int]:
+    """Score a match: a directory or file named exactly as the partial name is better than a prefix,
+    which is better than any substring; then the deepest match, then the shortest path.
+
+    >>> score_yml_file("/code/api/docker-compose.yml", "api") > score_yml_file("/code/apis/docker-compose.yml", "api")
+    True
+    >>> score_yml_file("/code/apis/docker-compose.yml", "api") > score_yml_file("/code/rapid/docker-compose.yml", "api")
+    True
+    """
+    parts = file.split("/")
+    best = (0, 0)
+    for depth, part in enumerate(parts):
+        if part == partial_name:
+            best = max(best, (3, depth))
+        elif part.startswith(partial_name):
+            best = max(best, (2, depth))
+        elif partial_name in part:
+            best = max(best, (1, depth))
+    return best[0], best[1], -len(file)
+
+
+def best_is_unique(found: List[str], partial_name: str) -> bool:
+    """Check if the first of the ranked files is a better kind of match than all the others.
+
+    >>> best_is_unique(["/code/api/compose.yml", "/code/apis/compose.yml"], "api")
+    True
+    >>> best_is_unique(["/a/api/compose.yml", "/b/api/compose.yml"], "api"), best_is_unique([], "api")
+    (False, False)
+    """
+    if len(found) < 2:
+        return bool(found)
+    return score_yml_file(found[0], partial_name)[0] > score_yml_file(found[1], partial_name)[0]
+
+
+class YmlIndex:
+    """Path components of the yml files, stored next to their JSON file to find them by partial name.
+
+    The index has two sections, after a first line with the size of the first one:
+    each distinct component, sorted, followed by the offsets of the files that have it (``component<TAB>1,42``);
+    then the paths of the files, one per line.
+    The file is read with ``mmap``, so a lookup doesn't parse the whole list: components that start with the
+    partial name are found with a binary search, other substrings with ``bytes.find()`` on the components,
+    and only a partial name with a slash is searched in the paths.
+    The index is rebuilt when it's older than the JSON file.
+    """
+
+    def __init__(self, files_config: Optional[JsonConfig] = None) -> None:
+        self.files_config = files_config or YML_FILES
+        path = self.files_config.full_path
+        self.path = path.with_name(f"{path.stem}-index.txt")
+
+    def build(self, files: Iterable[str]) -> "YmlIndex":
+        """Build the index and save it."""
+        paths: List[bytes] = []
+        offsets: Dict[bytes, List[str]] = defaultdict(list)
+        size = 0
+        # Tabs and line breaks are the separators of the index; such paths can only be found by "docker-find ls"
+        for file in sorted(set(files)):
+            if "\t" in file or "\n" in file:
+                continue
+            for component in {part.encode() for part in file.split("/") if part}:
+                offsets[component].append(str(size))
+            paths.append(file.encode() + b"\n")
+            size += len(paths[-1])
+        components = b"".join(
+            component + b"\t" + ",".join(offsets[component]).encode() + b"\n" for component in sorted(offsets)
+        )
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with NamedTemporaryFile(dir=self.path.parent, prefix=".", delete=False) as temp_file:
+            temp_file.write(f"{len(components)}\n".encode())
+            temp_file.write(components)
+            temp_file.writelines(paths)
+        os.replace(temp_file.name, self.path)
+        return self
+
+    @contextmanager
+    def _mapped(self) -> Iterator[Tuple[Union[mmap.mmap, bytes], int, int]]:
+        """Map the index in memory, rebuilding it first if the yml files changed since it was built.
+
+        :return: the data, the start of the components and the start of the paths
+        """
+        try:
+            stale = self.path.stat().st_mtime_ns < self.files_config.full_path.stat().st_mtime_ns
+        except FileNotFoundError:
+            stale = True
+        if stale:
+            self.build(self.files_config.load_set())
+        with open(self.path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            header_end = data.find(b"\n") + 1
+            yield data, header_end, header_end + int(data[: header_end - 1])
+
+    @staticmethod
+    def _lines(data: Union[mmap.mmap, bytes], key: bytes, start: int, end: int) -> Iterator[Tuple[int, int]]:
+        """Find the start and end of each line that contains the key, between two offsets."""
+        position = data.find(key, start, end)
+        while position >= 0:
+            line_start = max(data.rfind(b"\n", start, position) + 1, start)
+            line_end = data.find(b"\n", position)
+            yield line_start, line_end
+            position = data.find(key, line_end + 1, end)
+
+    @staticmethod
+    def _files(data: Union[mmap.mmap, bytes], paths_start: int, offsets: bytes) -> Iterator[str]:
+        """Read the files at these comma-separated offsets of the paths."""
+        for offset in offsets.split(b","):
+            start = paths_start + int(offset)
+            yield data[start : data.find(b"\n", start)].decode()
+
+    def prefix_matches(self, partial_name: str) -> List[str]:
+        """Find the yml files with a directory or file name that starts with the partial name, the best first."""
+        key = partial_name.encode()
+        found: Set[str] = set()
+        with self._mapped() as (data, low, high):
+            paths_start = high
+            # Binary search of the first component that is not lower than the key
+            while low < high:
+                start = max(data.rfind(b"\n", low, (low + high) // 2) + 1, low)
+                end = data.find(b"\n", start)
+                if data[start : data.find(b"\t", start, end)] < key:
+                    low = end + 1
+                else:
+                    high = start
+            while low < paths_start:
+                end = data.find(b"\n", low)
+                component, offsets = data[low:end].split(b"\t", 1)
+                if not component.startswith(key):
+                    break
+                found.update(self._files(data, paths_start, offsets))
+                low = end + 1
+        return sorted(found, key=lambda file: score_yml_file(file, partial_name), reverse=True)
+
+    def search(self, partial_name: str) -> List[str]:
+        """Find the yml files that contain a partial name, the best matches first."""
+        if "\t" in partial_name or "\n" in partial_name:
+            return []
+        key = partial_name.encode()
+        found: Set[str] = set()
+        with self._mapped() as (data, components_start, paths_start):
+            if "/" in partial_name:
+                # It can span components: search the whole paths
+                found.update(data[start:end].decode() for start, end in self._lines(data, key, paths_start, len(data)))
+            else:
+                for start, end in self._lines(data, key, components_start, paths_start):
+                    component, offsets = data[start:end].split(b"\t", 1)
+                    # The key can also be found in the offsets
+                    if key in component:
+                        found.update(self._files(data, paths_start, offsets))
+        return sorted(found, key=lambda file: score_yml_file(file, partial_name), reverse=True)
+
+
+def save_yml_files(files: Iterable[str], files_config: Optional[JsonConfig] = None) -> None:
+    """Save the yml files and their index."""
+    config = files_config or YML_FILES
+    sorted_files = sorted(files)
+    config.dump(sorted_files)
+    YmlIndex(config).build(sorted_files)
 
 
 def ls_command(parser, args):
@@ -86,31 +467,177 @@ def ls_command(parser, args):
 
 
 def yml_command(parser, args):
-    """Run a docker-compose command on one of the yml files."""
-    found = set()
-    partial_name = args.yml_file
+    """Run a docker-compose command on one of the yml files.
 
-    for file in YML_FILES.load_set():
-        if partial_name in file:
-            found.add(file)
+    If one file is a better match than all the others, it's chosen without asking.
+    """
+    partial_name = args.yml_file
+    index = YmlIndex()
+    # Matches on a name prefix always rank above other substrings: if one of them is the best, it's enough
+    found = index.prefix_matches(partial_name)
+    if args.choose or not best_is_unique(found, partial_name):
+        found = index.search(partial_name)
     if not found:
         print(f"No .yml file was found with the string '{partial_name}'")
         exit(1)
 
-    sorted_found = sorted(found)
-    if len(sorted_found) > 1:
-        choices = "\n".join(sorted_found)
-        chosen_yml = shell(
-            f"echo '{choices}' | fzf --height={len(sorted_found) + 2} --cycle --tac", quiet=True, stdout=PIPE
-        ).stdout.strip()
+    if best_is_unique(found, partial_name) and not args.choose:
+        chosen_yml = found[0]
+    else:
+        # The same picker as before (--cycle --tac): the last items are shown first, so the best matches go last
+        chosen_yml = fzf(reversed(found), reverse=True, height=str(len(found) + 2), layout=["--cycle"])
         if not chosen_yml:
             print("No .yml file was chosen")
             exit(2)
-    else:
-        chosen_yml = sorted_found[0]
     shell(f"docker-compose -f {chosen_yml} {' '.join(args.docker_compose_arg)}")
 
 
+class YmlWatcher:
+    """Keep the index of yml files up to date with inotify, watching all the registered directories.
+
+    The list of registered directories is also watched, so directories added by ``scan`` or removed by ``rm``
+    are picked up without restarting the watcher.
+    """
+
+    DIR_MASK = (
+        Inotify.IN_CREATE
+        | Inotify.IN_DELETE
+        | Inotify.IN_MOVED_FROM
+        | Inotify.IN_MOVED_TO
+        | Inotify.IN_DELETE_SELF
+        | Inotify.IN_MOVE_SELF
+        | Inotify.IN_ONLYDIR
+    )
+    CONFIG_MASK = Inotify.IN_CLOSE_WRITE | Inotify.IN_MOVED_TO | Inotify.IN_ONLYDIR
+
+    def __init__(
+        self, inotify: Inotify, dirs_config: Optional[JsonConfig] = None, files_config: Optional[JsonConfig] = None
+    ) -> None:
+        self.inotify = inotify
+        self.dirs_config = dirs_config or YML_DIRS
+        self.files_config = files_config or YML_FILES
+        self.roots: Set[str] = set()
+        self.files: Set[str] = set()
+        self.watches: Dict[int, str] = {}
+        self.config_wd = inotify.add_watch(self.dirs_config.full_path.parent, self.CONFIG_MASK)
+
+    def start(self) -> "YmlWatcher":
+        """Watch the registered directories and save a fresh index."""
+        self.reload_dirs()
+        self.save()
+        return self
+
+    def save(self) -> None:
+        """Save the index of yml files."""
+        save_yml_files(self.files, self.files_config)
+
+    def reload_dirs(self) -> None:
+        """Watch directories that were registered, and forget the ones that were removed."""
+        roots = {os.path.abspath(root) for root in self.dirs_config.load_set()}
+        for root in self.roots - roots:
+            print(f"Directory removed: {root}")
+            self.forget(root)
+        for root in sorted(roots - self.roots):
+            print(f"Watching {root}")
+            self.watch_tree(root)
+        self.roots = roots
+
+    def watch_tree(self, root: str) -> None:
+        """Watch a directory and its subdirectories, and add the yml files inside them to the index.
+
+        Directories are watched before they are scanned, so files created meanwhile are not missed.
+        """
+        for directory in [root, *find_paths(root, type_="d")]:
+            try:
+                self.watches[self.inotify.add_watch(directory, self.DIR_MASK)] = directory
+            except (FileNotFoundError, NotADirectoryError, PermissionError):
+                continue
+        for file in find_paths(root, name=YML_FILE_PATTERNS):
+            self.add_file(file)
+
+    def forget(self, root: str) -> None:
+        """Stop watching a directory tree, and remove its yml files from the index."""
+        prefix = os.path.join(root, "")
+        for wd, directory in list(self.watches.items()):
+            if directory == root or directory.startswith(prefix):
+                del self.watches[wd]
+                self.inotify.rm_watch(wd)
+        for file in [file for file in self.files if file.startswith(prefix)]:
+            self.remove_file(file)
+
+    def add_file(self, file: str) -> None:
+        """Add a yml file to the index."""
+        if file not in self.files:
+            self.files.add(file)
+            print(f"  + {file}")
+
+    def remove_file(self, file: str) -> None:
+        """Remove a yml file from the index."""
+        if file in self.files:
+            self.files.remove(file)
+            print(f"  - {file}")
+
+    def handle(self, event: InotifyEvent) -> bool:
+        """Update the index with an event.
+
+        :return: True if the index changed.
+        """
+        before = set(self.files)
+        if event.mask & Inotify.IN_Q_OVERFLOW:
+            print("Too many events: rescanning all directories")
+            for root in self.roots:
+                self.forget(root)
+                self.watch_tree(root)
+        elif event.wd == self.config_wd:
+            if event.name == self.dirs_config.full_path.name:
+                self.reload_dirs()
+        elif event.mask & Inotify.IN_IGNORED:
+            self.watches.pop(event.wd, None)
+        elif event.wd in self.watches:
+            directory = self.watches[event.wd]
+            path = os.path.join(directory, event.name)
+            created = event.mask & (Inotify.IN_CREATE | Inotify.IN_MOVED_TO)
+            if event.mask & (Inotify.IN_DELETE_SELF | Inotify.IN_MOVE_SELF):
+                self.forget(directory)
+            elif event.mask & Inotify.IN_ISDIR:
+                if created:
+                    self.watch_tree(path)
+                else:
+                    self.forget(path)
+            elif is_yml_file(event.name):
+                if created:
+                    self.add_file(path)
+                else:
+                    self.remove_file(path)
+        return self.files != before
+
+    def run(self, timeout: Optional[float] = None) -> None:
+        """Handle events and save the index when it changes.
+
+        :param timeout: Stop when there are no events for this number of seconds; wait forever if None.
+        """
+        while True:
+            events = self.inotify.read_events(timeout)
+            if not events:
+                return
+            changed = False
+            for event in events:
+                changed = self.handle(event) or changed
+            if changed:
+                self.save()
+
+
+def watch_command(parser, args):
+    """Watch the registered directories and keep the index of yml files up to date."""
+    with Inotify() as inotify:
+        watcher = YmlWatcher(inotify).start()
+        print(f"{len(watcher.files)} yml files in {len(watcher.watches)} watched directories. Press Ctrl-C to stop")
+        try:
+            watcher.run()
+        except KeyboardInterrupt:
+            pass
+
+
 # TODO: Convert to click
 def docker_find():
     """Find docker.compose.yml files."""
@@ -118,19 +645,30 @@ def docker_find():
     parser.set_defaults(chosen_function=None)
     subparsers = parser.add_subparsers(title="commands")
 
-    parser_scan = subparsers.add_parser("scan", help="scan directories and add them to the list")
+    parser_scan = subparsers.add_parser(
+        "scan", help="scan new directories and add them to the list, or rescan all directories if none is given"
+    )
     parser_scan.add_argument("dir", nargs="*", help="directory to scan", type=existing_directory_type)
+    parser_scan.add_argument(
+        "-j", "--jobs", type=int, default=SCAN_JOBS, help=f"directories scanned at the same time (default: {SCAN_JOBS})"
+    )
     parser_scan.set_defaults(chosen_function=scan_command)
 
     parser_rm = subparsers.add_parser("rm", help="remove directories from the list")
     parser_rm.add_argument("dir", nargs="+", help="directory to remove", type=existing_directory_type)
     parser_rm.set_defaults(chosen_function=rm_command)
 
+    parser_watch = subparsers.add_parser("watch", help="watch the directories and keep the list of yml files updated")
+    parser_watch.set_defaults(chosen_function=watch_command)
+
     parser_ls = subparsers.add_parser("ls", help="list yml files")
     parser_ls.set_defaults(chosen_function=ls_command)
 
     parser_yml = subparsers.add_parser("yml", help="choose one of the yml files to call docker-compose on")
     parser_yml.add_argument("yml_file", help="partial name of the desired .yml file")
+    parser_yml.add_argument(
+        "-c", "--choose", action="store_true", help="choose the file with fzf, even if one file is the best match"
+    )
     parser_yml.add_argument("docker_compose_arg", nargs=argparse.REMAINDER, help="docker-compose arguments")
     parser_yml.set_defaults(chosen_function=yml_command)
 
@@ -142,25 +680,150 @@ def docker_find():
     return
 
 
-def backup(parser, args):
-    """Backup a Docker volume."""
-    for volume in args.volume_name:
-        # TODO: when piping from stdin, stdout is printed only at the end (buffered)
-        shell(
-            "docker run --rm -i -v /var/lib/docker/volumes:/volumes -v {dir}:/backup busybox "
-            "tar czf /backup/{volume}.tgz /volumes/{volume}".format(dir=args.backup_dir, volume=volume)
+def compressor_command(compress: str) -> List[str]:
+    """Return the command line of a compressor that reads from stdin, preferring multi-threaded ones."""
+    if compress == COMPRESS_ZSTD:
+        return ["zstd", "-T0", "-q", "-c"]
+    if compress == COMPRESS_GZIP:
+        return ["pigz", "-c"] if which("pigz") else ["gzip", "-c"]
+    return []
+
+
+def decompressor_command(compress: str) -> List[str]:
+    """Return the command line of a decompressor that writes to stdout, preferring multi-threaded ones."""
+    if compress == COMPRESS_ZSTD:
+        return ["zstd", "-d", "-q", "-c"]
+    if compress == COMPRESS_GZIP:
+        return ["pigz", "-d", "-c"] if which("pigz") else ["gzip", "-d", "-c"]
+    return []
+
+
+def split_backup_name(file: Path) -> Tuple[str, str]:
+    """Split the name of a backup file in the volume name and the compression, from the extension.
+
+    >>> split_backup_name(Path("/backup/pg.tgz")), split_backup_name(Path("pg.data.tar.zst"))
+    (('pg', 'gzip'), ('pg.data', 'zstd'))
+    >>> split_backup_name(Path("pg.tar"))
+    ('pg', 'none')
+    """
+    # Longest extensions first, so ".tar.zst" is not taken for ".tar"
+    for compress, extension in sorted(BACKUP_EXTENSIONS.items(), key=lambda item: len(item[1]), reverse=True):
+        if file.name.endswith(extension) and len(file.name) > len(extension):
+            return file.name[: -len(extension)], compress
+    raise ValueError(f"Unknown backup extension: {file.name}; use one of {', '.join(BACKUP_EXTENSIONS.values())}")
+
+
+class VolumeBackup:
+    """Numbers of a volume backup."""
+
+    def __init__(self, volume: str, file: Path) -> None:
+        self.volume = volume
+        self.file = file
+        self.tar_bytes = 0
+        self.file_bytes = 0
+        self.elapsed = 0.0
+        self.error = ""
+
+    def __str__(self) -> str:
+        """Display the sizes, the compression ratio and the throughput."""
+        if self.error:
+            return f"{self.volume}: failed, {self.error}"
+        ratio = self.file_bytes / self.tar_bytes if self.tar_bytes else 1
+        rate = self.tar_bytes / max(self.elapsed, 1e-9)
+        return (
+            f"{self.volume}: {human_size(self.tar_bytes)} -> {human_size(self.file_bytes)} ({ratio:.0%})"
+            f" in {self.elapsed:.1f}s ({human_size(rate)}/s) {self.file}"
         )
 
 
+def backup_volume(volume: str, backup_dir: Path, compress: str) -> VolumeBackup:
+    """Backup a Docker volume, streaming the tar archive from the container to a compressor on the host.
+
+    The archive is written to a temporary file, which is renamed only when the backup succeeded.
+    """
+    result = VolumeBackup(volume, backup_dir / f"{volume}{BACKUP_EXTENSIONS[compress]}")
+    partial_file = result.file.with_name(f"{result.file.name}.partial")
+    command = compressor_command(compress)
+    if command and not which(command[0]):
+        result.error = f"{command[0]} was not found on the PATH"
+        return result
+
+    start = monotonic()
+    docker: Optional[Popen] = None
+    compressor: Optional[Popen] = None
+    try:
+        # Errors go to a temporary file: a full stderr pipe would block tar, while stdout is being read
+        with open(partial_file, "wb") as output, TemporaryFile() as errors:
+            docker = Popen([*VOLUME_TAR_COMMAND, f"/volumes/{volume}"], stdout=PIPE, stderr=errors)
+            compressor = Popen(command, stdin=PIPE, stdout=output) if command else None
+            destination = compressor.stdin if compressor else output
+            assert docker.stdout is not None and destination is not None
+            try:
+                for chunk in iter(lambda: docker.stdout.read(COPY_CHUNK_SIZE), b""):  # type: ignore
+                    result.tar_bytes += len(chunk)
+                    destination.write(chunk)
+            except BrokenPipeError:
+                result.error = f"{command[0]} stopped reading the archive"
+                docker.kill()
+            finally:
+                docker.stdout.close()
+                if compressor:
+                    try:
+                        destination.close()
+                    except BrokenPipeError:
+                        pass
+            if docker.wait():
+                errors.seek(0)
+                message = errors.read().decode(errors="replace").strip()
+                result.error = result.error or f"docker exited with code {docker.returncode}: {message}"
+            if compressor and compressor.wait():
+                result.error = result.error or f"{command[0]} exited with code {compressor.returncode}"
+    except OSError as error:
+        # The disk is full, or the compressor couldn't start: don't leave the processes behind
+        result.error = result.error or str(error)
+        for process in (docker, compressor):
+            if process:
+                process.kill()
+                process.wait()
+    result.elapsed = monotonic() - start
+
+    if result.error:
+        partial_file.unlink(missing_ok=True)
+    else:
+        partial_file.replace(result.file)
+        result.file_bytes = result.file.stat().st_size
+    return result
+
+
+def backup(parser, args):
+    """Backup Docker volumes in parallel."""
+    with ThreadPoolExecutor(max(args.jobs, 1), thread_name_prefix="backup") as executor:
+        futures = [
+            executor.submit(backup_volume, volume, Path(args.backup_dir), args.compress) for volume in args.volume_name
+        ]
+        results = []
+        for future in as_completed(futures):
+            results.append(future.result())
+            print(results[-1])
+
+    if len(results) > 1:
+        tar_bytes = sum(result.tar_bytes for result in results)
+        file_bytes = sum(result.file_bytes for result in results)
+        print(f"Total: {human_size(tar_bytes)} -> {human_size(file_bytes)} in {len(results)} volumes")
+    if any(result.error for result in results):
+        exit(1)
+
+
 def restore(parser, args):
-    """Restore a Docker volume."""
-    tgz_file: Path = args.tgz_file
-    backup_dir = tgz_file.parent
-    new_volume_name = args.volume_name if args.volume_name else tgz_file.stem
+    """Restore a Docker volume, streaming the backup from a decompressor on the host to the container."""
+    backup_file: Path = args.backup_file
+    try:
+        volume_name, compress = split_backup_name(backup_file)
+    except ValueError as error:
+        parser.error(str(error))
+    new_volume_name = args.volume_name if args.volume_name else volume_name
 
-    busybox = "docker run --rm -i -v /var/lib/docker:/docker -v {backup_dir}:/backup busybox ".format(
-        backup_dir=backup_dir
-    )
+    busybox = "docker run --rm -i -v /var/lib/docker:/docker busybox "
 
     # Delete the destination directory before restoring
     shell(busybox + f"rm -rf /docker/volumes/{new_volume_name}")
@@ -168,13 +831,474 @@ def restore(parser, args):
     # Create the full path
     shell(busybox + f"mkdir /docker/volumes/{new_volume_name}")
 
-    # Restore the .tgz file in the new empty directory
-    shell(
-        busybox
-        + "tar xzf /backup/{tgz} -C /docker/volumes/{new_volume_name}/ --strip-components 2".format(
-            tgz=tgz_file.name, new_volume_name=new_volume_name
+    # Extract the archive in the new empty directory
+    command = busybox + f"tar xf - -C /docker/volumes/{new_volume_name}/ --strip-components 2"
+    decompress = decompressor_command(compress)
+    with open(backup_file, "rb") as input_file:
+        if decompress:
+            print(f"$ {' '.join(decompress)} < {backup_file} | {command}")
+            decompressor: Optional[Popen] = Popen(decompress, stdin=input_file, stdout=PIPE)
+            assert decompressor and decompressor.stdout is not None
+            docker = Popen(command.split(), stdin=decompressor.stdout)
+            # Only docker reads the pipe now, so the decompressor gets a broken pipe if docker exits early
+            decompressor.stdout.close()
+        else:
+            print(f"$ {command} < {backup_file}")
+            decompressor = None
+            docker = Popen(command.split(), stdin=input_file)
+        if docker.wait():
+            print(f"docker exited with code {docker.returncode}")
+            exit(docker.returncode)
+        if decompressor and decompressor.wait():
+            print(f"{decompress[0]} exited with code {decompressor.returncode}")
+            exit(decompressor.returncode)
+
+
+class ChunkStore:
+    """Content-addressed chunks of volume snapshots, and the manifests that reference them.
+
+    Chunks are compressed with zlib and named after the BLAKE2 hash of their contents, so a chunk is stored once,
+    no matter how many files or snapshots have it.
+    """
+
+    def __init__(self, backup_dir: Path) -> None:
+        self.root = Path(backup_dir) / SNAPSHOT_DIR
+        self.chunks_dir = self.root / "chunks"
+        self.manifests_dir = self.root / "manifests"
+
+    @classmethod
+    def from_manifest(cls, manifest_file: Path) -> "ChunkStore":
+        """Return the store of a manifest."""
+        return cls(manifest_file.parents[3])
+
+    @contextmanager
+    def lock(self, exclusive: bool = False) -> Iterator[None]:
+        """Lock the store with a lock file: snapshots share the lock, while gc needs it alone.
+
+        The lock is released when the file is closed, even if the process is killed.
+        """
+        self.root.mkdir(parents=True, exist_ok=True)
+        with open(self.root / ".lock", "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+            yield
+
+    def chunk_path(self, digest: str) -> Path:
+        """Return the path of a chunk, inside a subdirectory named after the first characters of its hash."""
+        return self.chunks_dir / digest[:2] / digest
+
+    def add(self, data: bytes) -> Tuple[str, int]:
+        """Store a chunk, if it's not stored yet.
+
+        :return: Hash of the chunk, and the number of bytes written (zero if the chunk already existed).
+        """
+        digest = hashlib.blake2b(data, digest_size=20).hexdigest()
+        path = self.chunk_path(digest)
+        if path.exists():
+            return digest, 0
+        path.parent.mkdir(parents=True, exist_ok=True)
+        compressed = zlib.compress(data)
+        # Write to a temporary file, so an interrupted snapshot doesn't leave a truncated chunk
+        with NamedTemporaryFile(dir=path.parent, prefix=".", delete=False) as temp_file:
+            temp_file.write(compressed)
+        os.replace(temp_file.name, path)
+        return digest, len(compressed)
+
+    def read(self, digest: str) -> bytes:
+        """Read a chunk."""
+        return zlib.decompress(self.chunk_path(digest).read_bytes())
+
+    def missing_chunks(self, entries: List[JsonDict]) -> List[str]:
+        """Return the chunks of the entries of a manifest that are not in the store."""
+        return sorted(
+            {digest for entry in entries for digest in entry.get("chunks", []) if not self.chunk_path(digest).exists()}
         )
-    )
+
+    def latest_manifest(self, volume: str) -> Optional[JsonDict]:
+        """Return the latest manifest of a volume, if there is one."""
+        paths = sorted((self.manifests_dir / volume).glob("*.json"))
+        return json.loads(paths[-1].read_text()) if paths else None
+
+    def new_manifest_path(self, volume: str) -> Path:
+        """Return the path of a new manifest for a volume, named after the current time."""
+        return self.manifests_dir / volume / f"{datetime.now().strftime('%Y%m%d-%H%M%S-%f')}.json"
+
+    def manifests(self) -> Iterator[Path]:
+        """Return the paths of all the manifests."""
+        return self.manifests_dir.glob("*/*.json")
+
+    def gc(self, dry_run: bool = False) -> Tuple[int, int]:
+        """Remove chunks that are not referenced by any manifest.
+
+        The chunks of a snapshot are not referenced until its manifest is written,
+        so this waits for the snapshots being taken, and new ones wait until it's done.
+
+        :return: Number of removed chunks, and their size.
+        """
+        with self.lock(exclusive=True):
+            referenced = set()
+            for manifest in self.manifests():
+                for entry in json.loads(manifest.read_text())["entries"]:
+                    referenced.update(entry.get("chunks", []))
+            removed = removed_bytes = 0
+            for path in self.chunks_dir.glob("*/*"):
+                if path.name in referenced:
+                    continue
+                removed += 1
+                removed_bytes += path.stat().st_size
+                if not dry_run:
+                    path.unlink()
+        return removed, removed_bytes
+
+
+class ChunkReader:
+    """Read a file from its chunks, as a file object for ``tarfile``."""
+
+    def __init__(self, store: ChunkStore, chunks: List[str]) -> None:
+        self.store = store
+        self.chunks = iter(chunks)
+        self.chunk = b""
+        self.offset = 0
+
+    def read(self, size: int = -1) -> bytes:
+        """Read bytes from the chunks, loading one chunk at a time."""
+        parts = []
+        while size != 0:
+            if self.offset >= len(self.chunk):
+                digest = next(self.chunks, None)
+                if digest is None:
+                    break
+                self.chunk, self.offset = self.store.read(digest), 0
+            end = len(self.chunk) if size < 0 else min(len(self.chunk), self.offset + size)
+            parts.append(self.chunk[self.offset : end])
+            if size > 0:
+                size -= end - self.offset
+            self.offset = end
+        return b"".join(parts)
+
+
+class VolumeSnapshot:
+    """Numbers of a volume snapshot."""
+
+    def __init__(self, volume: str) -> None:
+        self.volume = volume
+        self.manifest: Optional[Path] = None
+        self.entries = 0
+        self.unchanged = 0
+        self.read_bytes = 0
+        self.chunks = 0
+        self.new_chunks = 0
+        self.new_bytes = 0
+        self.elapsed = 0.0
+        self.error = ""
+
+    def __str__(self) -> str:
+        """Display how much was read, and how much was new."""
+        if self.error:
+            return f"{self.volume}: failed, {self.error}"
+        return (
+            f"{self.volume}: {self.entries} entries, {human_size(self.read_bytes)} read"
+            f" ({self.unchanged} unchanged files skipped);"
+            f" {self.new_chunks} of {self.chunks} chunks were new ({human_size(self.new_bytes)} stored)"
+            f" in {self.elapsed:.1f}s {self.manifest}"
+        )
+
+
+def snapshot_entry_name(name: str, volume: str) -> Optional[str]:
+    """Return the name of an archive member relative to its volume, "." for the volume itself.
+
+    >>> snapshot_entry_name("volumes/pg", "pg"), snapshot_entry_name("volumes/pg/_data/a", "pg")
+    ('.', '_data/a')
+    >>> print(snapshot_entry_name("volumes/pg2/_data", "pg"))
+    None
+    """
+    root = f"volumes/{volume}"
+    name = name.rstrip("/")
+    if name == root:
+        return "."
+    if name.startswith(f"{root}/"):
+        return name[len(root) + 1 :]
+    return None
+
+
+def docker_failure(docker: Popen, errors: IO[bytes]) -> str:
+    """Describe a failed docker command, with the errors it wrote."""
+    errors.seek(0)
+    message = errors.read().decode(errors="replace").strip()
+    return f"docker exited with code {docker.returncode}: {message}"
+
+
+def read_snapshot_archive(
+    volume: str, store: ChunkStore, result: VolumeSnapshot, names: Optional[List[str]] = None
+) -> Dict[str, JsonDict]:
+    """Stream a tar archive of a volume from the container, storing the chunks of its files.
+
+    :param names: only archive these entries of the volume, instead of the whole volume
+    :return: the entries of the archive by name, in the archive order
+    """
+    entries: Dict[str, JsonDict] = {}
+    # Errors go to a temporary file: a full stderr pipe would block tar, while stdout is being read
+    with TemporaryFile() as errors, TemporaryFile() as names_file:
+        if names is None:
+            docker = Popen([*VOLUME_TAR_COMMAND, f"/volumes/{volume}"], stdout=PIPE, stderr=errors)
+        else:
+            names_file.writelines(os.fsencode(f"/volumes/{volume}/{name}\n") for name in names)
+            names_file.seek(0)
+            docker = Popen(VOLUME_TAR_NAMES_COMMAND, stdin=names_file, stdout=PIPE, stderr=errors)
+        assert docker.stdout is not None
+        try:
+            with tarfile.open(fileobj=docker.stdout, mode="r|") as archive:
+                for member in archive:
+                    name = snapshot_entry_name(member.name, volume)
+                    if name is None:
+                        continue
+                    entry = {
+                        "name": name,
+                        "type": member.type.decode(),
+                        "mode": member.mode,
+                        "uid": member.uid,
+                        "gid": member.gid,
+                        "uname": member.uname,
+                        "gname": member.gname,
+                        # Whole seconds, like the listing; a PAX archive can have fractions
+                        "mtime": int(member.mtime),
+                    }
+                    if member.issym() or member.islnk():
+                        link = member.linkname
+                        entry["linkname"] = (member.islnk() and snapshot_entry_name(link, volume)) or link
+                    elif member.ischr() or member.isblk():
+                        entry.update(devmajor=member.devmajor, devminor=member.devminor)
+                    elif member.isreg():
+                        entry["size"] = member.size
+                        entry["chunks"] = chunks = []
+                        file = archive.extractfile(member)
+                        assert file is not None
+                        for data in iter(lambda: file.read(SNAPSHOT_CHUNK_SIZE), b""):  # type: ignore
+                            digest, written = store.add(data)
+                            chunks.append(digest)
+                            result.read_bytes += len(data)
+                            result.new_bytes += written
+                            result.new_chunks += 1 if written else 0
+                        result.chunks += len(chunks)
+                    entries[name] = entry
+            # Read the padding after the end of the archive, so tar doesn't fail with a broken pipe
+            for _ in iter(lambda: docker.stdout.read(COPY_CHUNK_SIZE), b""):  # type: ignore
+                pass
+        except tarfile.TarError as error:
+            result.error = f"invalid archive: {error}"
+            docker.kill()
+        except OSError as error:
+            # The chunks couldn't be written, e.g. the disk is full
+            result.error = str(error)
+            docker.kill()
+        finally:
+            docker.stdout.close()
+        if docker.wait():
+            result.error = result.error or docker_failure(docker, errors)
+    return entries
+
+
+def list_volume(volume: str, result: VolumeSnapshot) -> Optional[List[JsonDict]]:
+    """List the entries of a volume with their metadata, without reading the files.
+
+    :return: the entries, parents first; None if the listing can't be parsed (e.g. a name with a line break),
+        or if docker failed (the error is set on the result)
+    """
+    with TemporaryFile() as errors:
+        docker = Popen(
+            [*VOLUME_LIST_COMMAND, f"/volumes/{volume}", "-exec", "stat", "-c", VOLUME_STAT_FORMAT, "{}", "+"],
+            stdout=PIPE,
+            stderr=errors,
+        )
+        output = docker.communicate()[0]
+        if docker.returncode:
+            result.error = docker_failure(docker, errors)
+            return None
+    entries = []
+    for line in os.fsdecode(output).splitlines():
+        # The name goes last, since it can have spaces
+        fields = line.split(" ", 8)
+        try:
+            raw_mode = int(fields[0], 16)
+            uid, gid, size, mtime, links = (int(field) for field in fields[1:6])
+            uname, gname, path = fields[6:]
+        except ValueError:
+            return None
+        name = snapshot_entry_name(path.lstrip("/"), volume)
+        if name is None:
+            return None
+        if stat.S_ISDIR(raw_mode):
+            entry_type = tarfile.DIRTYPE
+        elif stat.S_ISREG(raw_mode):
+            entry_type = tarfile.REGTYPE
+        else:
+            # Links and devices are read from the archive
+            entry_type = b""
+        entries.append(
+            {
+                "name": name,
+                "type": entry_type.decode(),
+                "mode": stat.S_IMODE(raw_mode),
+                "uid": uid,
+                "gid": gid,
+                # Users and groups that are unknown in the container have no name in the archive either
+                "uname": "" if uname == "UNKNOWN" else uname,
+                "gname": "" if gname == "UNKNOWN" else gname,
+                "mtime": mtime,
+                "size": size,
+                "links": links,
+            }
+        )
+    return entries
+
+
+def snapshot_changed_files(
+    volume: str, store: ChunkStore, previous: JsonDict, result: VolumeSnapshot
+) -> Optional[List[JsonDict]]:
+    """Read only the files that changed since the previous snapshot; reuse the chunks of the others.
+
+    A regular file is unchanged if its size and modification time are the ones of the previous snapshot, and it was
+    last modified before that snapshot started (a file written during the same second could have changed after it).
+    Directories are rebuilt from the listing; other entries, and files with hard links, are read from the archive.
+
+    :return: the entries, or None if the volume can't be listed this way
+    """
+    listing = list_volume(volume, result)
+    if listing is None:
+        return None
+    started = int(previous.get("started", 0))
+    previous_files = {entry["name"]: entry for entry in previous["entries"] if "chunks" in entry}
+    known: Dict[str, JsonDict] = {}
+    changed = []
+    for entry in listing:
+        old = previous_files.get(entry["name"])
+        size, links = entry.pop("size"), entry.pop("links")
+        if entry["type"] == tarfile.DIRTYPE.decode():
+            known[entry["name"]] = entry
+        elif (
+            entry["type"] == tarfile.REGTYPE.decode()
+            and links == 1
+            and old
+            and (old["size"], old["mtime"]) == (size, entry["mtime"])
+            and entry["mtime"] < started
+            and not store.missing_chunks([old])
+        ):
+            known[entry["name"]] = {**entry, "size": size, "chunks": old["chunks"]}
+            result.unchanged += 1
+            result.chunks += len(old["chunks"])
+        else:
+            changed.append(entry["name"])
+    archived = read_snapshot_archive(volume, store, result, changed) if changed else {}
+    entries = [known.get(entry["name"]) or archived.get(entry["name"]) for entry in listing]
+    # Hard links go last, after the files they link to
+    return [entry for entry in entries if entry and entry["type"] != tarfile.LNKTYPE.decode()] + [
+        entry for entry in entries if entry and entry["type"] == tarfile.LNKTYPE.decode()
+    ]
+
+
+def snapshot_volume(volume: str, store: ChunkStore) -> VolumeSnapshot:
+    """Take an incremental snapshot of a Docker volume.
+
+    The contents of each file are split in fixed size chunks, and only the chunks that are not in the store yet are
+    written. The manifest lists the entries of the volume with their metadata and chunks; it's written last, only
+    when the snapshot succeeded.
+    The first snapshot streams the tar archive of the whole volume from the container. The next ones list the volume
+    first, and only stream the files that changed since the latest snapshot: the others reuse its chunks.
+    """
+    result = VolumeSnapshot(volume)
+    start = monotonic()
+    # Chunks are not referenced until the manifest is written: keep gc from removing them until then
+    with store.lock():
+        started = time()
+        previous = store.latest_manifest(volume)
+        entries = snapshot_changed_files(volume, store, previous, result) if previous else None
+        if entries is None and not result.error:
+            entries = list(read_snapshot_archive(volume, store, result).values())
+        result.elapsed = monotonic() - start
+        if result.error or entries is None:
+            return result
+
+        result.entries = len(entries)
+        result.manifest = store.new_manifest_path(volume)
+        result.manifest.parent.mkdir(parents=True, exist_ok=True)
+        manifest = {
+            "volume": volume,
+            "created": datetime.now().isoformat(timespec="seconds"),
+            "started": started,
+            "entries": entries,
+        }
+        result.manifest.write_text(json.dumps(manifest, separators=(",", ":")))
+    return result
+
+
+def write_snapshot_archive(store: ChunkStore, entries: List[JsonDict], output: IO[bytes]) -> None:
+    """Write a tar archive of a snapshot, reading the files from their chunks."""
+    with tarfile.open(fileobj=output, mode="w|", format=tarfile.GNU_FORMAT) as archive:
+        for entry in entries:
+            info = tarfile.TarInfo(entry["name"])
+            info.type = entry["type"].encode()
+            info.mode = entry["mode"]
+            info.uid, info.gid = entry["uid"], entry["gid"]
+            info.uname, info.gname = entry["uname"], entry["gname"]
+            info.mtime = entry["mtime"]
+            info.linkname = entry.get("linkname", "")
+            info.devmajor, info.devminor = entry.get("devmajor", 0), entry.get("devminor", 0)
+            if "chunks" in entry:
+                info.size = entry["size"]
+                archive.addfile(info, ChunkReader(store, entry["chunks"]))  # type: ignore
+            else:
+                archive.addfile(info)
+
+
+def snapshot(parser, args):
+    """Take incremental snapshots of Docker volumes, in parallel."""
+    store = ChunkStore(args.backup_dir)
+    with ThreadPoolExecutor(max(args.jobs, 1), thread_name_prefix="snapshot") as executor:
+        futures = [executor.submit(snapshot_volume, volume, store) for volume in args.volume_name]
+        results = []
+        for future in as_completed(futures):
+            results.append(future.result())
+            print(results[-1])
+    if any(result.error for result in results):
+        exit(1)
+
+
+def snapshot_restore(parser, args):
+    """Restore a Docker volume from a snapshot manifest."""
+    manifest_file: Path = args.manifest_file
+    manifest = json.loads(manifest_file.read_text())
+    store = ChunkStore.from_manifest(manifest_file)
+    new_volume_name = args.volume_name or manifest["volume"]
+
+    # Check the chunks before deleting anything: an incomplete snapshot would leave the volume half restored
+    missing = store.missing_chunks(manifest["entries"])
+    if missing:
+        print(
+            f"{len(missing)} chunks of {manifest_file} are missing from {store.chunks_dir}; the volume was not changed"
+        )
+        exit(1)
+
+    busybox = "docker run --rm -i -v /var/lib/docker:/docker busybox "
+    shell(busybox + f"rm -rf /docker/volumes/{new_volume_name}")
+    shell(busybox + f"mkdir /docker/volumes/{new_volume_name}")
+
+    command = busybox + f"tar xf - -C /docker/volumes/{new_volume_name}/"
+    print(f"$ {command} < {manifest_file}")
+    docker = Popen(command.split(), stdin=PIPE)
+    assert docker.stdin is not None
+    try:
+        write_snapshot_archive(store, manifest["entries"], docker.stdin)
+    finally:
+        docker.stdin.close()
+    if docker.wait():
+        print(f"docker exited with code {docker.returncode}")
+        exit(docker.returncode)
+
+
+def snapshot_gc(parser, args):
+    """Remove chunks that are not referenced by any snapshot manifest."""
+    removed, removed_bytes = ChunkStore(args.backup_dir).gc(args.dry_run)
+    prefix = "[dry-run] " if args.dry_run else ""
+    print(f"{prefix}{removed} unreferenced chunks removed ({human_size(removed_bytes)})")
 
 
 # TODO: Convert to click
@@ -190,13 +1314,61 @@ def docker_volume():
     parser_backup = subparsers.add_parser("backup", aliases=["b"], help="backup a Docker volume")
     parser_backup.add_argument("backup_dir", type=existing_directory_type, help="directory to store the backups")
     parser_backup.add_argument("volume_name", nargs="+", help="Docker volume name")
+    parser_backup.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=BACKUP_JOBS,
+        help=f"number of volumes backed up at the same time (default: {BACKUP_JOBS})",
+    )
+    parser_backup.add_argument(
+        "-c",
+        "--compress",
+        choices=list(BACKUP_EXTENSIONS),
+        default=COMPRESS_GZIP,
+        help=f"compressor run on the host (default: {COMPRESS_GZIP})",
+    )
     parser_backup.set_defaults(chosen_function=backup)
 
+    parser_snapshot = subparsers.add_parser(
+        "snapshot", aliases=["s"], help="take an incremental snapshot of a Docker volume, storing only new chunks"
+    )
+    parser_snapshot.add_argument("backup_dir", type=existing_directory_type, help="directory to store the snapshots")
+    parser_snapshot.add_argument("volume_name", nargs="+", help="Docker volume name")
+    parser_snapshot.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=BACKUP_JOBS,
+        help=f"number of volumes read at the same time (default: {BACKUP_JOBS})",
+    )
+    parser_snapshot.set_defaults(chosen_function=snapshot)
+
+    parser_snapshot_restore = subparsers.add_parser("snapshot-restore", help="restore a Docker volume from a snapshot")
+    parser_snapshot_restore.add_argument(
+        "manifest_file",
+        type=existing_file_type,
+        help="full path of the .json manifest created by the 'snapshot' command",
+    )
+    parser_snapshot_restore.add_argument("volume_name", nargs="?", help="volume name (default: the snapshot volume)")
+    parser_snapshot_restore.set_defaults(chosen_function=snapshot_restore)
+
+    parser_snapshot_gc = subparsers.add_parser("snapshot-gc", help="remove chunks not used by any snapshot")
+    parser_snapshot_gc.add_argument("backup_dir", type=existing_directory_type, help="directory with the snapshots")
+    parser_snapshot_gc.add_argument(
+        "-n", "--dry-run", action="store_true", help="only show what would be removed, without removing anything"
+    )
+    parser_snapshot_gc.set_defaults(chosen_function=snapshot_gc)
+
     parser_restore = subparsers.add_parser("restore", aliases=["r"], help="restore a Docker volume")
     parser_restore.add_argument(
-        "tgz_file", type=existing_file_type, help="full path of the .tgz file created by the 'backup' command"
+        "backup_file",
+        type=existing_file_type,
+        help=f"full path of the {', '.join(BACKUP_EXTENSIONS.values())} file created by the 'backup' command",
+    )
+    parser_restore.add_argument(
+        "volume_name", nargs="?", help="volume name (default: name of the backup file, without the extension)"
     )
-    parser_restore.add_argument("volume_name", nargs="?", help="volume name (default: basename of .tgz file)")
     parser_restore.set_defaults(chosen_function=restore)
 
     args = parser.parse_args()
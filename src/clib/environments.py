@@ -14,3 +14,4 @@ RSYNC_EXCLUDE: List[str] = config(
 )
 BACKUP_DIRS: List[str] = config("BACKUP_DIRS", cast=cast_to_directory_list(), default="")
 PICTURE_DIRS: List[str] = config("PICTURE_DIRS", cast=cast_to_directory_list(), default="")
+DOCKER_INSPECT_TTL: int = config("DOCKER_INSPECT_TTL", cast=int, default="0")
@@ -1,66 +1,937 @@
 """Files, symbolic links, operating system utilities."""
 
+import asyncio
+import ctypes
+import errno
+import hashlib
+import json
 import os
+import re
+import select
+import shutil
+import stat
+import struct
 import sys
+import threading
 from argparse import ArgumentTypeError
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import datetime
+from fnmatch import fnmatchcase
 from pathlib import Path
-from shlex import split
-from subprocess import PIPE, run
-from time import sleep
-from typing import Any, List, Optional
+from shlex import quote, split
+from subprocess import PIPE, STDOUT, CalledProcessError, CompletedProcess, Popen, run
+from time import monotonic
+from typing import Any, Callable, Dict, Iterable, Iterator, List, NamedTuple, Optional, Sequence, Set, Tuple, Union
 
 import click
-from plumbum import FG
 
 from clib import dry_run_option
+from clib.config import CONFIG_DIR, JsonConfig
+from clib.constants import COLOR_CHANGED
+from clib.types import PathOrStr
 from clib.ui import echo_dry_run
 
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+# Errors raised when a zero-copy system call is not supported for these files; the next method is tried
+ZERO_COPY_UNSUPPORTED = {errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP, errno.ENOTSOCK, errno.EBADF}
+ZERO_COPY_CALLS: List[Callable[[int, int, int, int], int]] = []
+if hasattr(os, "copy_file_range"):
+    ZERO_COPY_CALLS.append(lambda src_fd, dst_fd, offset, count: os.copy_file_range(src_fd, dst_fd, count, offset))
+if hasattr(os, "sendfile"):
+    ZERO_COPY_CALLS.append(lambda src_fd, dst_fd, offset, count: os.sendfile(dst_fd, src_fd, offset, count))
 
-def sync_dir(source_dirs: List[str], destination_dirs: List[str], dry_run: bool = False, kill: bool = False):
-    """Synchronize a source directory with a destination."""
-    # Import locally, so we get an error only in this function, and not in other functions of this module.
-    from plumbum.cmd import rsync
+ENGINE_RSYNC = "rsync"
+ENGINE_NATIVE = "native"
+# Same as rsync's --modify-window=2, for file systems with a 2-second resolution (FAT)
+MODIFY_WINDOW = 2
+SYNC_TEMP_SUFFIX = ".clib-sync"
+PROGRESS_INTERVAL = 5.0
+REGEX_LINE_END = re.compile(rb"(?<=[\r\n])")
+REGEX_RSYNC_SENT = re.compile(r"^sent (?P<sent>[\d.,]+[KMGT]?) bytes")
+REGEX_RSYNC_PROGRESS = re.compile(
+    r"^\s*(?P<bytes>[\d.,]+[KMGT]?)\s+(?P<percent>\d+)%\s+\S+\s+[\d:]+(?: \(xfr#(?P<xfr>\d+))?"
+)
+REGEX_RSYNC_DELETING = re.compile(r"^deleting ")
+SYNC_METRICS_LOG = CONFIG_DIR / "sync-metrics.jsonl"
+METRICS_LOCK = threading.Lock()
+RSYNC_UNITS = {"K": 1000, "M": 1000**2, "G": 1000**3, "T": 1000**4}
 
+BACKUP_MANIFEST = JsonConfig("backup-manifest.json")
+RSYNC_WILDCARDS = set("*?[\\")
+
+SHELL_MANY_JOBS = 8
+WAIT_POLL_INTERVAL = 0.5
+FZF_LAYOUT = ("--reverse", "--inline-info", "--cycle")
+EXECUTABLE_CACHE = JsonConfig("executables.json")
+
+HASH_CACHE = JsonConfig("file-hashes.json")
+HASH_CACHE_MAX_SIZE = 500_000
+HASH_BLOCK_SIZE = 64 * 1024
+
+
+def sync_dir(
+    source_dirs: List[str],
+    destination_dirs: List[str],
+    dry_run: bool = False,
+    kill: bool = False,
+    engine: str = ENGINE_RSYNC,
+    jobs: int = 4,
+    parallel: bool = False,
+    max_parallel: int = 0,
+    full: bool = False,
+):
+    """Synchronize a source directory with a destination.
+
+    :param engine: ``rsync`` runs rsync processes; ``native`` copies files in process with ``jobs`` threads.
+    :param parallel: Sync destinations at the same time, with a summary per destination at the end.
+        The native engine always syncs destinations in parallel.
+    :param max_parallel: Maximum number of destinations synced at the same time (default: all of them).
+    :param full: Sync all subdirectories, ignoring the backup manifest of the previous run.
+    """
     from clib.environments import RSYNC_EXCLUDE
 
-    for dest_dir in destination_dirs:
-        if not dest_dir:
-            continue
+    manifest = BackupManifest() if full else BackupManifest().load()
+    destinations = [dest_dir for dest_dir in destination_dirs if dest_dir]
+    if engine == ENGINE_NATIVE or parallel:
+        if not destinations:
+            return
+        with ThreadPoolExecutor(max_parallel or len(destinations), thread_name_prefix="sync") as executor:
+            futures = {
+                dest_dir: executor.submit(
+                    sync_destination, source_dirs, dest_dir, RSYNC_EXCLUDE, dry_run, kill, engine, jobs, manifest
+                )
+                for dest_dir in destinations
+            }
+            summaries = {dest_dir: future.result() for dest_dir, future in futures.items()}
+        if not dry_run:
+            manifest.save()
+
+        click.secho("\nSummary per destination", bold=True, fg="green")
+        for dest_dir, stats in summaries.items():
+            status = "[dry-run] " if dry_run else ""
+            if not stats.succeeded:
+                status += "[FAILED] "
+            click.secho(f"{dest_dir}: {status}{stats}", fg=COLOR_CHANGED if stats.succeeded else "red")
+        failed = [dest_dir for dest_dir, stats in summaries.items() if not stats.succeeded]
+        if failed:
+            raise click.ClickException(f"Sync failed for {len(failed)} destination(s): {', '.join(failed)}")
+        return
+
+    failed = []
+    for dest_dir in destinations:
         for src_dir in source_dirs:
             if not src_dir:
                 continue
-            # Remove the user home and concatenate the source after the destination
-            full_dest_dir = os.path.join(dest_dir, src_dir.replace(os.path.expanduser("~"), "")[1:])
-
-            rsync_args = "{dry_run}{kill}-trOlhDuzv --modify-window=2 --progress {exclude} {src}/ {dest}/".format(
-                dry_run="-n " if dry_run else "",
-                kill="--del " if kill else "",
-                exclude=" ".join([f"--exclude={e}" for e in RSYNC_EXCLUDE]),
-                src=src_dir,
-                dest=full_dest_dir,
-            )
+            full_dest_dir = backup_destination(src_dir, dest_dir)
+            unchanged = manifest.unchanged_subdirs(src_dir, full_dest_dir, RSYNC_EXCLUDE, kill)
+            exclude = RSYNC_EXCLUDE + [f"/{name}/" for name in unchanged]
+            rsync_args = rsync_arguments(src_dir, full_dest_dir, exclude, dry_run, kill)
             click.secho(f"rsync {rsync_args}", fg="green")
             os.makedirs(full_dest_dir, exist_ok=True)
-            rsync[split(rsync_args)] & FG
+            stats = run_rsync(split(rsync_args))
+            click.secho(f"{'[dry-run] ' if dry_run else ''}{stats}", fg=COLOR_CHANGED)
+            if not dry_run:
+                log_sync_metrics(src_dir, full_dest_dir, engine, stats)
+                if stats.succeeded:
+                    manifest.commit(src_dir, full_dest_dir)
+                    manifest.save()
+            if not stats.succeeded:
+                failed.append(full_dest_dir)
+    if failed:
+        raise click.ClickException(f"Sync failed for {len(failed)} directory(ies): {', '.join(failed)}")
+
+
+def rsync_arguments(src_dir: str, full_dest_dir: str, exclude: Iterable[str], dry_run: bool, kill: bool) -> str:
+    """Build the rsync arguments used by ``sync_dir()``."""
+    return "{dry_run}{kill}-trOlhDuzv --modify-window=2 --progress {exclude} {src}/ {dest}/".format(
+        dry_run="-n " if dry_run else "",
+        kill="--del " if kill else "",
+        exclude=" ".join([f"--exclude={quote(e)}" for e in exclude]),
+        src=src_dir,
+        dest=full_dest_dir,
+    )
+
+
+def sync_destination(
+    source_dirs: List[str],
+    dest_dir: str,
+    exclude: Iterable[str],
+    dry_run: bool,
+    kill: bool,
+    engine: str = ENGINE_RSYNC,
+    jobs: int = 4,
+    manifest: Optional["BackupManifest"] = None,
+) -> "SyncStats":
+    """Synchronize all source directories to one destination, prefixing the output with the destination.
+
+    :param manifest: Skip subdirectories that didn't change since they were synced by a previous run.
+    :return: Stats of all sources synced to this destination.
+    """
+    prefix = f"[{dest_dir}] "
+    total = SyncStats()
+    for src_dir in source_dirs:
+        if not src_dir:
+            continue
+        full_dest_dir = backup_destination(src_dir, dest_dir)
+        unchanged = manifest.unchanged_subdirs(src_dir, full_dest_dir, exclude, kill) if manifest else []
+        if unchanged:
+            click.echo(f"{prefix}Skipping {len(unchanged)} unchanged directories in {src_dir}")
+        source_exclude = list(exclude) + [f"/{name}/" for name in unchanged]
+        if engine == ENGINE_NATIVE:
+            click.secho(f"{prefix}sync {src_dir}/ {full_dest_dir}/", fg="green")
+            stats = native_sync(src_dir, full_dest_dir, source_exclude, dry_run, kill, jobs, prefix=prefix)
+            succeeded = True
+        else:
+            rsync_args = rsync_arguments(src_dir, full_dest_dir, source_exclude, dry_run, kill)
+            click.secho(f"{prefix}rsync {rsync_args}", fg="green")
+            os.makedirs(full_dest_dir, exist_ok=True)
+            stats = run_rsync(split(rsync_args), prefix)
+            succeeded = stats.succeeded
+        if not dry_run:
+            log_sync_metrics(src_dir, full_dest_dir, engine, stats)
+            if manifest and succeeded:
+                manifest.commit(src_dir, full_dest_dir)
+        click.secho(f"{prefix}{'[dry-run] ' if dry_run else ''}{stats}", fg=COLOR_CHANGED)
+        total.add(stats)
+    return total
+
+
+def run_rsync(args: List[str], prefix: str = "") -> "SyncStats":
+    """Run rsync capturing its output, and display each line with a prefix.
+
+    Without a prefix, progress updates (lines ending with a carriage return) are displayed in place, like rsync does.
+    With a prefix, the output of several rsync processes is mixed, so progress updates are displayed on their own
+    lines, at most once per ``PROGRESS_INTERVAL``.
+
+    :return: Files and bytes transferred, files deleted, bytes sent by rsync and the elapsed time.
+    """
+    stats = SyncStats()
+    last_progress = 0.0
+    with Popen(["rsync", *args], stdout=PIPE, stderr=STDOUT) as process:
+        assert process.stdout is not None
+        buffer = b""
+        for chunk in iter(lambda: process.stdout.read1(COPY_CHUNK_SIZE), b""):  # type: ignore
+            buffer += chunk
+            *lines, buffer = REGEX_LINE_END.split(buffer)
+            for line in lines:
+                if not line.strip():
+                    continue
+                text = line.decode(errors="replace").rstrip("\r\n")
+                parse_rsync_line(text, stats)
+                if line.endswith(b"\r"):
+                    if not prefix:
+                        click.echo(f"{text}\r", nl=False)
+                        continue
+                    if monotonic() - last_progress < PROGRESS_INTERVAL:
+                        continue
+                    last_progress = monotonic()
+                click.echo(f"{prefix}{text.strip()}" if prefix else text)
+        if buffer.strip():
+            text = buffer.decode(errors="replace")
+            parse_rsync_line(text, stats)
+            click.echo(f"{prefix}{text.strip()}")
+    if process.returncode:
+        stats.succeeded = False
+        click.secho(f"{prefix}rsync failed with exit code {process.returncode}", err=True, fg="red")
+    stats.elapsed = monotonic() - stats.start
+    return stats
+
+
+def parse_rsync_line(text: str, stats: "SyncStats") -> None:
+    """Update the stats with a line of rsync output: per file progress, deleted files and final stats.
+
+    >>> stats = SyncStats()
+    >>> for line in ("   512.00K  50%  1.00MB/s  0:00:01", "     1.02M 100%  1.00MB/s  0:00:01 (xfr#1, to-chk=3/9)",
+    ...              "deleting old.jpg", "      2,048 100%  1.95kB/s  0:00:00 (xfr#2, to-chk=0/9)",
+    ...              "sent 1.03M bytes  received 54 bytes  686.69K bytes/sec"):
+    ...     parse_rsync_line(line, stats)
+    >>> stats.files, stats.bytes, stats.deleted, stats.sent
+    (2, 1022048, 1, 1030000)
+    """
+    match = REGEX_RSYNC_PROGRESS.match(text)
+    if match:
+        if match.group("xfr"):
+            stats.files = int(match.group("xfr"))
+            stats.bytes += parse_rsync_number(match.group("bytes"))
+        return
+    if REGEX_RSYNC_DELETING.match(text):
+        stats.deleted += 1
+        return
+    match = REGEX_RSYNC_SENT.match(text)
+    if match:
+        stats.sent = parse_rsync_number(match.group("sent"))
+
+
+def log_sync_metrics(src_dir: str, dest_dir: str, engine: str, stats: "SyncStats") -> None:
+    """Append the stats of a sync to the JSONL metrics log in the config dir, to track the throughput over time."""
+    record = {"time": datetime.now().isoformat(timespec="seconds"), "source": src_dir, "destination": dest_dir}
+    record.update(engine=engine, **stats.as_dict())
+    with METRICS_LOCK, open(SYNC_METRICS_LOG, "a") as log:
+        log.write(json.dumps(record) + "\n")
+
+
+def parse_rsync_number(number: str) -> int:
+    """Parse a number displayed by rsync, with digit separators or with a unit suffix (``-h``).
+
+    >>> parse_rsync_number("1,234,567")
+    1234567
+    >>> parse_rsync_number("1.23K")
+    1230
+    >>> parse_rsync_number("45.60M")
+    45600000
+    """
+    suffix = number[-1:].upper()
+    if suffix in RSYNC_UNITS:
+        return round(float(number[:-1].replace(",", "")) * RSYNC_UNITS[suffix])
+    return int(number.replace(",", "").replace(".", ""))
+
+
+def backup_destination(src_dir: str, dest_dir: str) -> str:
+    """Remove the user home and concatenate the source after the destination.
+
+    >>> backup_destination(os.path.expanduser("~/Pictures"), "/mnt/backup")
+    '/mnt/backup/Pictures'
+    """
+    return os.path.join(dest_dir, src_dir.replace(os.path.expanduser("~"), "")[1:])
+
+
+def rsync_excluded(relative_path: str, is_dir: bool, patterns: Iterable[str]) -> bool:
+    """Check if a path matches one of the ``--exclude`` patterns, with a subset of the rsync rules.
+
+    A trailing slash only matches directories. A pattern without slashes matches the name at any level.
+    A pattern starting with a slash is anchored at the root of the transfer.
+
+    >>> rsync_excluded("photos/lost+found", True, ["lost+found/"])
+    True
+    >>> rsync_excluded("photos/lost+found", False, ["lost+found/"])
+    False
+    >>> rsync_excluded("a/.Trash-1000", True, [".Trash-*"])
+    True
+    >>> rsync_excluded("a/b/c.jpg", False, ["/a/b/*.jpg"])
+    True
+    >>> rsync_excluded("x/a/b/c.jpg", False, ["/a/b/*.jpg", "a/*.jpg"])
+    False
+    """
+    path_parts = relative_path.split("/")
+    for pattern in patterns:
+        if pattern.endswith("/"):
+            if not is_dir:
+                continue
+            pattern = pattern.rstrip("/")
+        anchored = pattern.startswith("/")
+        pattern_parts = pattern.lstrip("/").split("/")
+        if anchored and len(path_parts) != len(pattern_parts) or len(path_parts) < len(pattern_parts):
+            continue
+        # Wildcards don't match slashes, so each part of the path is matched separately
+        last_parts = path_parts[-len(pattern_parts) :]
+        if all(fnmatchcase(part, pattern_part) for part, pattern_part in zip(last_parts, pattern_parts)):
+            return True
+    return False
+
+
+def needs_sync(src_stat: os.stat_result, dest_stat: Optional[os.stat_result]) -> bool:
+    """Check if a file should be copied, like rsync's quick check with ``--update --modify-window=2``.
+
+    Files that are newer on the destination are skipped.
+    """
+    if dest_stat is None or not stat.S_ISREG(dest_stat.st_mode):
+        return True
+    difference = dest_stat.st_mtime - src_stat.st_mtime
+    if difference > MODIFY_WINDOW:
+        return False
+    return abs(difference) > MODIFY_WINDOW or dest_stat.st_size != src_stat.st_size
+
+
+class SyncStats:
+    """Numbers of a directory synchronization."""
+
+    def __init__(self) -> None:
+        self.files = 0
+        self.bytes = 0
+        self.deleted = 0
+        self.start = monotonic()
+        self.elapsed = 0.0
+        self.sent = 0
+        self.succeeded = True
+
+    def add(self, other: "SyncStats") -> None:
+        """Add the numbers of another synchronization."""
+        self.files += other.files
+        self.bytes += other.bytes
+        self.deleted += other.deleted
+        self.elapsed += other.elapsed
+        self.sent += other.sent
+        self.succeeded = self.succeeded and other.succeeded
+
+    @property
+    def rate(self) -> float:
+        """Bytes transferred per second."""
+        return self.bytes / max(self.elapsed, 1e-9)
+
+    def as_dict(self) -> Dict[str, Any]:
+        """Return the numbers as a dict, for the metrics log."""
+        return {
+            "files": self.files,
+            "bytes": self.bytes,
+            "deleted": self.deleted,
+            "sent": self.sent,
+            "elapsed": round(self.elapsed, 3),
+            "rate": round(self.rate),
+            "succeeded": self.succeeded,
+        }
+
+    def __str__(self) -> str:
+        """Display the numbers with the throughput."""
+        rate = self.rate
+        return (
+            f"{self.files} files ({human_size(self.bytes)}) copied, {self.deleted} deleted"
+            f" in {self.elapsed:.1f}s ({human_size(rate)}/s)"
+        )
+
+
+def _remove_path(path: str, is_dir: bool) -> None:
+    """Remove a file or a whole directory tree."""
+    if is_dir:
+        shutil.rmtree(path)
+    else:
+        os.unlink(path)
+
+
+def _sync_file(src_path: str, dest_path: str) -> None:
+    """Copy a file to a temporary name, then replace the destination (keeping the mtime)."""
+    temp_path = os.path.join(os.path.dirname(dest_path), f".{os.path.basename(dest_path)}{SYNC_TEMP_SUFFIX}")
+    if os.path.lexists(temp_path):
+        os.unlink(temp_path)
+    copy_file_data(src_path, temp_path, fsync=False)
+    if os.path.isdir(dest_path) and not os.path.islink(dest_path):
+        shutil.rmtree(dest_path)
+    os.replace(temp_path, dest_path)
+
+
+def native_sync(
+    src_dir: str,
+    dest_dir: str,
+    exclude: Iterable[str] = (),
+    dry_run: bool = False,
+    kill: bool = False,
+    jobs: int = 4,
+    prefix: str = "",
+) -> SyncStats:
+    """Synchronize a directory in process, with the same behaviour as the rsync options used by ``sync_dir()``.
+
+    The source is walked with ``os.scandir()``; changed files are copied by a pool of ``jobs`` threads.
+    Symlinks are copied as symlinks; devices and other special files are skipped.
+
+    :param kill: Delete files on the destination that don't exist on the source (except excluded ones).
+    :param prefix: Prefix for each displayed line.
+    """
+    patterns = list(exclude)
+    stats = SyncStats()
+    in_flight: Set[Future] = set()
+
+    def collect(max_in_flight: int) -> None:
+        nonlocal in_flight
+        while len(in_flight) > max_in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                future.result()
+
+    with ThreadPoolExecutor(max(jobs, 1), thread_name_prefix="copy") as executor:
+        pending = [""]
+        while pending:
+            relative_dir = pending.pop()
+            src = os.path.join(src_dir, relative_dir)
+            dest = os.path.join(dest_dir, relative_dir)
+            try:
+                with os.scandir(dest) as entries:
+                    dest_entries = {entry.name: entry for entry in entries}
+            except (FileNotFoundError, NotADirectoryError):
+                dest_entries = {}
+                if not dry_run:
+                    if os.path.lexists(dest):
+                        os.unlink(dest)
+                    os.makedirs(dest, exist_ok=True)
+
+            src_names = set()
+            with os.scandir(src) as entries:
+                for entry in entries:
+                    relative_path = os.path.join(relative_dir, entry.name)
+                    is_dir = entry.is_dir(follow_symlinks=False)
+                    if rsync_excluded(relative_path, is_dir, patterns):
+                        continue
+                    src_names.add(entry.name)
+                    dest_entry = dest_entries.get(entry.name)
+                    dest_path = os.path.join(dest, entry.name)
+
+                    if is_dir:
+                        pending.append(relative_path)
+                    elif entry.is_symlink():
+                        target = os.readlink(entry.path)
+                        if dest_entry and dest_entry.is_symlink() and os.readlink(dest_path) == target:
+                            continue
+                        click.echo(f"{prefix}{relative_path} -> {target}")
+                        stats.files += 1
+                        if not dry_run:
+                            if dest_entry:
+                                _remove_path(dest_path, dest_entry.is_dir(follow_symlinks=False))
+                            os.symlink(target, dest_path)
+                    elif entry.is_file(follow_symlinks=False):
+                        src_stat = entry.stat(follow_symlinks=False)
+                        if not needs_sync(src_stat, dest_entry.stat(follow_symlinks=False) if dest_entry else None):
+                            continue
+                        click.echo(f"{prefix}{relative_path}")
+                        stats.files += 1
+                        stats.bytes += src_stat.st_size
+                        if not dry_run:
+                            in_flight.add(executor.submit(_sync_file, entry.path, dest_path))
+                            collect(jobs * 4)
+
+            if kill:
+                for name, dest_entry in sorted(dest_entries.items()):
+                    relative_path = os.path.join(relative_dir, name)
+                    is_dir = dest_entry.is_dir(follow_symlinks=False)
+                    if name in src_names or rsync_excluded(relative_path, is_dir, patterns):
+                        continue
+                    click.echo(f"{prefix}deleting {relative_path}{os.sep if is_dir else ''}")
+                    stats.deleted += 1
+                    if not dry_run:
+                        _remove_path(dest_entry.path, is_dir)
+        collect(0)
+
+    stats.elapsed = monotonic() - stats.start
+    return stats
+
+
+class BackupManifest:
+    """Summary of each top directory of a source and of its copy, as they were when synced to a destination.
+
+    The summary of a directory is the number of files, their total size and the most recent mtime of its files and
+    subdirectories. A directory with the same summary on both sides as the last successful sync is skipped
+    by the next sync; a file deleted or changed on the destination makes it sync again.
+    """
+
+    def __init__(self, config: Optional[JsonConfig] = None) -> None:
+        self.config = config or BACKUP_MANIFEST
+        self.pairs: Dict[str, Dict[str, Any]] = {}
+        self.pending: Dict[str, Dict[str, Any]] = {}
+        self.changed = False
+        # Summaries of this run, shared by all destinations of a source
+        self.summaries: Dict[Tuple[str, Tuple[str, ...]], Dict[str, List[int]]] = {}
+        self.summaries_lock = threading.Lock()
+
+    def load(self) -> "BackupManifest":
+        """Load the manifest from the config file."""
+        self.pairs = self.config.load_dict()
+        return self
+
+    def save(self) -> None:
+        """Save the manifest in the config file, if any sync was committed."""
+        if self.changed:
+            self.config.dump(self.pairs, compact=True)
+            self.changed = False
+
+    @staticmethod
+    def summarize(src_dir: str, exclude: Iterable[str], names: Optional[Iterable[str]] = None) -> Dict[str, List[int]]:
+        """Summarize each top directory of the source as ``[files, bytes, max_mtime_ns]``.
+
+        :param names: Only summarize these top directories (default: all of them).
+        """
+        patterns = list(exclude)
+        summary: Dict[str, List[int]] = {}
+        with os.scandir(src_dir) as entries:
+            top_dirs = [
+                entry.name
+                for entry in entries
+                if entry.is_dir(follow_symlinks=False) and not rsync_excluded(entry.name, True, patterns)
+            ]
+        if names is not None:
+            top_dirs = sorted(set(top_dirs).intersection(names))
+        for name in top_dirs:
+            numbers = summary[name] = [0, 0, os.stat(os.path.join(src_dir, name)).st_mtime_ns]
+            pending = [name]
+            while pending:
+                relative_dir = pending.pop()
+                with os.scandir(os.path.join(src_dir, relative_dir)) as entries:
+                    for entry in entries:
+                        relative_path = f"{relative_dir}/{entry.name}"
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                        if rsync_excluded(relative_path, is_dir, patterns):
+                            continue
+                        entry_stat = entry.stat(follow_symlinks=False)
+                        numbers[2] = max(numbers[2], entry_stat.st_mtime_ns)
+                        if is_dir:
+                            pending.append(relative_path)
+                        else:
+                            numbers[0] += 1
+                            numbers[1] += entry_stat.st_size
+        return summary
+
+    def unchanged_subdirs(self, src_dir: str, dest_dir: str, exclude: Iterable[str], kill: bool) -> List[str]:
+        """Return the top directories of the source that didn't change since the last sync to this destination.
+
+        The source is summarized once per run, for all destinations.
+        The new summary is kept aside until the sync is committed.
+        Directories missing or changed on the destination are never skipped.
+        A sync with ``kill`` doesn't trust the manifest of a sync without it, which didn't delete any file.
+        """
+        if not os.path.isdir(src_dir):
+            return []
+        key = f"{src_dir}\t{dest_dir}"
+        exclude = list(exclude)
+        with self.summaries_lock:
+            summary = self.summaries.get((src_dir, tuple(exclude)))
+            if summary is None:
+                summary = self.summaries[(src_dir, tuple(exclude))] = self.summarize(src_dir, exclude)
+        self.pending[key] = {"kill": kill, "exclude": exclude, "dirs": summary}
+        previous = self.pairs.get(key)
+        if not previous or previous["exclude"] != exclude or (kill and not previous["kill"]):
+            return []
+        candidates = [
+            name
+            for name, numbers in summary.items()
+            if previous["dirs"].get(name) == numbers and not RSYNC_WILDCARDS.intersection(name)
+        ]
+        if not candidates or not os.path.isdir(dest_dir):
+            return []
+        # Only the destination directories that didn't change on the source are summarized
+        dest_summary = self.summarize(dest_dir, exclude, candidates)
+        previous_dest = previous.get("dest", {})
+        return sorted(
+            name for name in candidates if name in dest_summary and previous_dest.get(name) == dest_summary[name]
+        )
+
+    def commit(self, src_dir: str, dest_dir: str) -> None:
+        """Record the summaries of a successful sync, reading the destination as the sync left it."""
+        key = f"{src_dir}\t{dest_dir}"
+        if key in self.pending:
+            pair = self.pending.pop(key)
+            pair["dest"] = self.summarize(dest_dir, pair["exclude"]) if os.path.isdir(dest_dir) else {}
+            self.pairs[key] = pair
+            self.changed = True
 
 
 @click.command()
 @dry_run_option
 @click.option("--kill", "-k", default=False, is_flag=True, help="Kill files when using rsync (--del)")
 @click.option("--pictures", "-p", default=False, is_flag=True, help="Backup pictures")
+@click.option(
+    "--engine",
+    type=click.Choice([ENGINE_RSYNC, ENGINE_NATIVE]),
+    default=ENGINE_RSYNC,
+    show_default=True,
+    help="Sync with rsync processes, or in process with all destinations in parallel",
+)
+@click.option(
+    "--jobs", "-j", default=4, show_default=True, help="Number of threads copying files to each destination (native)"
+)
+@click.option(
+    "--parallel",
+    "-P",
+    default=False,
+    is_flag=True,
+    help="Sync destinations at the same time, with a summary at the end",
+)
+@click.option(
+    "--max-parallel",
+    default=0,
+    help="Maximum number of destinations synced at the same time  [default: all]",
+)
+@click.option(
+    "--full", default=False, is_flag=True, help="Sync all directories, even the ones unchanged since the last backup"
+)
 @click.pass_context
-def backup_full(ctx, dry_run: bool, kill: bool, pictures: bool):
+def backup_full(
+    ctx,
+    dry_run: bool,
+    kill: bool,
+    pictures: bool,
+    engine: str,
+    jobs: int,
+    parallel: bool,
+    max_parallel: int,
+    full: bool,
+):
     """Perform all backups in a single script."""
     if pictures:
         from clib.environments import BACKUP_DIRS, PICTURE_DIRS
 
         click.secho("Pictures backup", bold=True, fg="green")
-        sync_dir(PICTURE_DIRS, BACKUP_DIRS, dry_run, kill)
+        sync_dir(PICTURE_DIRS, BACKUP_DIRS, dry_run, kill, engine, jobs, parallel, max_parallel, full)
     else:
         click.secho("Choose one of the options below.", fg="red")
         print(ctx.get_help())
 
 
+def human_size(size: float) -> str:
+    """Human-readable size in bytes.
+
+    >>> human_size(1023)
+    '1023 B'
+    >>> human_size(1536)
+    '1.5 KiB'
+    >>> human_size(3 * 1024 ** 3)
+    '3.0 GiB'
+    """
+    for unit in ("B", "KiB", "MiB", "GiB", "TiB"):
+        if abs(size) < 1024 or unit == "TiB":
+            break
+        size /= 1024
+    return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+
+
+def copy_file_data(source: PathOrStr, destination: PathOrStr, fsync: bool = True) -> int:
+    """Copy a file with zero-copy system calls when available, verify its size and fsync it.
+
+    ``os.copy_file_range()`` is tried first, then ``os.sendfile()``, then a regular buffered copy.
+    The destination must not exist. File metadata is copied as well, like a rename would keep it.
+
+    :param fsync: Flush the destination file to the disk before returning.
+    :return: Number of bytes copied.
+    """
+    with open(source, "rb", buffering=0) as src, open(destination, "xb", buffering=0) as dst:
+        src_fd, dst_fd = src.fileno(), dst.fileno()
+        size = os.fstat(src_fd).st_size
+        copied = 0
+        for system_call in ZERO_COPY_CALLS:
+            try:
+                while copied < size:
+                    # The source offset is explicit; the destination position moves with each call
+                    sent = system_call(src_fd, dst_fd, copied, min(COPY_CHUNK_SIZE, size - copied))
+                    if not sent:
+                        break
+                    copied += sent
+                break
+            except OSError as err:
+                if err.errno not in ZERO_COPY_UNSUPPORTED:
+                    raise
+        if copied < size:
+            src.seek(copied)
+            shutil.copyfileobj(src, dst, COPY_CHUNK_SIZE)
+        if fsync:
+            os.fsync(dst_fd)
+    shutil.copystat(source, destination)
+
+    copied_size = os.stat(destination).st_size
+    if copied_size != size:
+        raise OSError(errno.EIO, f"Size mismatch after copy: {size} bytes on source, {copied_size} on destination")
+    return size
+
+
+def move_file_across_devices(source: PathOrStr, destination: PathOrStr) -> int:
+    """Move a file to another device: copy, verify size, fsync, then unlink the source.
+
+    :return: Number of bytes moved.
+    """
+    try:
+        size = copy_file_data(source, destination)
+    except FileExistsError:
+        raise
+    except BaseException:
+        # Don't leave a partial copy behind
+        Path(destination).unlink(missing_ok=True)
+        raise
+    os.unlink(source)
+    return size
+
+
+class FileMover:
+    """Move files across devices in a bounded thread pool, displaying progress and throughput."""
+
+    def __init__(self, jobs: int = 4, progress_interval: float = 1.0) -> None:
+        self.jobs = max(jobs, 1)
+        self.progress_interval = progress_interval
+        self.executor: Optional[ThreadPoolExecutor] = None
+        self.in_flight: Set[Future] = set()
+        self.files = 0
+        self.bytes = 0
+        self.start = 0.0
+        self.last_progress = 0.0
+
+    def __enter__(self) -> "FileMover":
+        """Use the mover as a context manager."""
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        """Wait for pending moves when leaving the context."""
+        self.close()
+
+    def submit(self, source: PathOrStr, destination: PathOrStr) -> None:
+        """Move a file in the background; block while there are too many pending moves."""
+        if not self.executor:
+            self.executor = ThreadPoolExecutor(self.jobs, thread_name_prefix="move")
+            self.start = self.last_progress = monotonic()
+        self.in_flight.add(self.executor.submit(move_file_across_devices, source, destination))
+        self._wait(self.jobs * 2)
+
+    def wait_all(self) -> None:
+        """Wait until all pending moves are done."""
+        self._wait(0)
+
+    def _wait(self, max_in_flight: int) -> None:
+        """Wait until the number of pending moves is below a limit, collecting the results.
+
+        All finished moves are counted before the error of a failed one is raised.
+        """
+        while len(self.in_flight) > max_in_flight:
+            done, self.in_flight = wait(self.in_flight, return_when=FIRST_COMPLETED)
+            errors = []
+            for future in done:
+                error = future.exception()
+                if error:
+                    errors.append(error)
+                    continue
+                self.bytes += future.result()
+                self.files += 1
+            if errors:
+                raise errors[0]
+            if monotonic() - self.last_progress >= self.progress_interval:
+                self.last_progress = monotonic()
+                click.secho(f"Moved {self.summary()}", fg=COLOR_CHANGED)
+
+    def summary(self) -> str:
+        """Files and bytes moved, with throughput."""
+        elapsed = max(monotonic() - self.start, 1e-9)
+        return f"{self.files} files, {human_size(self.bytes)} in {elapsed:.1f}s ({human_size(self.bytes / elapsed)}/s)"
+
+    def close(self) -> None:
+        """Wait for all pending moves and display a summary."""
+        if not self.executor:
+            return
+        try:
+            self._wait(0)
+        finally:
+            self.executor.shutdown()
+            self.executor = None
+        click.secho(f"Moved across devices: {self.summary()}", fg=COLOR_CHANGED)
+
+
+class FileHashes:
+    """Partial and full content hashes of files, cached by device, inode, size and mtime.
+
+    The partial hash only reads the first and the last blocks of a file.
+    """
+
+    def __init__(self, max_size: int = HASH_CACHE_MAX_SIZE, config: Optional[JsonConfig] = None) -> None:
+        self.max_size = max_size
+        self.config = config or HASH_CACHE
+        self.hashes: Dict[str, Dict[str, str]] = {}
+        self.changed = False
+
+    def load(self) -> "FileHashes":
+        """Load cached hashes from the config file."""
+        self.hashes = self.config.load_dict()
+        return self
+
+    def save(self) -> None:
+        """Save cached hashes in the config file, keeping only the most recent ones."""
+        if not self.changed:
+            return
+        keys = list(self.hashes)
+        for key in keys[: max(len(keys) - self.max_size, 0)]:
+            del self.hashes[key]
+        self.config.dump(self.hashes, compact=True)
+
+    def _hash(self, path: Path, stat: os.stat_result, kind: str) -> str:
+        """Return a cached hash, or compute and cache it."""
+        key = f"{stat.st_dev}:{stat.st_ino}:{stat.st_size}:{stat.st_mtime_ns}"
+        cached = self.hashes.setdefault(key, {})
+        if kind not in cached:
+            digest = hashlib.blake2b(digest_size=20)
+            with open(path, "rb") as file:
+                if kind == "full":
+                    for block in iter(lambda: file.read(COPY_CHUNK_SIZE), b""):
+                        digest.update(block)
+                else:
+                    digest.update(file.read(HASH_BLOCK_SIZE))
+                    if stat.st_size > HASH_BLOCK_SIZE:
+                        file.seek(max(stat.st_size - HASH_BLOCK_SIZE, HASH_BLOCK_SIZE))
+                        digest.update(file.read(HASH_BLOCK_SIZE))
+            cached[kind] = digest.hexdigest()
+            self.changed = True
+        return cached[kind]
+
+    def duplicate_of(self, path: Path, candidates: Iterable[Path]) -> Optional[Path]:
+        """Return the first candidate with the same contents as the path, or None.
+
+        Candidates are compared by size first, then by partial hash; the full hash is only computed when needed.
+        """
+        stat = path.stat()
+        same_size = []
+        for candidate in candidates:
+            try:
+                candidate_stat = candidate.stat()
+            except FileNotFoundError:
+                continue
+            if candidate_stat.st_size == stat.st_size:
+                same_size.append((candidate, candidate_stat))
+        if not same_size:
+            return None
+
+        partial = self._hash(path, stat, "partial")
+        for candidate, candidate_stat in same_size:
+            if self._hash(candidate, candidate_stat, "partial") != partial:
+                continue
+            # The partial hash already read the whole file
+            if stat.st_size <= 2 * HASH_BLOCK_SIZE:
+                return candidate
+            if self._hash(candidate, candidate_stat, "full") == self._hash(path, stat, "full"):
+                return candidate
+        return None
+
+
+class ExecutableResolver:
+    """Find executables on the PATH in process, with ``shutil.which()``, instead of running ``which`` in a shell.
+
+    Results (also missing executables) are kept in memory for the process, and in a cache file.
+    The cache file is discarded when the PATH or the mtime of any of its directories changed,
+    e.g. when an executable was installed or removed.
+    """
+
+    def __init__(self, config: Optional[JsonConfig] = None) -> None:
+        self.config = config or EXECUTABLE_CACHE
+        self.path = ""
+        self.executables: Dict[str, str] = {}
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def path_mtimes(path: str) -> Dict[str, int]:
+        """Return the mtime of each directory on the PATH (zero for missing ones)."""
+        mtimes = {}
+        for directory in path.split(os.pathsep):
+            try:
+                mtimes[directory] = os.stat(directory).st_mtime_ns
+            except OSError:
+                mtimes[directory] = 0
+        return mtimes
+
+    def _load(self, path: str) -> None:
+        """Load the cache file, if it's still valid for this PATH."""
+        self.path = path
+        data = self.config.load_dict()
+        valid = data.get("path") == path and data.get("mtimes") == self.path_mtimes(path)
+        self.executables = data.get("executables", {}) if valid else {}
+
+    def which(self, executable: str) -> str:
+        """Return the full path of an executable, or an empty string if it's not on the PATH."""
+        path = os.environ.get("PATH", os.defpath)
+        with self.lock:
+            if path != self.path:
+                self._load(path)
+            if executable in self.executables:
+                return self.executables[executable]
+            found = self.executables[executable] = shutil.which(executable, path=path) or ""
+            self.config.dump({"path": path, "mtimes": self.path_mtimes(path), "executables": self.executables})
+            return found
+
+
+EXECUTABLES = ExecutableResolver()
+
+
+def which(executable: str) -> str:
+    """Return the full path of an executable, or an empty string if it's not on the PATH; no process is forked."""
+    return EXECUTABLES.which(executable)
+
+
 def shell(
     command_line,
     quiet=False,
@@ -79,10 +950,7 @@ def shell(
     :param header: Print a header before the command.
     """
     if not quiet or dry_run:
-        if header:
-            click.secho(f"\n# {header}", fg="bright_white")
-        click.secho("$ ", fg="magenta", nl=False)
-        click.secho(command_line, fg="yellow")
+        echo_command(command_line, header)
         if dry_run:
             return
     if return_lines:
@@ -99,6 +967,82 @@ def shell(
     return stdout.split("\n") if stdout else []
 
 
+def echo_command(command_line: str, header: str = "") -> None:
+    """Print a command line, with an optional header before it."""
+    if header:
+        click.secho(f"\n# {header}", fg="bright_white")
+    click.secho("$ ", fg="magenta", nl=False)
+    click.secho(command_line, fg="yellow")
+
+
+async def ashell(
+    command_line,
+    quiet=False,
+    exit_on_failure: bool = False,
+    return_lines=False,
+    dry_run=False,
+    header: str = "",
+    semaphore: Optional[asyncio.Semaphore] = None,
+    **kwargs,
+):
+    """Print and run a shell command without blocking the event loop, with the same options as ``shell()``.
+
+    The output is captured and printed after the command line when the command finishes,
+    so the output of concurrent commands is not mixed.
+
+    :param semaphore: Limit the number of commands running at the same time.
+    """
+    if dry_run:
+        echo_command(command_line, header)
+        return None
+    check = kwargs.pop("check", False)
+    echo_stdout = not return_lines and "stdout" not in kwargs
+    echo_stderr = "stderr" not in kwargs
+    kwargs.setdefault("stdout", PIPE)
+    kwargs.setdefault("stderr", PIPE)
+
+    async with semaphore or asyncio.Semaphore():
+        process = await asyncio.create_subprocess_shell(command_line, **kwargs)
+        stdout_bytes, stderr_bytes = await process.communicate()
+    stdout = stdout_bytes.decode() if stdout_bytes is not None else None
+    stderr = stderr_bytes.decode() if stderr_bytes is not None else None
+
+    if not quiet:
+        echo_command(command_line, header)
+    if echo_stdout and stdout:
+        click.echo(stdout, nl=False)
+    if echo_stderr and stderr:
+        click.echo(stderr, nl=False, err=True)
+
+    assert process.returncode is not None
+    if exit_on_failure and process.returncode != 0:
+        sys.exit(process.returncode)
+    if check and process.returncode != 0:
+        raise CalledProcessError(process.returncode, command_line, stdout, stderr)
+
+    if not return_lines:
+        return CompletedProcess(command_line, process.returncode, stdout, stderr)
+    stdout = (stdout or "").strip().strip("\n")
+    return stdout.split("\n") if stdout else []
+
+
+def shell_many(command_lines: Sequence[str], jobs: int = SHELL_MANY_JOBS, **kwargs) -> List[Any]:
+    """Run shell commands concurrently, with the same options as ``shell()``.
+
+    >>> shell_many(["echo one", "echo two; echo three"], quiet=True, return_lines=True)
+    [['one'], ['two', 'three']]
+
+    :param jobs: Maximum number of commands running at the same time.
+    :return: One result per command, in the same order as the command lines.
+    """
+
+    async def run_all():
+        semaphore = asyncio.Semaphore(max(jobs, 1))
+        return await asyncio.gather(*(ashell(command, semaphore=semaphore, **kwargs) for command in command_lines))
+
+    return asyncio.run(run_all())
+
+
 def shell_find(command_line, **kwargs) -> List[str]:
     """Run a find command using the shell, and return its output as a list."""
     if not command_line.startswith("find"):
@@ -108,34 +1052,125 @@ def shell_find(command_line, **kwargs) -> List[str]:
     return shell(command_line, return_lines=True, **kwargs)
 
 
+def find_paths(
+    *roots: PathOrStr,
+    name: Union[str, Sequence[str]] = (),
+    type_: str = "",
+    broken_links: bool = False,
+    follow_symlinks: bool = False,
+    jobs: int = 1,
+) -> Iterator[str]:
+    """Find paths under root directories with ``os.scandir()``, without running ``find``.
+
+    Paths are yielded while the tree is walked; unreadable directories are skipped.
+
+    :param name: Glob pattern (or patterns) matched against the name of each entry, like ``find -name``.
+    :param type_: Entry types, like ``find -type``: any of ``f`` (file), ``d`` (directory), ``l`` (symlink).
+    :param broken_links: Only symlinks whose target doesn't exist (or is a symlink loop).
+    :param follow_symlinks: Descend into symlinks to directories.
+    :param jobs: Number of threads scanning directories at the same time; with more than one thread,
+        paths are yielded in no particular order. Useful on network file systems, where each stat is slow.
+    """
+    patterns = [name] if isinstance(name, str) else list(name)
+    pending = [str(root).rstrip(os.sep) or os.sep for root in reversed(roots)]
+    scan_args = (patterns, type_, broken_links, follow_symlinks)
+    if jobs <= 1:
+        while pending:
+            found, subdirs = _scan_directory(pending.pop(), *scan_args)
+            yield from found
+            pending.extend(reversed(subdirs))
+        return
+
+    with ThreadPoolExecutor(jobs, thread_name_prefix="find") as executor:
+        in_flight = {executor.submit(_scan_directory, directory, *scan_args) for directory in pending}
+        while in_flight:
+            done, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                found, subdirs = future.result()
+                in_flight.update(executor.submit(_scan_directory, subdir, *scan_args) for subdir in subdirs)
+                yield from found
+
+
+def _scan_directory(
+    directory: str, patterns: List[str], type_: str, broken_links: bool, follow_symlinks: bool
+) -> Tuple[List[str], List[str]]:
+    """Scan one directory for ``find_paths()``.
+
+    :return: Matching paths, and subdirectories to be scanned.
+    """
+    found: List[str] = []
+    subdirs: List[str] = []
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                try:
+                    is_symlink = entry.is_symlink()
+                    is_dir = entry.is_dir(follow_symlinks=follow_symlinks)
+                    is_file = entry.is_file(follow_symlinks=False)
+                except OSError:
+                    continue
+                if is_dir:
+                    subdirs.append(entry.path)
+                if patterns and not any(fnmatchcase(entry.name, pattern) for pattern in patterns):
+                    continue
+                if type_ and ("l" if is_symlink else "d" if is_dir else "f" if is_file else "") not in type_:
+                    continue
+                if broken_links and (not is_symlink or os.path.exists(entry.path)):
+                    continue
+                found.append(entry.path)
+    except OSError:
+        pass
+    return found, subdirs
+
+
 def fzf(
-    items: List[Any], *, reverse=False, query: str = None, auto_select: bool = None, exit_no_match: bool = None
+    items: Iterable[Any],
+    *,
+    reverse=False,
+    query: str = None,
+    auto_select: bool = None,
+    exit_no_match: bool = None,
+    height: str = "40%",
+    layout: Sequence[str] = FZF_LAYOUT,
 ) -> Optional[str]:
-    """Run fzf to select among multiple choices."""
-    choices = "\n".join([str(item) for item in items])
+    """Run fzf to select among multiple choices.
+
+    Items are streamed to the stdin of fzf as they are produced, so a generator can be used:
+    the picker opens right away, while items are still being read.
 
-    query_opt = ""
+    :param layout: fzf options for the layout of the picker.
+    """
+    options = [f"--height={height}", *layout]
     if query:
-        query_opt = f" --query={query}"
+        options.append(f"--query={query}")
         # If there is a query, set auto-select flags when no explicit booleans were informed
         if auto_select is None:
             auto_select = True
         if exit_no_match is None:
             exit_no_match = True
+    if reverse:
+        options.append("--tac")
+    if auto_select:
+        options.append("--select-1")
+    if exit_no_match:
+        options.append("--exit-0")
 
-    select_one_opt = " --select-1" if auto_select else ""
-    tac_opt = " --tac" if reverse else ""
-    exit_zero_opt = " --exit-0" if exit_no_match else ""
-
-    return min(
-        shell(
-            f'echo "{choices}" | fzf --height 40% --reverse --inline-info '
-            f"{query_opt}{tac_opt}{select_one_opt}{exit_zero_opt} --cycle",
-            quiet=True,
-            return_lines=True,
-        ),
-        default=None,
-    )
+    # Unbuffered pipe: each item reaches fzf as soon as it's produced, even if the next one takes a while,
+    # and nothing is left in a buffer if fzf exits early
+    process = Popen(["fzf", *options], stdin=PIPE, stdout=PIPE, bufsize=0)
+    assert process.stdin is not None and process.stdout is not None
+    try:
+        for item in items:
+            process.stdin.write(f"{item}\n".encode())
+    except BrokenPipeError:
+        # fzf exited before reading all the items: something was already selected, or the user gave up
+        pass
+    finally:
+        process.stdin.close()
+    output = process.stdout.read().decode()
+    process.stdout.close()
+    process.wait()
+    return min(output.splitlines(), default=None)
 
 
 def _check_type(full_path, method, msg):
@@ -156,34 +1191,204 @@ def existing_file_type(file):
     return _check_type(file, Path.is_file, "file")
 
 
-def wait_for_process(process_name: str) -> None:
-    """Wait for a process to finish.
+class InotifyEvent(NamedTuple):
+    """An inotify event: watch descriptor, event mask, cookie that pairs moves, and name inside the watched dir."""
+
+    wd: int
+    mask: int
+    cookie: int
+    name: str
+
+
+class Inotify:
+    """Watch file system events with Linux inotify, through ``ctypes`` and without extra dependencies."""
+
+    IN_MODIFY = 0x00000002
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_FROM = 0x00000040
+    IN_MOVED_TO = 0x00000080
+    IN_CREATE = 0x00000100
+    IN_DELETE = 0x00000200
+    IN_DELETE_SELF = 0x00000400
+    IN_MOVE_SELF = 0x00000800
+    IN_Q_OVERFLOW = 0x00004000
+    IN_IGNORED = 0x00008000
+    IN_ONLYDIR = 0x01000000
+    IN_ISDIR = 0x40000000
+
+    EVENT_HEADER = struct.Struct("iIII")
+    READ_SIZE = 64 * 1024
 
-    https://stackoverflow.com/questions/1058047/wait-for-any-process-to-finish
+    def __init__(self) -> None:
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        if not hasattr(self.libc, "inotify_init1"):
+            raise OSError(errno.ENOSYS, "inotify is only available on Linux")
+        self.fd = self._check(self.libc.inotify_init1(os.O_CLOEXEC))
+
+    def __enter__(self) -> "Inotify":
+        """Use as a context manager, closing the inotify instance at the end."""
+        return self
+
+    def __exit__(self, *args) -> None:
+        """Close the inotify instance."""
+        self.close()
+
+    @staticmethod
+    def _check(result: int, path: PathOrStr = "") -> int:
+        """Raise an error if a libc call failed."""
+        if result < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), *([str(path)] if path else []))
+        return result
+
+    def add_watch(self, path: PathOrStr, mask: int) -> int:
+        """Watch a path for events.
+
+        :return: Watch descriptor, which identifies the path in the events.
+        """
+        return self._check(self.libc.inotify_add_watch(self.fd, os.fsencode(path), ctypes.c_uint32(mask)), path)
+
+    def rm_watch(self, wd: int) -> None:
+        """Stop watching a path; it's not an error if the watch was already removed by the kernel."""
+        if self.libc.inotify_rm_watch(self.fd, wd) < 0 and ctypes.get_errno() != errno.EINVAL:
+            self._check(-1)
+
+    def read_events(self, timeout: Optional[float] = None) -> List[InotifyEvent]:
+        """Wait for events, and return all that are available.
+
+        :param timeout: Seconds to wait for events; an empty list is returned when the timeout expires.
+        """
+        poller = select.poll()
+        poller.register(self.fd, select.POLLIN)
+        if not poller.poll(None if timeout is None else timeout * 1000):
+            return []
+        data = os.read(self.fd, self.READ_SIZE)
+        events = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = self.EVENT_HEADER.unpack_from(data, offset)
+            offset += self.EVENT_HEADER.size
+            name = os.fsdecode(data[offset : offset + length].rstrip(b"\0"))
+            offset += length
+            events.append(InotifyEvent(wd, mask, cookie, name))
+        return events
+
+    def close(self) -> None:
+        """Close the inotify instance; all watches are removed."""
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def find_pids(process_name: str) -> List[int]:
+    """Find the PIDs of processes by name, like ``pidof``, scanning ``/proc`` instead of running it.
+
+    A process matches when the name is its command name or the base name of its executable.
+    The current process is never returned, like ``pidof`` does with its own PID.
     """
-    pid = shell(f"pidof {process_name}", quiet=True, stdout=PIPE).stdout.strip()
-    if not pid:
-        return
+    pids = []
+    own_pid = str(os.getpid())
+    try:
+        entries = os.listdir("/proc")
+    except FileNotFoundError:
+        return []
+    for entry in entries:
+        if not entry.isdigit() or entry == own_pid:
+            continue
+        try:
+            with open(f"/proc/{entry}/cmdline", "rb") as file:
+                executable = file.read().split(b"\0", 1)[0].decode(errors="replace")
+            with open(f"/proc/{entry}/comm") as file:
+                command = file.read().rstrip("\n")
+        except OSError:
+            # The process finished while scanning
+            continue
+        if process_name in (command, os.path.basename(executable)):
+            pids.append(int(entry))
+    return sorted(pids)
+
+
+def process_running(pid: int) -> bool:
+    """Check if a process is running; zombies (finished, but not reaped by their parent) are not."""
+    try:
+        with open(f"/proc/{pid}/stat") as file:
+            # The state comes after the command name, which is inside parentheses and can contain spaces
+            return file.read().rpartition(")")[2].split()[0] != "Z"
+    except FileNotFoundError:
+        return False
+    except OSError:
+        pass
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
 
-    pid_path = Path(f"/proc/{pid}")
-    while pid_path.exists():
-        sleep(0.5)
+def wait_for_process(*processes: Union[int, str], timeout: Optional[float] = None) -> bool:
+    """Wait for processes to finish.
+
+    On Linux, each process is watched with a pidfd, so the wait returns as soon as the processes finish,
+    without polling. Elsewhere, the processes are polled every ``WAIT_POLL_INTERVAL`` seconds.
+
+    :param processes: PIDs, or names of processes (all the processes with the name will be waited for).
+    :param timeout: Maximum number of seconds to wait.
+    :return: True if all processes finished, False if the timeout expired.
+    """
+    pids: Set[int] = set()
+    for process in processes:
+        pids.update(find_pids(process) if isinstance(process, str) else [process])
+    deadline = None if timeout is None else monotonic() + timeout
+
+    pidfds: Dict[int, int] = {}
+    if hasattr(os, "pidfd_open"):
+        for pid in sorted(pids):
+            try:
+                pidfds[os.pidfd_open(pid)] = pid  # type: ignore
+            except ProcessLookupError:
+                pids.discard(pid)
+            except OSError:
+                # Not supported by the kernel, or no permission: fall back to polling this process
+                pass
+    try:
+        poller = select.poll()
+        for fd in pidfds:
+            poller.register(fd, select.POLLIN)
+        while pids:
+            polled = pids.difference(pidfds.values())
+            pids.difference_update([pid for pid in polled if not process_running(pid)])
+            if not pids:
+                break
+            wait_seconds = None if deadline is None else deadline - monotonic()
+            if wait_seconds is not None and wait_seconds <= 0:
+                return False
+            if polled:
+                wait_seconds = WAIT_POLL_INTERVAL if wait_seconds is None else min(wait_seconds, WAIT_POLL_INTERVAL)
+            for fd, _ in poller.poll(None if wait_seconds is None else wait_seconds * 1000):
+                poller.unregister(fd)
+                pids.discard(pidfds.pop(fd))
+                os.close(fd)
+        return True
+    finally:
+        for fd in pidfds:
+            os.close(fd)
 
 
 @click.command()
 @dry_run_option
+@click.option(
+    "--jobs", "-j", default=8, show_default=True, help="Number of threads scanning directories and removing links"
+)
 @click.argument("directories", nargs=-1, required=True, type=click.Path(exists=True), metavar="[DIR1 [DIR2]...]")
-def rm_broken_symlinks(dry_run: bool, directories):
+def rm_broken_symlinks(dry_run: bool, jobs: int, directories):
     """Remove broken symlinks from directories (asks for confirmation)."""
     clean_dirs = [dir_str.rstrip("/") for dir_str in directories]
-    base_command = r"find {dir} -type l ! -exec test -e {{}} \; -print{extra}"
-
-    all_broken_links = []
-    for clean_dir in clean_dirs:
-        broken_links = shell_find(base_command.format(dir=clean_dir, extra=""), quiet=False)
-        all_broken_links.extend(broken_links)
-        for file in broken_links:
-            echo_dry_run(file, dry_run=dry_run)
+
+    all_broken_links = sorted(find_paths(*clean_dirs, broken_links=True, jobs=jobs))
+    for broken_link in all_broken_links:
+        echo_dry_run(broken_link, dry_run=dry_run)
     if not all_broken_links:
         echo_dry_run("There are no broken links to be removed", dry_run=dry_run, fg="green")
         exit(0)
@@ -192,6 +1397,25 @@ def rm_broken_symlinks(dry_run: bool, directories):
 
     click.confirm("These broken links will be removed. Continue?", default=False, abort=True)
 
-    for clean_dir in clean_dirs:
-        click.secho(f"Removing broken symlinks in {click.format_filename(clean_dir)}...", fg="green")
-        shell(base_command.format(dir=clean_dir, extra=" -delete"))
+    click.secho(f"Removing {len(all_broken_links)} broken symlinks...", fg="green")
+    batch_size = max(len(all_broken_links) // (jobs * 4), 1)
+    batches = [all_broken_links[index : index + batch_size] for index in range(0, len(all_broken_links), batch_size)]
+    with ThreadPoolExecutor(max(jobs, 1), thread_name_prefix="unlink") as executor:
+        removed = sum(executor.map(_remove_broken_links, batches))
+    click.secho(f"{removed} broken symlinks removed", fg="green")
+
+
+def _remove_broken_links(broken_links: List[str]) -> int:
+    """Remove symlinks that are still broken; one might have been fixed or removed while waiting for the confirmation.
+
+    :return: Number of removed links.
+    """
+    removed = 0
+    for broken_link in broken_links:
+        if os.path.islink(broken_link) and not os.path.exists(broken_link):
+            try:
+                os.unlink(broken_link)
+                removed += 1
+            except FileNotFoundError:
+                pass
+    return removed
@@ -1,18 +1,28 @@
 """Rename dirs and files and merge dirs in the process."""
 
+import errno
+import hashlib
+import json
 import os
 import re
 import unicodedata
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
+from datetime import date, datetime
 from functools import partial
+from itertools import accumulate
 from pathlib import Path
-from typing import Set, Union
+from typing import Dict, Iterable, Iterator, List, NamedTuple, Optional, Set, TextIO, Tuple, Union
 
 import click
-import pendulum
+import slugify as slugify_module
 from slugify import slugify
 
 from clib import dry_run_option, verbose_option, yes_option
-from clib.constants import COLOR_OK
+from clib.config import JsonConfig
+from clib.constants import COLOR_CHANGED, COLOR_OK
+from clib.files import FileHashes, FileMover
 from clib.types import PathOrStr
 from clib.ui import echo_dry_run
 
@@ -47,6 +57,258 @@ POSSIBLE_FORMATS = (
 )
 IGNORE_FILES_ON_MERGE = {".DS_Store"}
 
+REGEX_FORMAT_TOKEN = re.compile("YYYY|YY|MM|DD|HH|mm|ss|.")
+FORMAT_TOKEN_FIELDS = {
+    "YYYY": "year",
+    "YY": "year",
+    "MM": "month",
+    "DD": "day",
+    "HH": "hour",
+    "mm": "minute",
+    "ss": "second",
+}
+DIGITS_TO_LAYOUT = str.maketrans("0123456789", "9" * 10)
+
+
+class DateTimeFormat(NamedTuple):
+    """A date/time format precompiled into the position of each field in the string."""
+
+    fields: Tuple[Tuple[str, int, int], ...]
+    has_century: bool
+    has_day: bool
+    has_time: bool
+
+
+def compile_date_formats(formats: Tuple[str, ...]) -> Dict[str, Tuple[DateTimeFormat, ...]]:
+    """Group date/time formats by their layout: digits are replaced by ``9``, separators are kept.
+
+    Formats with the same layout are kept in the original order, so they are tried with the same priority.
+
+    >>> compiled = compile_date_formats(("DD_MM_YYYY", "DDMMYYYY", "YYYYMMDD"))
+    >>> sorted(compiled)
+    ['99999999', '99_99_9999']
+    >>> compiled["99_99_9999"][0].fields
+    (('day', 0, 2), ('month', 3, 5), ('year', 6, 10))
+    >>> [date_format.fields[0][0] for date_format in compiled["99999999"]]
+    ['day', 'year']
+    """
+    by_layout: Dict[str, List[DateTimeFormat]] = {}
+    for date_format in formats:
+        fields = []
+        layout = []
+        position = 0
+        for token in REGEX_FORMAT_TOKEN.findall(date_format):
+            field = FORMAT_TOKEN_FIELDS.get(token)
+            if field:
+                fields.append((field, position, position + len(token)))
+                layout.append("9" * len(token))
+            else:
+                layout.append(token)
+            position += len(token)
+        field_names = {field for field, _, _ in fields}
+        compiled = DateTimeFormat(tuple(fields), "YYYY" in date_format, "day" in field_names, "hour" in field_names)
+        by_layout.setdefault("".join(layout), []).append(compiled)
+    return {layout: tuple(compiled_formats) for layout, compiled_formats in by_layout.items()}
+
+
+DATE_FORMATS_BY_LAYOUT = compile_date_formats(POSSIBLE_FORMATS)
+
+SLUG_CACHE = JsonConfig("rename-slugify-cache.json")
+SLUG_CACHE_MAX_SIZE = 200_000
+SLUGIFY_CHUNK_SIZE = 1_000
+DIR_INDEX = JsonConfig("rename-slugify-index.json")
+
+
+def slug_rules_version() -> str:
+    """Hash everything that can change the output of ``slugify_camel_iso()``.
+
+    The rules are in this module; the current year is used to convert 2-digit years.
+    """
+    rules = hashlib.sha1(Path(__file__).read_bytes())
+    rules.update(f"{slugify_module.__version__}|{date.today().year}".encode())
+    return rules.hexdigest()
+
+
+class SlugCache:
+    """A bounded LRU memo for ``slugify_camel_iso()``, persisted in a JSON config file.
+
+    Cached slugs are discarded when the rules version changes.
+    """
+
+    def __init__(self, max_size: int = SLUG_CACHE_MAX_SIZE, config: JsonConfig = SLUG_CACHE) -> None:
+        self.max_size = max_size
+        self.config = config
+        self.version = slug_rules_version()
+        self.slugs: "OrderedDict[str, str]" = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def load(self) -> "SlugCache":
+        """Load cached slugs from the config file, if they were created with the same rules."""
+        if self.max_size <= 0:
+            return self
+        data = self.config.load_dict()
+        if data.get("version") == self.version:
+            self.slugs.update(data.get("slugs", {}))
+            self._trim()
+        return self
+
+    def save(self) -> None:
+        """Save cached slugs in the config file, from the least to the most recently used."""
+        if self.max_size <= 0 or not (self.hits or self.misses):
+            return
+        self.config.dump({"version": self.version, "slugs": self.slugs}, compact=True)
+
+    def get(self, text: str) -> Optional[str]:
+        """Return the cached slug of a text, marking it as the most recently used."""
+        slug = self.slugs.get(text)
+        if slug is not None:
+            self.hits += 1
+            self.slugs.move_to_end(text)
+        return slug
+
+    def add(self, text: str, slug: str) -> None:
+        """Add a slug that was not found in the cache."""
+        self.misses += 1
+        if self.max_size > 0:
+            self.slugs[text] = slug
+            self._trim()
+
+    def slugify(self, text: str) -> str:
+        """Return the cached slug of a text, or slugify it and cache the result."""
+        slug = self.get(text)
+        if slug is None:
+            slug = slugify_camel_iso(text)
+            self.add(text, slug)
+        return slug
+
+    def _trim(self) -> None:
+        """Remove the least recently used slugs when the cache is full."""
+        while len(self.slugs) > self.max_size:
+            self.slugs.popitem(last=False)
+
+    def __str__(self) -> str:
+        """Display hit/miss counters."""
+        return f"Slug cache: {self.hits} hits, {self.misses} misses, {len(self.slugs)} entries"
+
+
+def slugify_many(texts: Iterable[str], jobs: int = 1, cache: Optional[SlugCache] = None) -> Dict[str, str]:
+    """Slugify many texts, returning a dict with the slug of each one.
+
+    Texts not found in the cache are split in chunks and slugified in parallel processes, if ``jobs`` is more than 1.
+    """
+    slugs = {}
+    pending = []
+    for text in dict.fromkeys(texts):
+        slug = cache.get(text) if cache else None
+        if slug is None:
+            pending.append(text)
+        else:
+            slugs[text] = slug
+    if not pending:
+        return slugs
+
+    if jobs > 1 and len(pending) > SLUGIFY_CHUNK_SIZE:
+        with ProcessPoolExecutor(jobs) as executor:
+            computed = list(executor.map(slugify_camel_iso, pending, chunksize=SLUGIFY_CHUNK_SIZE))
+    else:
+        computed = [slugify_camel_iso(text) for text in pending]
+    for text, slug in zip(pending, computed):
+        slugs[text] = slug
+        if cache:
+            cache.add(text, slug)
+    return slugs
+
+
+class DirIndex:
+    """Modification time, inode and subdirectories of directories whose entries already have correct names.
+
+    A directory with the same mtime and inode as in the previous run is not listed again;
+    its subdirectories are read from the index instead.
+    The index is discarded when its version changes (different rules or excluded paths).
+    """
+
+    def __init__(self, version: str, config: JsonConfig = DIR_INDEX) -> None:
+        self.version = version
+        self.config = config
+        self.dirs: Dict[str, list] = {}
+        # Directories found on this run, and whether they were listed (True) or skipped (False)
+        self.visited: Dict[str, bool] = {}
+
+    def load(self) -> "DirIndex":
+        """Load the index from the config file, if it has the same version."""
+        data = self.config.load_dict()
+        if data.get("version") == self.version:
+            self.dirs = data.get("dirs", {})
+        return self
+
+    def save(self) -> None:
+        """Save the index in the config file."""
+        self.config.dump({"version": self.version, "dirs": self.dirs}, compact=True)
+
+    def unchanged_subdirs(self, path: str) -> Optional[List[str]]:
+        """Return the subdirectories of an unchanged directory, or None if it has to be listed."""
+        entry = self.dirs.get(path)
+        subdirs = None
+        if entry:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                stat = None
+            if stat and [stat.st_mtime_ns, stat.st_ino] == entry[:2]:
+                subdirs = entry[2]
+        self.visited[path] = subdirs is None
+        return subdirs
+
+    def update(self, root_dir: Path, moved_dirs: Dict[Path, Path]) -> None:
+        """Record the directories listed on this run, after they were renamed, and forget the ones that are gone.
+
+        Directories inside a renamed one are recorded again under the new path, even if they were skipped.
+        """
+        existing = set()
+        for path, listed in self.visited.items():
+            moved = self._moved_path(path, moved_dirs)
+            new_path = str(moved) if moved else path
+            if listed or moved:
+                self.dirs.pop(path, None)
+                try:
+                    self.dirs[new_path] = self._read(new_path)
+                except OSError:
+                    continue
+            existing.add(new_path)
+        self.visited.clear()
+
+        root = str(root_dir)
+        prefix = os.path.join(root, "")
+        for path in [path for path in self.dirs if (path == root or path.startswith(prefix)) and path not in existing]:
+            del self.dirs[path]
+
+    @staticmethod
+    def _moved_path(path: str, moved_dirs: Dict[Path, Path]) -> Optional[Path]:
+        """Return the new path of a directory, if it or one of its parents was renamed."""
+        current = Path(path)
+        for parent in (current, *current.parents):
+            if parent in moved_dirs:
+                return moved_dirs[parent] / current.relative_to(parent)
+        return None
+
+    @staticmethod
+    def _read(path: str) -> list:
+        """Read the current mtime, inode and non-hidden subdirectories of a directory."""
+        with os.scandir(path) as entries:
+            subdirs = [
+                entry.name
+                for entry in entries
+                if not entry.name.startswith(".") and entry.is_dir(follow_symlinks=False)
+            ]
+        stat = os.stat(path)
+        return [stat.st_mtime_ns, stat.st_ino, sorted(subdirs)]
+
+    def __str__(self) -> str:
+        """Display how many directories were skipped."""
+        skipped = sum(1 for listed in self.visited.values() if not listed)
+        return f"Directory index: {skipped} unchanged directories skipped, {len(self.visited) - skipped} listed"
+
 
 @click.command()
 @click.option(
@@ -57,22 +319,72 @@ IGNORE_FILES_ON_MERGE = {".DS_Store"}
     multiple=True,
     help="Exclude one or more directories",
 )
+@click.option(
+    "--cache-size",
+    default=SLUG_CACHE_MAX_SIZE,
+    show_default=True,
+    help="Maximum number of slugs kept in the on-disk cache (0 disables the cache)",
+)
+@click.option(
+    "--jobs", "-j", default=1, show_default=True, help="Number of processes used to compute new names on big trees"
+)
+@click.option(
+    "--plan-out",
+    type=click.Path(dir_okay=False, writable=True),
+    help="Write the rename plan to a JSON lines file, without renaming anything",
+)
+@click.option(
+    "--apply",
+    "apply_file",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Apply a rename plan file; an interrupted plan is resumed from its journal",
+)
+@click.option(
+    "--undo",
+    "undo_file",
+    type=click.Path(exists=True, dir_okay=False),
+    help="Undo the renames recorded in the journal of a plan file",
+)
+@click.option(
+    "--full", default=False, is_flag=True, help="Scan all directories, even the ones that didn't change since last run"
+)
 @yes_option
 @dry_run_option
 @verbose_option
-@click.argument("directories", nargs=-1, type=click.Path(exists=True, file_okay=False, dir_okay=True), required=True)
-def rename_slugify(exclude, yes: bool, dry_run: bool, verbose: bool, directories):
+@click.argument("directories", nargs=-1, type=click.Path(exists=True, file_okay=False, dir_okay=True))
+def rename_slugify(
+    exclude,
+    cache_size: int,
+    jobs: int,
+    plan_out: Optional[str],
+    apply_file: Optional[str],
+    undo_file: Optional[str],
+    full: bool,
+    yes: bool,
+    dry_run: bool,
+    verbose: bool,
+    directories,
+):
     """Rename files recursively, slugifying them. Format dates in file names as ISO. Ignore hidden dirs/files."""
-    excluded_dirs = set()
-    excluded_files = set()
+    if apply_file:
+        RenamePlan(apply_file).apply(yes, dry_run, verbose)
+        return
+    if undo_file:
+        RenamePlan(undo_file).undo(yes, dry_run, verbose)
+        return
+    if not directories:
+        raise click.UsageError("Provide one or more directories, or a plan file to apply or undo")
+
+    excluded_dirs: Set[str] = set()
+    excluded_files: Set[str] = set()
     for file_system_object in exclude:
         path = Path(file_system_object).expanduser()
         if not path.exists():
             continue
         if path.is_dir():
-            excluded_dirs.add(path)
+            excluded_dirs.add(os.path.abspath(path))
         else:
-            excluded_files.add(path)
+            excluded_files.add(os.path.abspath(path))
     if excluded_dirs and verbose:
         pretty_dirs = sorted({relative_to_home(path) for path in excluded_dirs})
         click.echo(f"Excluding directories: {', '.join(pretty_dirs)}")
@@ -80,89 +392,309 @@ def rename_slugify(exclude, yes: bool, dry_run: bool, verbose: bool, directories
         pretty_files = sorted({relative_to_home(path) for path in excluded_files})
         click.echo(f"Excluding files: {', '.join(pretty_files)}")
 
-    for directory in directories:
-        original_dir = Path(directory).expanduser()
-
-        dirs_to_rename = set()
-        files_to_rename = set()
-        for child in original_dir.glob("**/*"):
-            if child.name.startswith(".") or "/." in str(child):
-                if verbose:
-                    click.echo(f"Ignoring hidden {relative_to_home(child)}")
-                continue
-            add = True
-            for dir_to_exclude in excluded_dirs:
-                if str(child).startswith(str(dir_to_exclude)):
-                    if verbose:
-                        click.echo(f"Ignoring {relative_to_home(child)}")
-                    add = False
-                    break
-            if not add:
-                continue
-
-            if child.is_dir():
-                dirs_to_rename.add(child)
-            else:
-                if child not in excluded_files:
+    cache = SlugCache(cache_size).load()
+    with ExitStack() as stack:
+        plan = stack.enter_context(open(plan_out, "w")) if plan_out else None
+        index_version = hashlib.sha1(
+            "\n".join([slug_rules_version(), *sorted(excluded_dirs), *sorted(excluded_files)]).encode()
+        ).hexdigest()
+        index = DirIndex(index_version)
+        if not full:
+            index.load()
+        # The index is only updated when the renames are done now
+        update_index = not dry_run and not plan
+        for directory in directories:
+            original_dir = Path(os.path.abspath(Path(directory).expanduser()))
+
+            dirs_to_rename = set()
+            files_to_rename = set()
+            for child, is_dir in scan_tree(original_dir, excluded_dirs, verbose, index):
+                if is_dir:
+                    dirs_to_rename.add(child)
+                elif str(child) not in excluded_files:
                     files_to_rename.add(child)
                 elif verbose:
                     click.echo(f"Ignoring file {relative_to_home(child)}")
 
-        # Rename directories first
-        rename_batch(yes, dry_run, True, original_dir, dirs_to_rename)
+            # Rename directories first, keeping track of their new paths
+            moved_dirs: Dict[Path, Path] = {}
+            rename_batch(yes, dry_run, True, original_dir, dirs_to_rename, cache, jobs, moved_dirs, plan)
+
+            # Then rename files inside the renamed directories
+            files_found = rename_batch(
+                yes, dry_run, False, original_dir, files_to_rename, cache, jobs, moved_dirs, plan
+            )
+
+            if not files_found:
+                click.secho(f"{relative_to_home(directory)}: All files already have correct names.", fg=COLOR_OK)
 
-        # Glob the renamed directories for files
-        files_found = rename_batch(yes, dry_run, False, original_dir, files_to_rename)
+            if verbose:
+                click.echo(str(index))
+            if update_index:
+                index.update(original_dir, moved_dirs)
 
-        if not files_found:
-            click.secho(f"{relative_to_home(directory)}: All files already have correct names.", fg=COLOR_OK)
+    if plan_out:
+        click.secho(f"Rename plan written to {plan_out}", fg=COLOR_CHANGED)
+    if update_index:
+        index.save()
+    cache.save()
+    if verbose:
+        click.echo(str(cache))
 
 
-def rename_batch(yes: bool, dry_run: bool, is_dir: bool, root_dir: Path, items: Set[Path]) -> bool:
-    """Rename a batch of items (directories or files)."""
+def scan_tree(
+    root_dir: Path, excluded_dirs: Set[str], verbose: bool = False, index: Optional[DirIndex] = None
+) -> Iterator[Tuple[Path, bool]]:
+    """Walk a directory tree with ``os.scandir()``, yielding each path and whether it's a directory.
+
+    Hidden and excluded directories are pruned before descending into them.
+    The file type cached in each directory entry is reused, to avoid an extra ``stat()`` per path.
+    Symlinks to directories are yielded but not followed, like ``Path.glob("**/*")`` does.
+
+    :param excluded_dirs: Absolute paths of directories to be excluded, with their subtrees.
+    :param index: Don't list (nor yield) the entries of directories that didn't change since the last run.
+    """
+    root = str(root_dir)
+    if any(parent in excluded_dirs for parent in (root, *map(str, root_dir.parents))):
+        if verbose:
+            click.echo(f"Ignoring {relative_to_home(root_dir)}")
+        return
+
+    pending = [root]
+    while pending:
+        current = pending.pop()
+        if index is not None:
+            subdirs = index.unchanged_subdirs(current)
+            if subdirs is not None:
+                for name in subdirs:
+                    path = os.path.join(current, name)
+                    if path not in excluded_dirs:
+                        pending.append(path)
+                continue
+        try:
+            scanner = os.scandir(current)
+        except OSError:
+            continue
+        with scanner:
+            for entry in scanner:
+                if entry.name.startswith("."):
+                    if verbose:
+                        click.echo(f"Ignoring hidden {relative_to_home(entry.path)}")
+                    continue
+                if entry.path in excluded_dirs:
+                    if verbose:
+                        click.echo(f"Ignoring {relative_to_home(entry.path)}")
+                    continue
+
+                is_dir = entry.is_dir()
+                if is_dir and not entry.is_symlink():
+                    pending.append(entry.path)
+                yield Path(entry.path), is_dir
+
+
+def rename_batch(
+    yes: bool,
+    dry_run: bool,
+    is_dir: bool,
+    root_dir: Path,
+    items: Set[Path],
+    cache: Optional[SlugCache] = None,
+    jobs: int = 1,
+    moved_dirs: Optional[Dict[Path, Path]] = None,
+    plan: Optional[TextIO] = None,
+) -> bool:
+    """Rename a batch of items (directories or files).
+
+    :param moved_dirs: Original and new paths of directories renamed by a previous batch (or by this one).
+    :param plan: Write the renames to this plan file, instead of executing them.
+    """
     which_type = "directories" if is_dir else "files"
+    if moved_dirs is None:
+        moved_dirs = {}
+    sorted_items = sorted(items)
+    slugs = slugify_many((item.name if is_dir else item.stem for item in sorted_items), jobs, cache)
     pairs = []
-    for item in sorted(items):
+    for item in sorted_items:
         if is_dir:
-            new_name = slugify_camel_iso(item.name)
+            new_name = slugs[item.name]
         else:
-            new_name = slugify_camel_iso(item.stem) + item.suffix.lower()
+            new_name = slugs[item.stem] + item.suffix.lower()
+
+        # Parents are sorted before their children, so they were already moved
+        moved_parent = moved_dirs.get(item.parent)
+        current = moved_parent / item.name if moved_parent else item
+        new = current.with_name(new_name)
+        if is_dir and new != item:
+            moved_dirs[item] = new
 
         if item.name == new_name:
             continue
+        pairs.append((current, new))
+        if plan:
+            plan.write(RenamePlan.entry(which_type, current, new))
+            continue
 
         relative_dir = str(item.parent.relative_to(root_dir))
 
         echo_dry_run(f"from: {relative_dir}/{item.name}", dry_run=dry_run)
         echo_dry_run(f"  to: {relative_dir}/", nl=False, dry_run=dry_run)
         click.secho(new_name, fg="yellow")
-        pairs.append((item, item.with_name(new_name)))
 
-    if not dry_run and pairs:
+    if not dry_run and not plan and pairs:
         pretty_root = relative_to_home(root_dir)
         if not yes:
             click.confirm(f"{pretty_root}: Rename these {which_type}?", default=False, abort=True)
         for original, new in pairs:
-            if str(original) == str(new) and new.exists():
-                # Don't rename files with the exact same name that already exist
-                click.secho(f"New file already exists! {new}", err=True, fg="red")
-            else:
-                try:
-                    os.rename(original, new)
-                except OSError as err:
-                    if err.errno == 66:  # Directory not empty
-                        merge_directories(new, original)
-                    else:
-                        raise err
+            rename_path(original, new)
         click.secho(f"{pretty_root}: {which_type.capitalize()} renamed succesfully.", fg="yellow")
 
     return bool(pairs)
 
 
+def rename_path(original: Path, new: Path) -> bool:
+    """Rename a file or directory; merge directories if the new one already exists and is not empty.
+
+    :return: True if directories were merged.
+    """
+    if str(original) == str(new) and new.exists():
+        # Don't rename files with the exact same name that already exist
+        click.secho(f"New file already exists! {new}", err=True, fg="red")
+        return False
+    try:
+        os.rename(original, new)
+    except OSError as err:
+        if err.errno in (66, errno.ENOTEMPTY):  # Directory not empty
+            merge_directories(new, original)
+            return True
+        raise err
+    return False
+
+
+class RenamePlan:
+    """A rename plan stored as JSON lines.
+
+    Renames applied from the plan are appended to a journal file next to it,
+    so an interrupted plan can be resumed, and the applied renames can be undone.
+    """
+
+    def __init__(self, plan_file: PathOrStr) -> None:
+        self.plan_file = Path(plan_file)
+        self.journal_file = self.plan_file.with_name(f"{self.plan_file.name}.journal")
+
+    @staticmethod
+    def entry(which_type: str, original: Path, new: Path) -> str:
+        """Return a JSON line with a rename."""
+        return json.dumps({"type": which_type, "from": str(original), "to": str(new)}) + "\n"
+
+    def applied_indexes(self) -> Set[int]:
+        """Indexes of plan lines that were already applied, according to the journal."""
+        if not self.journal_file.exists():
+            return set()
+        indexes = set()
+        with self.journal_file.open() as journal:
+            for line in journal:
+                try:
+                    indexes.add(json.loads(line)["index"])
+                except (json.JSONDecodeError, KeyError):
+                    # A partial line written before a crash
+                    continue
+        return indexes
+
+    def _journal_ends_with_new_line(self) -> bool:
+        """Check the last byte of the journal, without reading the whole file."""
+        with self.journal_file.open("rb") as journal:
+            journal.seek(-1, os.SEEK_END)
+            return journal.read(1) == b"\n"
+
+    def apply(self, yes: bool, dry_run: bool, verbose: bool) -> None:
+        """Apply the renames in the plan that are not in the journal yet."""
+        applied = self.applied_indexes()
+        with self.plan_file.open() as plan:
+            total = sum(1 for _ in plan)
+        pending = total - len(applied)
+        if not pending:
+            click.secho(f"{self.plan_file}: All {total} renames were already applied.", fg=COLOR_OK)
+            return
+        if applied:
+            click.echo(f"{self.plan_file}: Resuming after {len(applied)} of {total} renames")
+        if not dry_run and not yes:
+            click.confirm(f"{self.plan_file}: Apply {pending} renames?", default=False, abort=True)
+
+        renamed = 0
+        with self.plan_file.open() as plan, ExitStack() as stack:
+            # A dry run doesn't create the journal, so the plan isn't taken as started by the next run
+            journal = None if dry_run else stack.enter_context(self.journal_file.open("a"))
+            if journal and journal.tell() and not self._journal_ends_with_new_line():
+                # Start a new line after a partial line written before a crash
+                journal.write("\n")
+            for index, line in enumerate(plan):
+                if index in applied:
+                    continue
+                entry = json.loads(line)
+                original, new = Path(entry["from"]), Path(entry["to"])
+                if dry_run or verbose:
+                    echo_dry_run(f"from: {original}", dry_run=dry_run)
+                    echo_dry_run("  to: ", nl=False, dry_run=dry_run)
+                    click.secho(str(new), fg="yellow")
+                if not journal:
+                    continue
+
+                # The rename might have happened before a crash, without being written to the journal
+                merged = False
+                if original.exists() or not new.exists():
+                    merged = rename_path(original, new)
+                entry.update(index=index, merged=merged)
+                journal.write(json.dumps(entry) + "\n")
+                journal.flush()
+                renamed += 1
+        if not dry_run:
+            click.secho(f"{self.plan_file}: {renamed} renames applied succesfully.", fg=COLOR_CHANGED)
+
+    def undo(self, yes: bool, dry_run: bool, verbose: bool) -> None:
+        """Undo the renames in the journal, from the last to the first one.
+
+        The journal is truncated after each undone rename, so an interrupted undo can also be resumed.
+        """
+        if not self.journal_file.exists():
+            click.secho(f"{self.journal_file}: There is no journal to undo.", fg=COLOR_OK)
+            return
+        with self.journal_file.open("rb") as journal:
+            lines = journal.readlines()
+        if not dry_run and not yes:
+            click.confirm(f"{self.journal_file}: Undo {len(lines)} renames?", default=False, abort=True)
+
+        offsets = list(accumulate(len(line) for line in lines))
+        with self.journal_file.open("r+b") as journal:
+            for position in reversed(range(len(lines))):
+                try:
+                    entry = json.loads(lines[position])
+                except json.JSONDecodeError:
+                    entry = {}
+                if entry:
+                    original, new = Path(entry["from"]), Path(entry["to"])
+                    if dry_run or verbose:
+                        echo_dry_run(f"from: {new}", dry_run=dry_run)
+                        echo_dry_run("  to: ", nl=False, dry_run=dry_run)
+                        click.secho(str(original), fg="yellow")
+                    if dry_run:
+                        continue
+                    if entry.get("merged"):
+                        click.secho(f"Merged directories can't be undone: {new}", err=True, fg="red")
+                    else:
+                        os.rename(new, original)
+                journal.truncate(offsets[position - 1] if position else 0)
+        if not dry_run:
+            self.journal_file.unlink()
+            click.secho(f"{self.plan_file}: {len(lines)} renames undone.", fg=COLOR_CHANGED)
+
+
 def relative_to_home(full_path: Union[str, Path]):
     """Return a directory with ``~`` instead of printing the home dir full path."""
     path_obj = Path(full_path)
-    return f"~/{path_obj.relative_to(path_obj.home())}"
+    try:
+        return f"~/{path_obj.relative_to(path_obj.home())}"
+    except ValueError:
+        return str(path_obj)
 
 
 def slugify_camel_iso(old_string: str) -> str:
@@ -231,34 +763,11 @@ def slugify_camel_iso(old_string: str) -> str:
 
     slugged = slugify(temp_string, separator=SLUG_SEPARATOR).capitalize()
 
-    next_ten_years = pendulum.today().year + 10
+    next_ten_years = date.today().year + 10
 
     def try_date(matchobj):
         original_string = matchobj.group(0)
-        actual_date = None
-        which_format = "YYYY-MM-DD"
-        for date_format in POSSIBLE_FORMATS:
-            # Only try formats with the same size; Pendulum is too permissive and returns wrong dates.
-            if len(original_string) != len(date_format):
-                continue
-
-            try:
-                actual_date = pendulum.from_format(original_string, date_format)
-
-                # If the year has only 2 digits, consider it as between 1929 and 2029
-                format_has_century = "YYYY" in date_format
-                if not format_has_century and actual_date.year > next_ten_years:
-                    actual_date = actual_date.subtract(years=100)
-
-                if "HH" in date_format:
-                    which_format = "YYYY-MM-DDTHH-mm-ss"
-                elif "DD" not in date_format:
-                    which_format = "YYYY-MM"
-                break
-            except ValueError:
-                continue
-
-        new_date = actual_date.format(which_format) if actual_date else original_string
+        new_date = format_date_time(original_string, next_ten_years) or original_string
         return f"{SLUG_SEPARATOR}{new_date}{SLUG_SEPARATOR}"
 
     replaced_dates_multiple_seps = REGEX_DATE_TIME.sub(try_date, slugged)
@@ -267,8 +776,59 @@ def slugify_camel_iso(old_string: str) -> str:
     return corrected_case.strip(SLUG_SEPARATOR)
 
 
-def merge_directories(target_dir: PathOrStr, *source_dirs: PathOrStr, dry_run: bool = False):
-    """Merge directories into one, keeping subdirectories and renaming files with the same name."""
+def format_date_time(text: str, next_ten_years: int) -> Optional[str]:
+    """Format a date/time string as ISO, using the first possible format with the same layout that is a valid date.
+
+    A year with only 2 digits is moved to the previous century if it is after ``next_ten_years``.
+
+    >>> format_date_time("30_12_2017", 2030)
+    '2017-12-30'
+    >>> format_date_time("20191020", 2030)
+    '2019-10-20'
+    >>> format_date_time("101020191830", 2030)
+    '2019-10-10T18-30-00'
+    >>> format_date_time("08_1975", 2030)
+    '1975-08'
+    >>> format_date_time("290875", 2030)
+    '1975-08-29'
+    >>> format_date_time("31_02_2019", 2030) is None
+    True
+    >>> format_date_time("614", 2030) is None
+    True
+    """
+    for date_format in DATE_FORMATS_BY_LAYOUT.get(text.translate(DIGITS_TO_LAYOUT), ()):
+        values = {"day": 1, "hour": 0, "minute": 0, "second": 0}
+        for field, start, end in date_format.fields:
+            values[field] = int(text[start:end])
+        year = values["year"]
+        if not date_format.has_century:
+            year += 2000 if year <= 68 else 1900
+        try:
+            datetime(year, values["month"], values["day"], values["hour"], values["minute"], values["second"])
+        except ValueError:
+            continue
+
+        if not date_format.has_century and year > next_ten_years:
+            year -= 100
+        if date_format.has_time:
+            return (
+                f"{year:d}-{values['month']:02d}-{values['day']:02d}"
+                f"T{values['hour']:02d}-{values['minute']:02d}-{values['second']:02d}"
+            )
+        if not date_format.has_day:
+            return f"{year:d}-{values['month']:02d}"
+        return f"{year:d}-{values['month']:02d}-{values['day']:02d}"
+    return None
+
+
+def merge_directories(
+    target_dir: PathOrStr, *source_dirs: PathOrStr, dry_run: bool = False, jobs: int = 4, dedupe: bool = False
+):
+    """Merge directories into one, keeping subdirectories and renaming files with the same name.
+
+    Files on another device are copied and then removed, by a pool of ``jobs`` threads.
+    With ``dedupe``, a file with the same contents as the file it collides with (or one of its copies) is removed.
+    """
     echo = partial(echo_dry_run, dry_run=dry_run)
     target_color = "green"
     source_color = "bright_blue"
@@ -278,58 +838,169 @@ def merge_directories(target_dir: PathOrStr, *source_dirs: PathOrStr, dry_run: b
         click.secho("Target is not a directory", err=True, fg="red")
         return False
 
-    for source_dir in source_dirs:
-        echo(f"Source: {source_dir}", fg=source_color)
-        if not Path(source_dir).is_dir():
-            click.secho("Source is not a directory", err=True, fg="red")
-            continue
-
-        for path in sorted(Path(source_dir).rglob("*")):
-            if path.is_dir() or path.stem in IGNORE_FILES_ON_MERGE:
+    target_dir = Path(target_dir)
+    target_device = target_dir.stat().st_dev
+    unique_names = UniqueNames()
+    hashes = FileHashes().load() if dedupe else None
+    moving: Set[Path] = set()
+    with FileMover(jobs) as mover:
+        for source_dir in source_dirs:
+            echo(f"Source: {source_dir}", fg=source_color)
+            if not Path(source_dir).is_dir():
+                click.secho("Source is not a directory", err=True, fg="red")
                 continue
-
-            new_path = unique_file_name(target_dir / path.relative_to(source_dir))
-            echo(f"Moving {dir_with_end_slash(source_dir)}", nl=False)
-            click.secho(str(path.relative_to(source_dir)), fg=source_color, nl=False)
-            click.secho(f" to {dir_with_end_slash(target_dir)}", nl=False)
-            click.secho(str(new_path.relative_to(target_dir)), fg=target_color)
-            if not dry_run:
-                new_path.parent.mkdir(parents=True, exist_ok=True)
-                path.rename(new_path)
+            cross_device = Path(source_dir).stat().st_dev != target_device
+
+            for path in sorted(Path(source_dir).rglob("*")):
+                if path.is_dir() or path.stem in IGNORE_FILES_ON_MERGE:
+                    continue
+
+                if hashes:
+                    candidates = list(unique_names.taken(target_dir / path.relative_to(source_dir)))
+                    if moving.intersection(candidates):
+                        # Files still being copied can't be compared yet
+                        mover.wait_all()
+                        moving.clear()
+                    duplicate = hashes.duplicate_of(path, candidates)
+                    if duplicate:
+                        echo(f"Dropping {dir_with_end_slash(source_dir)}", nl=False)
+                        click.secho(str(path.relative_to(source_dir)), fg=source_color, nl=False)
+                        click.secho(f", same as {dir_with_end_slash(target_dir)}", nl=False)
+                        click.secho(str(duplicate.relative_to(target_dir)), fg=target_color)
+                        if not dry_run:
+                            path.unlink()
+                        continue
+
+                new_path = unique_names.allocate(target_dir / path.relative_to(source_dir))
+                echo(f"Moving {dir_with_end_slash(source_dir)}", nl=False)
+                click.secho(str(path.relative_to(source_dir)), fg=source_color, nl=False)
+                click.secho(f" to {dir_with_end_slash(target_dir)}", nl=False)
+                click.secho(str(new_path.relative_to(target_dir)), fg=target_color)
+                if not dry_run:
+                    new_path.parent.mkdir(parents=True, exist_ok=True)
+                    if cross_device:
+                        mover.submit(path, new_path)
+                        moving.add(new_path)
+                    else:
+                        try:
+                            path.rename(new_path)
+                        except OSError as err:
+                            # A mount point inside the source directory
+                            if err.errno != errno.EXDEV:
+                                raise
+                            mover.submit(path, new_path)
+                            moving.add(new_path)
+                # Register created subdirectories, except the target itself
+                for parent in list(new_path.relative_to(target_dir).parents)[:-1]:
+                    unique_names.add(target_dir / parent)
+    if hashes:
+        hashes.save()
 
 
 @click.command()
 @dry_run_option
+@click.option(
+    "--jobs", "-j", default=4, show_default=True, help="Number of threads used to move files to another device"
+)
+@click.option(
+    "--dedupe", default=False, is_flag=True, help="Remove files with the same contents, instead of creating copies"
+)
 @click.argument(
     "target_directory", nargs=1, type=click.Path(exists=True, file_okay=False, dir_okay=True), required=True
 )
 @click.argument(
     "source_directories", nargs=-1, type=click.Path(exists=True, file_okay=False, dir_okay=True), required=True
 )
-def merge_dirs(dry_run: bool, target_directory, source_directories):
+def merge_dirs(dry_run: bool, jobs: int, dedupe: bool, target_directory, source_directories):
     """Merge directories into one, keeping subdirectories and renaming files with the same name."""
-    merge_directories(target_directory, *source_directories, dry_run=dry_run)
+    merge_directories(target_directory, *source_directories, dry_run=dry_run, jobs=jobs, dedupe=dedupe)
 
 
 def unique_file_name(path_or_str: PathOrStr) -> Path:
     """Unique file name: append a number to the file name until the file is not found."""
     path = Path(path_or_str)
     while path.exists():
-        original_stem = None
-        index = None
-        for match in REGEX_UNIQUE_FILE.finditer(path.stem):
-            original_stem = match.group("original_stem")
-            index = int(match.group("index") or 0) + 1
-
-        if not original_stem:
-            new_stem = path.stem
-        else:
-            new_stem = original_stem
+        path = next_copy_name(path)
+    return path
 
-        new_name = f"{new_stem}_Copy{index if index else ''}{path.suffix}"
-        path = path.with_name(new_name)
 
-    return path
+def next_copy_name(path: Path) -> Path:
+    """Next candidate for a unique file name: ``name_Copy.ext``, then ``name_Copy1.ext``, ``name_Copy2.ext``...
+
+    >>> next_copy_name(Path("/tmp/file.txt"))
+    PosixPath('/tmp/file_Copy.txt')
+    >>> next_copy_name(Path("/tmp/file_Copy.txt"))
+    PosixPath('/tmp/file_Copy1.txt')
+    >>> next_copy_name(Path("/tmp/file_copy9.txt"))
+    PosixPath('/tmp/file_Copy10.txt')
+    """
+    original_stem = None
+    index = None
+    for match in REGEX_UNIQUE_FILE.finditer(path.stem):
+        original_stem = match.group("original_stem")
+        index = int(match.group("index") or 0) + 1
+
+    if not original_stem:
+        new_stem = path.stem
+    else:
+        new_stem = original_stem
+
+    new_name = f"{new_stem}_Copy{index if index else ''}{path.suffix}"
+    return path.with_name(new_name)
+
+
+class UniqueNames:
+    """Allocate unique file names with the same scheme as ``unique_file_name()``, for a batch of files.
+
+    Each target directory is listed only once; names are then checked and allocated in memory.
+    The last name allocated for each original path is kept, so the next search starts from there.
+    """
+
+    def __init__(self) -> None:
+        self.names: Dict[Path, Set[str]] = {}
+        self.folded_names: Dict[Path, Set[str]] = {}
+        self.last_allocated: Dict[Path, Path] = {}
+
+    def _names(self, directory: Path) -> Set[str]:
+        """Names in a directory, listing it on the first call."""
+        names = self.names.get(directory)
+        if names is None:
+            try:
+                names = set(os.listdir(directory))
+            except (FileNotFoundError, NotADirectoryError):
+                names = set()
+            self.names[directory] = names
+            self.folded_names[directory] = {name.casefold() for name in names}
+        return names
+
+    def exists(self, path: Path) -> bool:
+        """Check if a path exists (or was allocated)."""
+        if path.name in self._names(path.parent):
+            return True
+        # Only hit the file system on case-insensitive matches, to support case-insensitive file systems
+        return path.name.casefold() in self.folded_names[path.parent] and path.exists()
+
+    def add(self, path: Path) -> None:
+        """Add a path to the names of its directory."""
+        self._names(path.parent).add(path.name)
+        self.folded_names[path.parent].add(path.name.casefold())
+
+    def taken(self, path_or_str: PathOrStr) -> Iterator[Path]:
+        """Existing (or allocated) names for a path: the path itself and its copies, until a name is free."""
+        path = Path(path_or_str)
+        while self.exists(path):
+            yield path
+            path = next_copy_name(path)
+
+    def allocate(self, path_or_str: PathOrStr) -> Path:
+        """Return a unique name for a path, and reserve it."""
+        original = Path(path_or_str)
+        path = self.last_allocated.get(original, original)
+        while self.exists(path):
+            path = next_copy_name(path)
+        self.add(path)
+        self.last_allocated[original] = path
+        return path
 
 
 def dir_with_end_slash(path: PathOrStr) -> str:
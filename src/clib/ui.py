@@ -3,21 +3,15 @@
 import sys
 import time
 from pathlib import Path
-from subprocess import PIPE, CalledProcessError
 
 import click
 
 
 def notify(title, message):
     """If terminal-notifier is installed, use it to display a notification."""
-    from clib.files import shell
-
-    check = "which" if sys.platform == "linux" else "command -v"
-    try:
-        terminal_notifier_path = shell(f"{check} terminal-notifier", check=True, stdout=PIPE).stdout.strip()
-    except CalledProcessError:
-        terminal_notifier_path = ""
-    if terminal_notifier_path:
+    from clib.files import shell, which
+
+    if which("terminal-notifier"):
         shell(
             'terminal-notifier -title "{}: {} complete" -message "Successfully {} dev environment."'.format(
                 Path(__file__).name, title, message
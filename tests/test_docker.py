@@ -0,0 +1,427 @@
+"""Docker tests."""
+
+import gzip
+import json
+import os
+import shutil
+import stat
+import sys
+import threading
+from pathlib import Path
+from time import time
+
+import pytest
+from testfixtures import compare
+
+from clib import docker, files
+from clib.config import JsonConfig
+from clib.docker import (
+    ChunkStore,
+    ContainerCache,
+    DockerContainer,
+    YmlIndex,
+    YmlWatcher,
+    backup_volume,
+    docker_volume,
+    rescan_files,
+    save_yml_files,
+    snapshot_volume,
+)
+from clib.files import ExecutableResolver, Inotify
+
+
+def test_yml_watcher(tmp_path):
+    """Test the index of yml files kept up to date with inotify events."""
+    projects = tmp_path / "projects"
+    (projects / "one").mkdir(parents=True)
+    (projects / "one" / "docker-compose.yml").touch()
+    other = tmp_path / "other"
+    other.mkdir()
+    dirs_config = JsonConfig(tmp_path / "config" / "dirs.json")
+    files_config = JsonConfig(tmp_path / "config" / "files.json")
+    dirs_config.dump([str(projects)])
+
+    def index():
+        return [os.path.relpath(file, tmp_path) for file in files_config.load_set()]
+
+    with Inotify() as inotify:
+        watcher = YmlWatcher(inotify, dirs_config, files_config).start()
+        compare(actual=index(), expected=["projects/one/docker-compose.yml"])
+
+        (projects / "two" / "deep").mkdir(parents=True)
+        (projects / "two" / "deep" / "docker-compose.yml").touch()
+        (projects / "two" / "deep" / "other.yml").touch()
+        (projects / "one" / "docker-compose.yml").unlink()
+        watcher.run(timeout=0.2)
+        compare(actual=index(), expected=["projects/two/deep/docker-compose.yml"])
+
+        (projects / "two").rename(projects / "three")
+        (other / "docker-compose.yml").touch()
+        watcher.run(timeout=0.2)
+        compare(actual=index(), expected=["projects/three/deep/docker-compose.yml"])
+
+        dirs_config.dump([str(projects), str(other)])
+        watcher.run(timeout=0.2)
+        compare(actual=sorted(index()), expected=["other/docker-compose.yml", "projects/three/deep/docker-compose.yml"])
+
+        shutil.rmtree(projects / "three")
+        (projects / "three").mkdir()
+        (projects / "three" / "docker-compose.yml").touch()
+        watcher.run(timeout=0.2)
+        compare(actual=sorted(index()), expected=["other/docker-compose.yml", "projects/three/docker-compose.yml"])
+
+
+def test_rescan_files(tmp_path, monkeypatch):
+    """Test the parallel rescan, reusing the cached tree of directories that didn't change."""
+    for name in ("YML_DIRS", "YML_FILES", "YML_CACHE"):
+        monkeypatch.setattr(docker, name, JsonConfig(tmp_path / "config" / f"{name}.json"))
+    one = tmp_path / "one"
+    two = tmp_path / "two"
+    for path in (one / "a" / "docker-compose.yml", one / "b" / "compose.yaml", two / "docker-compose.prod.yml"):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.touch()
+    (one / "a" / "notes.yml").touch()
+
+    def index():
+        return sorted(os.path.relpath(file, tmp_path) for file in docker.YML_FILES.load_set())
+
+    rescan_files([str(one)], jobs=2)
+    compare(actual=index(), expected=["one/a/docker-compose.yml", "one/b/compose.yaml"])
+
+    # Only the new directory is scanned
+    (one / "c").mkdir()
+    (one / "c" / "docker-compose.yml").touch()
+    rescan_files([str(one), str(two)], [str(two)])
+    compare(actual=index(), expected=["one/a/docker-compose.yml", "one/b/compose.yaml", "two/docker-compose.prod.yml"])
+
+    # A full rescan only lists the directories that changed
+    scanned = []
+    original_scandir = os.scandir
+    monkeypatch.setattr(os, "scandir", lambda path: scanned.append(path) or original_scandir(path))
+    rescan_files([str(one), str(two)])
+    compare(actual=scanned, expected=[str(one), str(one / "c")])
+    assert "one/c/docker-compose.yml" in index()
+
+    # Removing a directory doesn't scan anything
+    scanned.clear()
+    rescan_files([str(two)], scan_dirs=[])
+    compare(actual=index(), expected=["two/docker-compose.prod.yml"])
+    compare(actual=scanned, expected=[])
+
+
+def test_yml_index(tmp_path, monkeypatch):
+    """Test the index of path components: ranked matches, prefix lookups, and a rebuild when the yml files change."""
+    files_config = JsonConfig(tmp_path / "files.json")
+    save_yml_files(
+        [
+            "/code/rapid/docker-compose.yml",
+            "/code/api/docker-compose.yml",
+            "/code/apis/compose.yaml",
+            "/code/web/a.yml",
+        ],
+        files_config,
+    )
+    index = YmlIndex(files_config)
+    text = (tmp_path / "files-index.txt").read_text()
+    assert "\napi\t0\n" in text
+    assert text.endswith("\n/code/rapid/docker-compose.yml\n/code/web/a.yml\n")
+
+    # A lookup reads the index only
+    monkeypatch.setattr(JsonConfig, "load_set", lambda self: pytest.fail("the JSON file was parsed"))
+    compare(
+        actual=index.search("api"),
+        expected=["/code/api/docker-compose.yml", "/code/apis/compose.yaml", "/code/rapid/docker-compose.yml"],
+    )
+    compare(actual=index.prefix_matches("api"), expected=["/code/api/docker-compose.yml", "/code/apis/compose.yaml"])
+    compare(actual=index.prefix_matches("a.y"), expected=["/code/web/a.yml"])
+    compare(actual=index.search("web/a"), expected=["/code/web/a.yml"])
+    compare(actual=index.search("nothing"), expected=[])
+    # Not found in the offsets of the files
+    compare(actual=index.search("2"), expected=[])
+    compare(actual=index.prefix_matches("zzz"), expected=[])
+    monkeypatch.undo()
+
+    files_config.dump(["/other/api-v2/docker-compose.yml"])
+    os.utime(tmp_path / "files-index.txt", ns=(0, 0))
+    compare(actual=index.prefix_matches("api"), expected=["/other/api-v2/docker-compose.yml"])
+    save_yml_files([], files_config)
+    compare(actual=index.search("api"), expected=[])
+
+
+@pytest.fixture()
+def fake_docker(tmp_path, monkeypatch):
+    """A fake docker binary that logs its arguments, and inspects containers from JSON files."""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    script = bin_dir / "docker"
+    script.write_text(f"""#!{sys.executable}
+import json, os, sys
+from pathlib import Path
+bin_dir = Path(__file__).parent
+with open(bin_dir / "calls.log", "a") as log:
+    log.write(" ".join(sys.argv[1:]) + "\\n")
+if sys.argv[1] == "inspect":
+    found = [json.loads((bin_dir / f"{{name}}.json").read_text()) for name in sys.argv[2:] if (bin_dir / f"{{name}}.json").exists()]
+    print(json.dumps(found))
+    sys.exit(0 if len(found) == len(sys.argv) - 2 else 1)
+if sys.argv[1] == "run" and os.environ.get("FAKE_VOLUMES"):
+    # Volumes are directories on the host: archive or extract them with a real tar stream
+    import tarfile
+    command = sys.argv[sys.argv.index("busybox") + 1 :]
+    if command[0] == "find":
+        # Only "find PATH -exec stat -c FORMAT {{}} +", with the format of the snapshots
+        import grp, pwd
+        def walk(host, name):
+            yield host, name
+            if os.path.isdir(host) and not os.path.islink(host):
+                for child in sorted(os.listdir(host)):
+                    yield from walk(os.path.join(host, child), name + "/" + child)
+        for host, name in walk(os.environ["FAKE_VOLUMES"] + command[1][len("/volumes"):], command[1]):
+            st = os.lstat(host)
+            try:
+                user = pwd.getpwuid(st.st_uid).pw_name
+            except KeyError:
+                user = "UNKNOWN"
+            try:
+                group = grp.getgrgid(st.st_gid).gr_name
+            except KeyError:
+                group = "UNKNOWN"
+            print(f"{{st.st_mode:x}} {{st.st_uid}} {{st.st_gid}} {{st.st_size}} {{int(st.st_mtime)}} {{st.st_nlink}} {{user}} {{group}} {{name}}")
+        sys.exit(0)
+    if "-T" in command:
+        with tarfile.open(fileobj=sys.stdout.buffer, mode="w|") as archive:
+            for name in sys.stdin.read().splitlines():
+                archive.add(os.environ["FAKE_VOLUMES"] + name[len("/volumes"):], arcname=name.lstrip("/"), recursive=False)
+        sys.exit(0)
+    path = command[command.index("-C") + 1] if "-C" in command else command[-1]
+    volume = os.path.join(os.environ["FAKE_VOLUMES"], path.rstrip("/").rsplit("/", 1)[-1])
+    if command[:2] == ["tar", "cf"]:
+        with tarfile.open(fileobj=sys.stdout.buffer, mode="w|") as archive:
+            archive.add(volume, arcname=path.lstrip("/"))
+    elif command[:2] == ["tar", "xf"]:
+        strip = int(command[command.index("--strip-components") + 1]) if "--strip-components" in command else 0
+        with tarfile.open(fileobj=sys.stdin.buffer, mode="r|") as archive:
+            for member in archive:
+                member.name = "/".join(member.name.split("/")[strip:])
+                if member.name:
+                    archive.extract(member, volume)
+elif sys.argv[1] == "run":
+    volume = sys.argv[-1].rsplit("/", 1)[-1]
+    if volume == "broken":
+        print("no such volume", file=sys.stderr)
+        sys.exit(2)
+    sys.stdout.buffer.write(f"tar of {{volume}}\\n".encode() * 1000)
+""")
+    script.chmod(0o755)
+    for name, mounts in {"db": {"/data": "/var/lib/db", "/data/backups/": "/backups"}, "web": {}}.items():
+        info = {
+            "Id": f"{name}123",
+            "Name": f"/{name}",
+            "Mounts": [{"Source": s, "Destination": d} for s, d in mounts.items()],
+        }
+        (bin_dir / f"{name}.json").write_text(json.dumps(info))
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    return bin_dir / "calls.log"
+
+
+def test_container_cache(tmp_path, fake_docker):
+    """Test containers inspected in one batch, cached in the process and on disk with a TTL."""
+    config = JsonConfig(tmp_path / "inspect.json")
+    cache = ContainerCache(ttl=60, config=config)
+    compare(actual=[info["Id"] for info in cache.inspect("db", "web")], expected=["db123", "web123"])
+    assert cache.inspect("web")[0]["Name"] == "/web"
+    compare(actual=fake_docker.read_text().splitlines(), expected=["inspect db web"])
+
+    # Another process reuses the cache file, until the TTL expires
+    assert ContainerCache(ttl=60, config=config).inspect("db")[0]["Id"] == "db123"
+    assert len(fake_docker.read_text().splitlines()) == 1
+    assert ContainerCache(ttl=0, config=config).inspect("db")[0]["Id"] == "db123"
+    assert len(fake_docker.read_text().splitlines()) == 2
+
+    with pytest.raises(LookupError, match="missing"):
+        cache.inspect("db", "missing")
+
+
+def test_container_cache_matches_names_and_ids(tmp_path, fake_docker):
+    """Test that a name is not matched to another container whose ID starts with it."""
+    bin_dir = fake_docker.parent
+    (bin_dir / "db12.json").write_text(json.dumps({"Id": "77aa", "Name": "/db12"}))
+    (bin_dir / "0123456789ab.json").write_text(json.dumps({"Id": "0123456789abcdef", "Name": "/hexy"}))
+    cache = ContainerCache(ttl=0)
+    compare(actual=[info["Name"] for info in cache.inspect("db", "db12")], expected=["/db", "/db12"])
+    assert cache.inspect("0123456789ab")[0]["Name"] == "/hexy"
+
+
+def test_replace_mount_dir(tmp_path, fake_docker):
+    """Test the longest mounted dir is replaced, only on whole path components."""
+    container = DockerContainer("db", ContainerCache(ttl=0))
+    assert container.replace_mount_dir(Path("/data/pg/file.sql")) == Path("/var/lib/db/pg/file.sql")
+    assert container.replace_mount_dir(Path("/data/backups/x.sql")) == Path("/backups/x.sql")
+    assert container.replace_mount_dir(Path("/data")) == Path("/var/lib/db")
+    assert container.replace_mount_dir(Path("/database/x.sql")) == Path("/database/x.sql")
+    assert DockerContainer("web", ContainerCache(ttl=0)).replace_mount_dir(Path("/data/x")) == Path("/data/x")
+
+
+def test_backup_volumes(tmp_path, fake_docker, monkeypatch, capsys):
+    """Test volumes backed up in parallel, streamed to a compressor on the host."""
+    monkeypatch.setattr(files, "EXECUTABLES", ExecutableResolver(JsonConfig(tmp_path / "executables.json")))
+    result = backup_volume("pg", tmp_path, "gzip")
+    assert not result.error
+    assert gzip.decompress((tmp_path / "pg.tgz").read_bytes()) == b"tar of pg\n" * 1000
+    assert (result.tar_bytes, result.file_bytes) == (10_000, (tmp_path / "pg.tgz").stat().st_size)
+
+    result = backup_volume("broken", tmp_path, "gzip")
+    assert "docker exited with code 2: no such volume" in str(result)
+    compare(actual=sorted(path.name for path in tmp_path.glob("*.tgz*")), expected=["pg.tgz"])
+
+    monkeypatch.setattr(sys, "argv", ["docker-volume", "backup", "-j", "2", "-c", "none", str(tmp_path), "a", "b"])
+    docker_volume()
+    assert (tmp_path / "a.tar").read_bytes() == b"tar of a\n" * 1000
+    output = capsys.readouterr().out
+    assert "b: 8.8 KiB -> 8.8 KiB (100%)" in output
+    assert "Total: 17.6 KiB -> 17.6 KiB in 2 volumes" in output
+
+
+def test_backup_volume_errors(tmp_path, fake_docker, monkeypatch, capsys):
+    """Test a missing compressor and a full disk fail their volume only, without leaving partial files."""
+    monkeypatch.setattr(files, "EXECUTABLES", ExecutableResolver(JsonConfig(tmp_path / "executables.json")))
+    monkeypatch.setenv("PATH", str(fake_docker.parent))
+    result = backup_volume("pg", tmp_path, "zstd")
+    assert str(result) == "pg: failed, zstd was not found on the PATH"
+    assert not fake_docker.exists()
+
+    if not Path("/dev/full").exists():
+        pytest.skip("/dev/full is needed to fill the disk")
+    backup_dir = tmp_path / "backup"
+    backup_dir.mkdir()
+    (backup_dir / "full.tar.partial").symlink_to("/dev/full")
+    monkeypatch.setattr(sys, "argv", ["docker-volume", "backup", "-c", "none", str(backup_dir), "full", "ok"])
+    with pytest.raises(SystemExit):
+        docker_volume()
+    output = capsys.readouterr().out
+    assert "full: failed, [Errno 28] No space left on device" in output
+    assert "ok: 9.8 KiB -> 9.8 KiB (100%)" in output
+    compare(actual=sorted(path.name for path in backup_dir.iterdir()), expected=["ok.tar"])
+
+
+@pytest.mark.parametrize("compress", list(docker.BACKUP_EXTENSIONS))
+def test_backup_and_restore_volume(tmp_path, fake_docker, monkeypatch, capsys, compress):
+    """Test a volume restored from a backup in each format, decompressed on the host."""
+    monkeypatch.setattr(files, "EXECUTABLES", ExecutableResolver(JsonConfig(tmp_path / "executables.json")))
+    command = docker.compressor_command(compress)
+    if command and not shutil.which(command[0]):
+        pytest.skip(f"{command[0]} is not installed")
+    volumes = tmp_path / "volumes"
+    monkeypatch.setenv("FAKE_VOLUMES", str(volumes))
+    data = volumes / "pg.v2" / "_data"
+    (data / "sub").mkdir(parents=True)
+    (data / "sub" / "a.txt").write_text("a" * 1000)
+    (data / "b.bin").write_bytes(os.urandom(1024))
+
+    result = backup_volume("pg.v2", tmp_path, compress)
+    assert not result.error
+    monkeypatch.setattr(sys, "argv", ["docker-volume", "restore", str(result.file)])
+    docker_volume()
+    calls = fake_docker.read_text()
+    assert "rm -rf /docker/volumes/pg.v2\n" in calls
+    assert "tar xf - -C /docker/volumes/pg.v2/ --strip-components 2\n" in calls
+
+    monkeypatch.setattr(sys, "argv", ["docker-volume", "restore", str(result.file), "copy"])
+    docker_volume()
+    restored = volumes / "copy" / "_data"
+    compare(
+        actual=sorted(str(path.relative_to(restored)) for path in restored.rglob("*")),
+        expected=["b.bin", "sub", "sub/a.txt"],
+    )
+    assert (restored / "b.bin").read_bytes() == (data / "b.bin").read_bytes()
+    assert (restored / "sub" / "a.txt").read_text() == "a" * 1000
+
+
+def test_volume_snapshots(tmp_path, fake_docker, monkeypatch, capsys):
+    """Test incremental snapshots: only new chunks are stored, any snapshot can be restored, and gc."""
+    monkeypatch.setattr(docker, "SNAPSHOT_CHUNK_SIZE", 1024)
+    volumes = tmp_path / "volumes"
+    monkeypatch.setenv("FAKE_VOLUMES", str(volumes))
+    data = volumes / "pg" / "_data"
+    (data / "sub").mkdir(parents=True)
+    (data / "big.bin").write_bytes(os.urandom(10 * 1024))
+    (data / "sub" / "same.txt").write_text("same")
+    (data / "sub" / "copy.txt").write_text("same")
+    (data / "link").symlink_to("sub/same.txt")
+    # Files modified before a snapshot started can be skipped by the next one
+    for path in [*data.rglob("*"), data]:
+        os.utime(path, (time() - 100, time() - 100), follow_symlinks=False)
+    (volumes / "pg").chmod(0o750)
+    backup_dir = tmp_path / "backup"
+    backup_dir.mkdir()
+    store = ChunkStore(backup_dir)
+
+    def snapshot(*args):
+        monkeypatch.setattr(sys, "argv", ["docker-volume", *args])
+        docker_volume()
+        return capsys.readouterr().out
+
+    assert "11 of 12 chunks were new" in snapshot("snapshot", str(backup_dir), "pg")
+    first = sorted(store.manifests())[0]
+
+    with open(data / "big.bin", "r+b") as file:
+        file.seek(2048)
+        file.write(b"changed")
+    (data / "sub" / "copy.txt").unlink()
+    output = snapshot("snapshot", str(backup_dir), "pg")
+    # Only the changed file was read
+    assert "10.0 KiB read (1 unchanged files skipped); 1 of 11 chunks were new" in output
+    assert "tar cf - -T -\n" in fake_docker.read_text()
+
+    snapshot("snapshot-restore", str(first), "restored")
+    restored = volumes / "restored" / "_data"
+    assert (restored / "sub" / "copy.txt").read_text() == "same"
+    assert os.readlink(restored / "link") == "sub/same.txt"
+    assert (restored / "big.bin").read_bytes()[2048:2055] != b"changed"
+    assert stat.S_IMODE((volumes / "restored").stat().st_mode) == 0o750
+
+    first.unlink()
+    assert "[dry-run] 1 unreferenced chunks removed" in snapshot("snapshot-gc", "-n", str(backup_dir))
+    assert "1 unreferenced chunks removed" in snapshot("snapshot-gc", str(backup_dir))
+    latest = sorted(store.manifests())[0]
+    snapshot("snapshot-restore", str(latest), "latest")
+    assert (volumes / "latest" / "_data" / "big.bin").read_bytes() == (data / "big.bin").read_bytes()
+    assert not (volumes / "latest" / "_data" / "sub" / "copy.txt").exists()
+    assert (volumes / "latest" / "_data" / "sub" / "same.txt").read_text() == "same"
+    assert stat.S_IMODE((volumes / "latest").stat().st_mode) == 0o750
+
+    # A snapshot with missing chunks is not restored, and the volume is left untouched
+    chunks = [digest for entry in json.loads(latest.read_text())["entries"] for digest in entry.get("chunks", [])]
+    store.chunk_path(chunks[0]).unlink()
+    with pytest.raises(SystemExit):
+        snapshot("snapshot-restore", str(latest), "incomplete")
+    assert "/docker/volumes/incomplete" not in fake_docker.read_text()
+
+
+def test_snapshot_stops_when_chunks_cant_be_written(tmp_path, fake_docker, monkeypatch):
+    """Test a full disk fails the snapshot, without a manifest."""
+    monkeypatch.setenv("FAKE_VOLUMES", str(tmp_path / "volumes"))
+    (tmp_path / "volumes" / "pg" / "_data").mkdir(parents=True)
+    (tmp_path / "volumes" / "pg" / "_data" / "a.txt").write_text("a")
+
+    def disk_full(self, data):
+        raise OSError(28, "No space left on device")
+
+    monkeypatch.setattr(ChunkStore, "add", disk_full)
+    store = ChunkStore(tmp_path)
+    assert str(snapshot_volume("pg", store)) == "pg: failed, [Errno 28] No space left on device"
+    compare(actual=list(store.manifests()), expected=[])
+
+
+def test_snapshot_gc_waits_for_snapshots(tmp_path):
+    """Test that gc doesn't remove chunks while a snapshot holds the lock of the store."""
+    store = ChunkStore(tmp_path)
+    with store.lock():
+        digest, _ = store.add(b"not referenced yet")
+        gc = threading.Thread(target=store.gc)
+        gc.start()
+        gc.join(0.2)
+        assert gc.is_alive()
+        assert store.chunk_path(digest).exists()
+    gc.join(5)
+    assert not store.chunk_path(digest).exists()
@@ -1,11 +1,44 @@
 """File tests."""
 
+import json
+import os
+import shutil
+import subprocess
+import sys
 from pathlib import Path
 from textwrap import dedent
+from time import monotonic, sleep
+from typing import List
 
+import click
+import pytest
+from click.testing import CliRunner
 from testfixtures import compare
 
-from clib.rename import merge_directories, unique_file_name
+from clib import files, rename
+from clib.config import JsonConfig
+from clib.files import (
+    ExecutableResolver,
+    FileMover,
+    find_paths,
+    find_pids,
+    fzf,
+    native_sync,
+    parse_rsync_number,
+    rm_broken_symlinks,
+    sync_dir,
+    wait_for_process,
+)
+from clib.rename import (
+    DirIndex,
+    SlugCache,
+    UniqueNames,
+    merge_directories,
+    rename_slugify,
+    scan_tree,
+    slugify_many,
+    unique_file_name,
+)
 
 
 def test_unique_file_name(tmp_path):
@@ -63,3 +96,463 @@ def test_merge_directories(tmp_path):
     """
     actual = sorted(str(path.relative_to(tmp_path)) for path in tmp_path.rglob("*") if path.is_file())
     compare(actual=actual, expected=dedent(expected).strip().splitlines())
+
+
+def test_slug_cache_is_persisted_and_bounded(tmp_path):
+    """Test the LRU slug cache: evict the least recently used slug, then reload it from disk."""
+    config = JsonConfig(tmp_path / "cache.json")
+    cache = SlugCache(2, config).load()
+    assert cache.slugify("first Name") == "First_Name"
+    assert cache.slugify("second 20191020") == "Second_2019-10-20"
+    assert cache.slugify("first Name") == "First_Name"
+    assert cache.slugify("third") == "Third"
+    assert (cache.hits, cache.misses) == (1, 3)
+    compare(actual=list(cache.slugs), expected=["first Name", "third"])
+    cache.save()
+
+    reloaded = SlugCache(2, config).load()
+    assert reloaded.slugify("third") == "Third"
+    assert (reloaded.hits, reloaded.misses) == (1, 0)
+
+    config.dump({"version": "old rules", "slugs": {"third": "Wrong"}})
+    assert SlugCache(2, config).load().slugify("third") == "Third"
+
+
+def test_scan_tree_prunes_hidden_and_excluded_dirs(tmp_path):
+    """Test the scandir walker: hidden and excluded subtrees are pruned, symlinks to dirs are not followed."""
+    create(tmp_path / "keep" / "one.txt")
+    create(tmp_path / "keep" / ".hidden.txt")
+    create(tmp_path / ".git" / "config")
+    create(tmp_path / "skip" / "two.txt")
+    create(tmp_path / "skip_not" / "three.txt")
+    (tmp_path / "link").symlink_to(tmp_path / "keep")
+
+    actual = sorted(
+        (str(path.relative_to(tmp_path)), is_dir) for path, is_dir in scan_tree(tmp_path, {str(tmp_path / "skip")})
+    )
+    expected = [
+        ("keep", True),
+        ("keep/one.txt", False),
+        ("link", True),
+        ("skip_not", True),
+        ("skip_not/three.txt", False),
+    ]
+    compare(actual=actual, expected=expected)
+    assert not list(scan_tree(tmp_path / "keep", {str(tmp_path)}))
+
+
+def test_slugify_many_in_parallel(tmp_path, monkeypatch):
+    """Test parallel slugs are the same as serial ones, and are added to the cache."""
+    monkeypatch.setattr(rename, "SLUGIFY_CHUNK_SIZE", 2)
+    texts = [f"file 2019_08_{index:02d}" for index in range(1, 11)]
+    cache = SlugCache(100, JsonConfig(tmp_path / "cache.json"))
+    parallel = slugify_many(texts + texts[:3], jobs=2, cache=cache)
+    compare(actual=parallel, expected=slugify_many(texts))
+    assert parallel["file 2019_08_01"] == "File_2019-08-01"
+    assert (cache.hits, cache.misses) == (0, 10)
+
+
+def all_files(root: Path):
+    """All files inside a directory, relative to it."""
+    return sorted(str(path.relative_to(root)) for path in root.rglob("*") if path.is_file())
+
+
+def test_rename_plan_apply_resume_and_undo(tmp_path):
+    """Test a rename plan: nested dirs are renamed first, then files inside them; resume and undo with the journal."""
+    root = tmp_path / "root"
+    create(root / "Some Dir" / "Sub Dir" / "My File 01012019.TXT")
+    create(root / "Some Dir" / "other File.txt")
+    plan_file = tmp_path / "plan.jsonl"
+    journal_file = tmp_path / "plan.jsonl.journal"
+    runner = CliRunner()
+
+    result = runner.invoke(rename_slugify, ["--cache-size", "0", "--plan-out", str(plan_file), str(root)])
+    assert result.exit_code == 0, result.output
+    assert len(plan_file.read_text().splitlines()) == 4
+    compare(actual=all_files(root), expected=["Some Dir/Sub Dir/My File 01012019.TXT", "Some Dir/other File.txt"])
+
+    result = runner.invoke(rename_slugify, ["--apply", str(plan_file), "--dry-run"])
+    assert result.exit_code == 0, result.output
+    assert not journal_file.exists()
+
+    # Simulate a crash after the first rename
+    first_entry = json.loads(plan_file.read_text().splitlines()[0])
+    Path(first_entry["from"]).rename(first_entry["to"])
+    journal_file.write_text(json.dumps(dict(first_entry, index=0)) + "\n" + '{"index": 1, "fr')
+
+    result = runner.invoke(rename_slugify, ["--apply", str(plan_file), "--yes"])
+    assert result.exit_code == 0, result.output
+    assert "Resuming after 1 of 4 renames" in result.output
+    compare(actual=all_files(root), expected=["Some_Dir/Other_File.txt", "Some_Dir/Sub_Dir/My_File_2019-01-01.txt"])
+
+    result = runner.invoke(rename_slugify, ["--undo", str(plan_file), "--yes"])
+    assert result.exit_code == 0, result.output
+    compare(actual=all_files(root), expected=["Some Dir/Sub Dir/My File 01012019.TXT", "Some Dir/other File.txt"])
+    assert not journal_file.exists()
+
+
+def test_dir_index_skips_unchanged_dirs(tmp_path):
+    """Test the directory index: only directories that changed since the last run are listed."""
+    root = tmp_path / "root"
+    create(root / "a" / "one.txt")
+    create(root / "a" / "b" / "two.txt")
+    create(root / "c" / "three.txt")
+    config = JsonConfig(tmp_path / "index.json")
+
+    def scan(index):
+        return sorted(str(path.relative_to(root)) for path, _ in scan_tree(root, set(), index=index))
+
+    index = DirIndex("v1", config)
+    assert len(scan(index)) == 6
+    index.update(root, {})
+    index.save()
+
+    index = DirIndex("v1", config).load()
+    assert scan(index) == []
+    index.update(root, {})
+
+    create(root / "a" / "b" / "new.txt")
+    compare(actual=scan(index), expected=["a/b/new.txt", "a/b/two.txt"])
+    assert len(scan(DirIndex("v2", config).load())) == 7
+
+    # A renamed directory takes the index entries of its skipped subdirectories along
+    index = DirIndex("v1", config)
+    scan(index)
+    index.update(root, {})
+    create(root / "new.txt")
+    scan(index)
+    (root / "a").rename(root / "a2")
+    index.update(root, {root / "a": root / "a2"})
+    compare(actual=sorted(index.dirs), expected=[str(root), str(root / "a2"), str(root / "a2" / "b"), str(root / "c")])
+
+
+def test_unique_names_allocate_like_unique_file_name(tmp_path):
+    """Test names allocated in memory follow the same scheme as the ones checked on the disk."""
+    create(tmp_path / "file.txt")
+    create(tmp_path / "file_Copy1.txt")
+    create(tmp_path / "other_copy.txt")
+    unique_names = UniqueNames()
+    for name in ("file.txt", "file.txt", "file_Copy.txt", "other_copy.txt", "file.txt", "new.txt"):
+        expected = unique_file_name(tmp_path / name)
+        assert unique_names.allocate(tmp_path / name) == expected
+        create(expected)
+
+
+def test_file_mover_copies_and_unlinks(tmp_path):
+    """Test moving files with the copy, fsync and unlink pipeline."""
+    sources = []
+    for index in range(5):
+        source = tmp_path / "source" / f"file{index}.bin"
+        create(source)
+        source.write_bytes(bytes(range(256)) * 1000 * index)
+        os.utime(source, (1_000_000, 1_000_000))
+        sources.append(source)
+
+    with FileMover(jobs=2) as mover:
+        for source in sources:
+            mover.submit(source, tmp_path / source.name)
+    assert mover.files == 5
+    assert mover.bytes == 256 * 1000 * 10
+    for index, source in enumerate(sources):
+        moved = tmp_path / source.name
+        assert not source.exists()
+        assert moved.read_bytes() == bytes(range(256)) * 1000 * index
+        assert moved.stat().st_mtime == 1_000_000
+
+
+def test_file_mover_counts_finished_moves_before_an_error(tmp_path):
+    """Test that moves finished together with a failed one are still counted."""
+    mover = FileMover(jobs=8)
+    (tmp_path / "moved").mkdir()
+    for index in range(6):
+        create(tmp_path / f"file{index}.txt")
+        mover.submit(tmp_path / f"file{index}.txt", tmp_path / "moved" / f"file{index}.txt")
+    mover.submit(tmp_path / "missing.txt", tmp_path / "moved" / "missing.txt")
+    while not all(future.done() for future in mover.in_flight):
+        sleep(0.01)
+    with pytest.raises(FileNotFoundError):
+        mover.close()
+    assert mover.files == 6
+
+
+def test_merge_directories_dedupe(tmp_path, monkeypatch):
+    """Test files with the same contents as the target file (or one of its copies) are dropped."""
+    monkeypatch.setattr(files, "HASH_CACHE", JsonConfig(tmp_path / "hashes.json"))
+    target = tmp_path / "target"
+    source = tmp_path / "source"
+    for path, contents in (
+        (target / "one.txt", "same"),
+        (source / "one.txt", "same"),
+        (target / "two.txt", "target"),
+        (source / "two.txt", "source"),
+        (target / "sub" / "three.txt", "first"),
+        (target / "sub" / "three_Copy.txt", "second"),
+        (source / "sub" / "three.txt", "second"),
+    ):
+        create(path)
+        path.write_text(contents)
+
+    merge_directories(target, source, dedupe=True)
+
+    expected = ["one.txt", "sub/three.txt", "sub/three_Copy.txt", "two.txt", "two_Copy.txt"]
+    compare(actual=all_files(target), expected=expected)
+    assert all_files(source) == []
+    assert (target / "two_Copy.txt").read_text() == "source"
+    assert json.loads((tmp_path / "hashes.json").read_text())
+
+
+def test_native_sync(tmp_path):
+    """Test the native sync engine: excluded files, symlinks, newer files on the destination and --kill."""
+    src = tmp_path / "src"
+    dest = tmp_path / "dest"
+    for path in (src / "a.txt", src / "sub" / "b.txt", src / ".DS_Store", dest / "extra.txt", dest / "newer.txt"):
+        create(path)
+        path.write_text(path.name)
+    (src / "newer.txt").write_text("old contents")
+    os.utime(src / "newer.txt", (1_000_000, 1_000_000))
+    (src / "link").symlink_to("a.txt")
+
+    stats = native_sync(str(src), str(dest), [".DS_Store"], jobs=2)
+    assert (stats.files, stats.bytes, stats.deleted) == (3, len("a.txt") + len("b.txt"), 0)
+    compare(actual=all_files(dest), expected=["a.txt", "extra.txt", "link", "newer.txt", "sub/b.txt"])
+    assert (dest / "newer.txt").read_text() == "newer.txt"
+    assert os.readlink(dest / "link") == "a.txt"
+    assert (dest / "a.txt").stat().st_mtime == (src / "a.txt").stat().st_mtime
+
+    stats = native_sync(str(src), str(dest), [".DS_Store"], kill=True, dry_run=True)
+    assert (stats.files, stats.deleted) == (0, 1)
+    assert (dest / "extra.txt").exists()
+
+    stats = native_sync(str(src), str(dest), [".DS_Store"], kill=True)
+    assert (stats.files, stats.deleted) == (0, 1)
+    compare(actual=all_files(dest), expected=["a.txt", "link", "newer.txt", "sub/b.txt"])
+
+
+def test_parallel_rsync_destinations(tmp_path, monkeypatch, capsys):
+    """Test destinations synced in parallel with rsync, with progress lines and a summary per destination."""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    fake_rsync = bin_dir / "rsync"
+    fake_rsync.write_text(
+        "#!/bin/sh\n"
+        "printf 'a.txt\\n      1.00K  50%% 1.00kB/s 0:00:01\\r'\n"
+        "printf '      2.00K 100%% 1.00kB/s 0:00:02 (xfr#1, to-chk=0/2)\\ndeleting old.txt\\n'\n"
+        "printf 'sent 1,234 bytes  received 35 bytes  2.54K bytes/sec\\n'\n"
+    )
+    fake_rsync.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setattr(files, "BACKUP_MANIFEST", JsonConfig(tmp_path / "manifest.json"))
+    monkeypatch.setattr(files, "SYNC_METRICS_LOG", tmp_path / "metrics.jsonl")
+
+    src = tmp_path / "src"
+    src.mkdir()
+    destinations = [str(tmp_path / "one"), str(tmp_path / "two")]
+    sync_dir([str(src)], destinations, parallel=True, max_parallel=2)
+
+    output = capsys.readouterr().out
+    for dest in destinations:
+        assert f"[{dest}] a.txt" in output
+        assert f"[{dest}] sent 1,234 bytes" in output
+        assert (
+            f"\n{dest}: 1 files ({files.human_size(2000)}) copied, 1 deleted"
+            in output.split("Summary per destination")[1]
+        )
+    assert parse_rsync_number("2.54K") == 2540
+
+    metrics = [json.loads(line) for line in (tmp_path / "metrics.jsonl").read_text().splitlines()]
+    compare(
+        actual=sorted((record["destination"], record["files"], record["bytes"], record["sent"]) for record in metrics),
+        expected=[(files.backup_destination(str(src), dest), 1, 2000, 1234) for dest in destinations],
+    )
+
+
+def test_parallel_rsync_destination_failure(tmp_path, monkeypatch, capsys):
+    """Test that a failed destination is marked in the summary and makes the sync fail."""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    fake_rsync = bin_dir / "rsync"
+    fake_rsync.write_text('#!/bin/sh\ncase "$*" in *broken*) echo "rsync error" && exit 23;; esac\n')
+    fake_rsync.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{bin_dir}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setattr(files, "BACKUP_MANIFEST", JsonConfig(tmp_path / "manifest.json"))
+    monkeypatch.setattr(files, "SYNC_METRICS_LOG", tmp_path / "metrics.jsonl")
+
+    src = tmp_path / "src"
+    src.mkdir()
+    good, broken = str(tmp_path / "good"), str(tmp_path / "broken")
+    with pytest.raises(click.ClickException, match=f"1 destination\\(s\\): {broken}$"):
+        sync_dir([str(src)], [good, broken], parallel=True)
+
+    summary = capsys.readouterr().out.split("Summary per destination")[1]
+    assert f"\n{good}: 0 files" in summary
+    assert f"\n{broken}: [FAILED] 0 files" in summary
+
+    # Serial syncs keep going after a failure, then fail too
+    with pytest.raises(
+        click.ClickException, match=f"1 directory\\(ies\\): {files.backup_destination(str(src), broken)}$"
+    ):
+        sync_dir([str(src)], [broken, good])
+    assert f"{files.backup_destination(str(src), good)}/\n" in capsys.readouterr().out
+
+
+def test_backup_manifest_skips_unchanged_dirs(tmp_path, monkeypatch, capsys):
+    """Test that directories unchanged since the last sync are skipped, unless they changed on either side."""
+    monkeypatch.setattr(files, "BACKUP_MANIFEST", JsonConfig(tmp_path / "manifest.json"))
+    monkeypatch.setattr(files, "SYNC_METRICS_LOG", tmp_path / "metrics.jsonl")
+    src = tmp_path / "pictures"
+    backup = tmp_path / "backup"
+    for path in (src / "2019" / "a.jpg", src / "2020" / "b.jpg", src / "root.txt"):
+        create(path)
+    dest = Path(files.backup_destination(str(src), str(backup)))
+
+    sync_dir([str(src)], [str(backup)], engine="native")
+    compare(actual=all_files(dest), expected=["2019/a.jpg", "2020/b.jpg", "root.txt"])
+    assert "Skipping" not in capsys.readouterr().out
+
+    (src / "2020" / "c.jpg").write_text("new")
+    (dest / "2019" / "a.jpg").unlink()
+    sync_dir([str(src)], [str(backup)], engine="native")
+    assert "Skipping" not in capsys.readouterr().out
+    compare(actual=all_files(dest), expected=["2019/a.jpg", "2020/b.jpg", "2020/c.jpg", "root.txt"])
+
+    sync_dir([str(src)], [str(backup)], engine="native")
+    assert "Skipping 2 unchanged directories" in capsys.readouterr().out
+    (dest / "2019" / "a.jpg").write_text("corrupted")
+    sync_dir([str(src)], [str(backup)], engine="native")
+    assert "Skipping 1 unchanged directories" in capsys.readouterr().out
+    assert (dest / "2019" / "a.jpg").read_text() == (src / "2019" / "a.jpg").read_text()
+
+    shutil.rmtree(dest / "2020")
+    sync_dir([str(src)], [str(backup)], engine="native")
+    assert "Skipping 1 unchanged directories" in capsys.readouterr().out
+    compare(actual=all_files(dest), expected=["2019/a.jpg", "2020/b.jpg", "2020/c.jpg", "root.txt"])
+
+    summarized = []
+    summarize = files.BackupManifest.summarize
+
+    def spy_summarize(src_dir, exclude, names=None):
+        summarized.append(src_dir)
+        return summarize(src_dir, exclude, names)
+
+    monkeypatch.setattr(files.BackupManifest, "summarize", staticmethod(spy_summarize))
+    sync_dir([str(src)], [str(backup), str(tmp_path / "other")], engine="native")
+    assert summarized.count(str(src)) == 1
+
+
+def test_executable_resolver(tmp_path, monkeypatch):
+    """Test executables found on the PATH, cached in memory and on disk until a PATH directory changes."""
+    bin_dir = tmp_path / "bin"
+    bin_dir.mkdir()
+    tool = bin_dir / "tool"
+    tool.write_text("#!/bin/sh\n")
+    tool.chmod(0o755)
+    monkeypatch.setenv("PATH", str(bin_dir))
+    config = JsonConfig(tmp_path / "executables.json")
+
+    resolver = ExecutableResolver(config)
+    assert resolver.which("tool") == str(tool)
+    assert resolver.which("other") == ""
+
+    other = bin_dir / "other"
+    other.write_text("#!/bin/sh\n")
+    other.chmod(0o755)
+    # Same process: the missing executable is memoised
+    assert resolver.which("other") == ""
+
+    # New process: the PATH directory changed, so the cache file is discarded
+    os.utime(bin_dir, ns=(1, 1))
+    resolver = ExecutableResolver(config)
+    assert resolver.which("other") == str(other)
+    assert resolver.which("tool") == str(tool)
+
+    # New process with the same PATH: executables come from the cache file
+    monkeypatch.setattr(shutil, "which", lambda *args, **kwargs: None)
+    assert ExecutableResolver(config).which("tool") == str(tool)
+    assert ExecutableResolver(config).which("other") == str(other)
+
+
+def test_find_paths_and_rm_broken_symlinks(tmp_path):
+    """Test the native finder with names, types and broken links; then remove the broken links."""
+    for path in (
+        tmp_path / "a" / "docker-compose.yml",
+        tmp_path / "a" / "b" / "docker-compose.yml",
+        tmp_path / "c.txt",
+    ):
+        create(path)
+    (tmp_path / "a" / "ok").symlink_to(tmp_path / "c.txt")
+    (tmp_path / "a" / "b" / "broken").symlink_to(tmp_path / "missing")
+    (tmp_path / "loop").symlink_to(tmp_path / "loop")
+
+    def relative(paths):
+        return sorted(str(Path(path).relative_to(tmp_path)) for path in paths)
+
+    compare(
+        actual=relative(find_paths(tmp_path, name="docker-compose.yml")),
+        expected=["a/b/docker-compose.yml", "a/docker-compose.yml"],
+    )
+    compare(actual=relative(find_paths(tmp_path / "a", type_="dl")), expected=["a/b", "a/b/broken", "a/ok"])
+    compare(actual=relative(find_paths(tmp_path, name=["*.txt", "o*"], type_="f")), expected=["c.txt"])
+    compare(actual=relative(find_paths(tmp_path, broken_links=True)), expected=["a/b/broken", "loop"])
+    compare(
+        actual=relative(find_paths(tmp_path / "a", tmp_path / "c.txt", type_="f", jobs=3)),
+        expected=["a/b/docker-compose.yml", "a/docker-compose.yml"],
+    )
+
+    result = CliRunner().invoke(rm_broken_symlinks, ["--dry-run", str(tmp_path)])
+    assert result.exit_code == 0
+    assert (tmp_path / "loop").is_symlink()
+
+    result = CliRunner().invoke(rm_broken_symlinks, ["--jobs", "2", str(tmp_path)], input="y\n")
+    assert result.exit_code == 0, result.output
+    assert "2 broken symlinks removed" in result.output
+    compare(actual=relative(find_paths(tmp_path, type_="l")), expected=["a/ok"])
+
+
+def test_wait_for_process():
+    """Test waiting for PIDs and process names, with a timeout."""
+    quick = subprocess.Popen([sys.executable, "-c", "import time; time.sleep(0.2)"])
+    slow = subprocess.Popen(["sleep", "30"])
+    try:
+        # The child is named after the parent until it runs the new executable
+        deadline = monotonic() + 5
+        while slow.pid not in find_pids("sleep") and monotonic() < deadline:
+            sleep(0.01)
+        assert slow.pid in find_pids("sleep")
+        assert os.getpid() not in find_pids(Path("/proc/self/comm").read_text().rstrip("\n"))
+        assert not wait_for_process(quick.pid, "sleep", timeout=0.5)
+        assert wait_for_process(quick.pid, timeout=5)
+        assert wait_for_process(999_999_999)
+    finally:
+        slow.kill()
+        quick.wait()
+    assert wait_for_process(slow.pid, timeout=5)
+    slow.wait()
+
+
+def test_fzf_streams_items(tmp_path, monkeypatch):
+    """Test items streamed to fzf, with quotes, and with fzf exiting before reading all of them."""
+    fake_fzf = tmp_path / "fzf"
+    fake_fzf.write_text('#!/bin/sh\necho "$@" > "$(dirname "$0")/args"\nhead -n 1 | tee "$(dirname "$0")/selected"\n')
+    fake_fzf.chmod(0o755)
+    monkeypatch.setenv("PATH", f"{tmp_path}{os.pathsep}{os.environ['PATH']}")
+
+    assert fzf(['it\'s "quoted"', "other"], query="two words") == 'it\'s "quoted"'
+    assert "--query=two words --select-1 --exit-0" in (tmp_path / "args").read_text()
+    assert fzf(["a", "b"], reverse=True, height="4", layout=["--cycle"]) == "a"
+    assert (tmp_path / "args").read_text() == "--height=4 --cycle --tac\n"
+    assert fzf(f"item {number}" for number in range(1_000_000)) == "item 0"
+    assert fzf([]) is None
+
+    def stalled_items():
+        """Yield an item, then stall until fzf has received it."""
+        yield "first"
+        deadline = monotonic() + 5
+        while monotonic() < deadline and not (tmp_path / "selected").read_text():
+            sleep(0.01)
+        received.append((tmp_path / "selected").read_text())
+        yield "second"
+
+    received: List[str] = []
+    (tmp_path / "selected").write_text("")
+    assert fzf(stalled_items()) == "first"
+    assert received == ["first\n"]